@@ -12,6 +12,7 @@ from handlers.scores_handler import ScoresHandler
 from handlers.score_flashcards_handler import ScoreFlashcardsHandler
 from handlers.unittest_handler import UnittestHandler
 from handlers.priorities_handler import JSONPrioritiesHandler
+from z3b import model
 
 
 routes = [
@@ -42,4 +43,16 @@ routes = [
     (r'/json/interpret2', JSONExploreHandler),
 ]
 
-app = webapp2.WSGIApplication(routes, debug=True)
+
+# The handlers use z3b Histories directly, so (unlike Bidder and Interpreter)
+# they don't take the main z3 Context for themselves.  Holding it for the
+# whole request also means the request's z3 objects are freed under it.
+# See z3b.bidder.use_thread_contexts.
+def _holding_main_context_lock(wsgi_app):
+    def locked_app(environ, start_response):
+        with model.main_context_lock:
+            return wsgi_app(environ, start_response)
+    return locked_app
+
+
+app = _holding_main_context_lock(webapp2.WSGIApplication(routes, debug=True))
@@ -3,7 +3,6 @@
 # found in the LICENSE file.
 
 import json
-import networkx.readwrite.json_graph
 import webapp2
 from z3b.rules import Rule
 from z3b.sayc import StandardAmericanYellowCard
@@ -11,7 +10,10 @@ from z3b.sayc import StandardAmericanYellowCard
 
 class JSONPrioritiesHandler(webapp2.RequestHandler):
     def get(self):
-        graph = StandardAmericanYellowCard.priority_ordering.ordering._graph
+        # networkx is slow to import and only this debugging handler needs it.
+        import networkx
+        import networkx.readwrite.json_graph
+        graph = networkx.DiGraph(list(StandardAmericanYellowCard.priority_ordering.ordering.edges()))
         link_data = networkx.readwrite.json_graph.node_link_data(graph)
 
         # Many priority objects aren't json serializable so just repr everything for now.
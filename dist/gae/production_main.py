@@ -1,10 +1,14 @@
 from cherrypy import wsgiserver
 import standalone_app
+import z3b.bidder
+
+# Each server thread solves in a z3 Context of its own.
+z3b.bidder.use_thread_contexts()
 
 server = wsgiserver.CherryPyWSGIServer(
         ('localhost', 8080),
         standalone_app.app,
-        numthreads=1 # z3 does not play nice with threads.
+        numthreads=4
     )
 try:
     print "Starting..."
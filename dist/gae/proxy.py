@@ -13,6 +13,8 @@ class ConstraintsSerializer(object):
     EMPTY_HCP_RANGE = (0, MAX_HCP_PER_HAND)
 
     def __init__(self, position_view):
+        # We need every bound, which is much cheaper to solve for all at once.
+        position_view.solve_all_bounds()
         self._hcp_range = (position_view.min_points, position_view.max_points)
         self._suit_length_ranges = [(position_view.min_length(suit), position_view.max_length(suit)) for suit in SUITS]
 
@@ -155,8 +155,13 @@ class CallHistory(object):
     def copy_appending_call(self, call):
         assert call
         assert self.is_legal_call(call)
-        new_call_history = copy.deepcopy(self)
-        new_call_history.calls.append(call)
+        return self.copy_with_calls_appended([call])
+
+    # Dealer, Vulnerability and Call objects are never modified, so a shallow
+    # copy with a fresh calls list is as good as a deepcopy and much cheaper.
+    def copy_with_calls_appended(self, calls):
+        new_call_history = copy.copy(self)
+        new_call_history.calls = self.calls + calls
         return new_call_history
 
     def copy_with_partial_history(self, last_entry):
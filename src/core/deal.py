@@ -5,13 +5,19 @@
 from position import *
 from suit import Suit, SUITS
 from card import Card
-from hand import Hand
+from hand import Hand, CompactHand
 from core.callhistory import CallHistory
 
 import random
 
 import json
 
+try:
+    import numpy
+except ImportError:
+    # Only DealArray needs numpy.
+    numpy = None
+
 
 class Deal(object):
     def __init__(self, hands):
@@ -31,14 +37,12 @@ class Deal(object):
         # and use from_identifier.  Howver our current identifier
         # space is not compact.  We can generate identifiers
         # which are not valid deals.
-        hands = cls._empty_hands()
+        card_masks = [0 for position in POSITIONS]
         shuffled_cards = range(52)
         random.shuffle(shuffled_cards)
         for index_in_deck, card_identifier in enumerate(shuffled_cards):
-            position = index_in_deck % len(POSITIONS)
-            suit, card = Card.suit_and_value_from_identifier(card_identifier)
-            hands[position][suit.index] += card
-        return Deal(map(Hand, hands))
+            card_masks[index_in_deck % len(POSITIONS)] |= 1 << card_identifier
+        return Deal(map(CompactHand, card_masks))
 
     @classmethod
     def from_string(cls, string):
@@ -133,3 +137,78 @@ class Deal(object):
                     assert card_identifier not in all_cards, ("Already seen %s" % Card.card_name(suit, card))
                     all_cards.add(card_identifier)
         assert len(all_cards) == 52
+
+
+# Many deals at once, as a (count, 52) numpy array holding the position index
+# each card identifier was dealt to.  Features are computed for every deal in
+# a handful of array operations, and Deal objects are only built on demand,
+# so statistics over millions of deals don't pay for millions of Hands.
+class DealArray(object):
+    _hex_chars = '0123456789abcdef'
+    _chunk_size = 65536
+
+    def __init__(self, positions_for_cards):
+        assert numpy, "DealArray requires numpy"
+        self.positions_for_cards = positions_for_cards
+
+    @classmethod
+    def random(cls, count, random_state=None):
+        assert numpy, "DealArray requires numpy"
+        random_state = random_state or numpy.random
+        positions_for_cards = numpy.empty((count, 52), dtype=numpy.int8)
+        # Shuffling in chunks bounds the size of the float and index arrays.
+        for start in xrange(0, count, cls._chunk_size):
+            chunk = positions_for_cards[start:start + cls._chunk_size]
+            # Sorting random keys shuffles each row.  The first 13 places in
+            # the shuffled deck go to the first position, and so on.
+            deck_places = numpy.argsort(random_state.random_sample(chunk.shape), axis=1)
+            chunk[:] = deck_places // 13
+        return cls(positions_for_cards)
+
+    def __len__(self):
+        return len(self.positions_for_cards)
+
+    def __getitem__(self, index):
+        return self.deal(index)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self.deal(index)
+
+    def _cards_held_by(self, position):
+        return self.positions_for_cards == position.index
+
+    def deal(self, index):
+        card_bits = numpy.left_shift(numpy.uint64(1), numpy.arange(52, dtype=numpy.uint64))
+        held_cards = self.positions_for_cards[index]
+        return Deal([CompactHand(int(card_bits[held_cards == position.index].sum())) for position in POSITIONS])
+
+    # (count, positions, suits) lengths, with suits in SUITS order.
+    def suit_lengths(self):
+        lengths = numpy.empty((len(self), len(POSITIONS), len(SUITS)), dtype=numpy.int8)
+        for position in POSITIONS:
+            lengths[:, position.index, :] = self._cards_held_by(position).reshape(len(self), len(SUITS), 13).sum(axis=2)
+        return lengths
+
+    # (count, positions)
+    def high_card_points(self):
+        card_points = numpy.tile([Card.high_card_points(Card.card_for_index(index)) for index in range(13)], len(SUITS))
+        points = numpy.empty((len(self), len(POSITIONS)), dtype=numpy.int8)
+        for position in POSITIONS:
+            points[:, position.index] = self._cards_held_by(position).dot(card_points)
+        return points
+
+    # (count, positions), matching Hand.is_balanced.
+    def is_balanced(self, suit_lengths=None):
+        if suit_lengths is None:
+            suit_lengths = self.suit_lengths()
+        no_long_or_short_suits = ((suit_lengths >= 2) & (suit_lengths <= 5)).all(axis=2)
+        return no_long_or_short_suits & ((suit_lengths == 2).sum(axis=2) < 2)
+
+    # The same hex strings as Deal.identifier.
+    def identifiers(self):
+        hex_indices = self.positions_for_cards[:, 0::2] * 4 + self.positions_for_cards[:, 1::2]
+        hex_chars = numpy.array(list(self._hex_chars), dtype='S1')[hex_indices]
+        # Each row's 26 one-character strings viewed as a single string.
+        return hex_chars.view('S26').ravel().tolist()
+
@@ -10,24 +10,11 @@ from suit import *
 from card import Card
 
 
-class Hand(object):
-    def __init__(self, cards_by_suit):
-        hand_sorter = lambda cards: "".join(sorted(cards, key=Card.index_for_card, reverse=True))
-        self.cards_by_suit_index = map(hand_sorter, map(str.upper, cards_by_suit))
-        self._validate()
-
-    @classmethod
-    def random(cls):
-        shuffled_cards = range(52)
-        random.shuffle(shuffled_cards)
-        cards_by_suit_index = ["" for suit in SUITS]
-        for card_identifier in shuffled_cards[:13]:
-            suit, card = Card.suit_and_value_from_identifier(card_identifier)
-            cards_by_suit_index[suit.index] += card
-        return Hand(cards_by_suit_index)
-
-    def _validate(self):
-        assert sum(map(lambda suit: self.length_of_suit(suit), SUITS)) == 13, self.cards_by_suit_index
+# Hand evaluation which only looks at the cards through cards_in_suit,
+# length_of_suit, suit_lengths and high_card_points, shared by Hand and
+# CompactHand.
+class HandBase(object):
+    __slots__ = ()
 
     # This is also referred to as "pbn notation": http://www.tistis.nl/pbn/
     # "The cards of each hand are given in the order:  spades, hearts, diamonds, clubs."
@@ -39,23 +26,6 @@ class Hand(object):
     def cdhs_dot_string(self):
         return '.'.join(map(self.cards_in_suit, (CLUBS, DIAMONDS, HEARTS, SPADES)))
 
-    def play_card(self, suit, card_value):
-        assert card_value in self.cards_by_suit_index[suit.index]
-        self.cards_by_suit_index[suit.index] = self.cards_by_suit_index[suit.index].replace(card_value, '')
-
-    @classmethod
-    def from_cdhs_string(cls, string):
-        return Hand(string.split('.'))
-
-    def high_card_points(self):
-        return sum(map(Card.high_card_points, itertools.chain(*self.cards_by_suit_index)))
-
-    def hcp_in_suit(self, suit):
-        return sum(map(Card.high_card_points, self.cards_by_suit_index[suit.index]))
-
-    def cards_in_suit(self, suit):
-        return self.cards_by_suit_index[suit.index]
-
     def high_card_in_suit(self, suit):
         # FIXME: It's possible we could just return self.cards_in_suit(suit)[0], depending on what cards_in_suit guarantees.
         return sorted(self.cards_in_suit(suit), key=Card.index_for_card)[-1]
@@ -102,9 +72,6 @@ class Hand(object):
             return self.high_card_in_suit(suit) in "AKQJT"
         return self.has_third_round_stopper(suit)
 
-    def length_of_suit(self, suit):
-        return len(self.cards_by_suit_index[suit.index])
-
     def is_longest_suit(self, suit, except_suits=None):
         except_suits = except_suits or ()
         if suit in except_suits:
@@ -117,12 +84,9 @@ class Hand(object):
                 return False
         return True
 
-    def suit_lengths(self):
-        return map(len, self.cards_by_suit_index)
-
     def longest_suits(self):
         longest_suit_length = max(self.suit_lengths())
-        return filter(lambda suit: len(self.cards_by_suit_index[suit.index]) == longest_suit_length, SUITS)
+        return filter(lambda suit: self.length_of_suit(suit) == longest_suit_length, SUITS)
 
     def length_points(self):
         # FIXME: Should length_points return high_card_points() - 1 for a flat hand?
@@ -133,7 +97,7 @@ class Hand(object):
         slow_winners = 0
         have_seen_loser = False
 
-        cards_in_hand = self.cards_by_suit_index[suit.index]
+        cards_in_hand = self.cards_in_suit(suit)
         for card_index in reversed(range(13)):
             card = Card.card_for_index(card_index)
             if card not in cards_in_hand:
@@ -173,14 +137,14 @@ class Hand(object):
     # For this value to be useful, it needs to be compared against the "control-neutral" table
     # http://en.wikipedia.org/wiki/Hand_evaluation#Control_count
     def control_count(self):
-        return sum(map(Card.control_count, itertools.chain(*self.cards_by_suit_index)))
+        return sum(map(Card.control_count, itertools.chain(*map(self.cards_in_suit, SUITS))))
 
     # FIXME: We shouldn't discount non-working honors for suits that partner has bid (or at least shown stoppers in).
     def _support_point_adjustment_for_non_working_honors(self, trump):
         # We'll overbid if we count holdings like 'K' or 'Qx' for both HCPs and support points.
         point_adjustment = 0
         for suit in SUITS:
-            cards = self.cards_by_suit_index[suit.index]
+            cards = self.cards_in_suit(suit)
             if suit == trump or len(cards) not in (1, 2):
                 continue
             if len(cards) == 1:
@@ -222,11 +186,175 @@ class Hand(object):
                 doubletons += 1
         return doubletons < 2
 
+    # Returns 0 or 1 for each of the A, K, Q, J and T.
+    def honors_in_suit(self, suit):
+        cards = self.cards_in_suit(suit)
+        return tuple(int(card in cards) for card in 'AKQJT')
+
+    # The number of voids, singletons and doubletons.
+    def shortness_counts(self):
+        lengths = self.suit_lengths()
+        return lengths.count(0), lengths.count(1), lengths.count(2)
+
     def is_flat(self):
         return sorted(self.suit_lengths()) == [3, 3, 3, 4]
 
+    def pretty_one_line(self):
+        return "%s (hcp: %s lp: %s sp: %s)" % (self.cdhs_dot_string(), self.high_card_points(), self.length_points(), self.generic_support_points())
+
+
+class Hand(HandBase):
+    def __init__(self, cards_by_suit):
+        hand_sorter = lambda cards: "".join(sorted(cards, key=Card.index_for_card, reverse=True))
+        self.cards_by_suit_index = map(hand_sorter, map(str.upper, cards_by_suit))
+        self._validate()
+
+    @classmethod
+    def random(cls):
+        shuffled_cards = range(52)
+        random.shuffle(shuffled_cards)
+        cards_by_suit_index = ["" for suit in SUITS]
+        for card_identifier in shuffled_cards[:13]:
+            suit, card = Card.suit_and_value_from_identifier(card_identifier)
+            cards_by_suit_index[suit.index] += card
+        return Hand(cards_by_suit_index)
+
+    def _validate(self):
+        assert sum(map(lambda suit: self.length_of_suit(suit), SUITS)) == 13, self.cards_by_suit_index
+
+    def play_card(self, suit, card_value):
+        assert card_value in self.cards_by_suit_index[suit.index]
+        self.cards_by_suit_index[suit.index] = self.cards_by_suit_index[suit.index].replace(card_value, '')
+
+    @classmethod
+    def from_cdhs_string(cls, string):
+        return Hand(string.split('.'))
+
+    def high_card_points(self):
+        return sum(map(Card.high_card_points, itertools.chain(*self.cards_by_suit_index)))
+
+    def hcp_in_suit(self, suit):
+        return sum(map(Card.high_card_points, self.cards_by_suit_index[suit.index]))
+
+    def cards_in_suit(self, suit):
+        return self.cards_by_suit_index[suit.index]
+
+    def length_of_suit(self, suit):
+        return len(self.cards_by_suit_index[suit.index])
+
+    def suit_lengths(self):
+        return map(len, self.cards_by_suit_index)
+
     def __repr__(self):
         return "Hand(%s)" % self.cards_by_suit_index
 
-    def pretty_one_line(self):
-        return "%s (hcp: %s lp: %s sp: %s)" % (self.cdhs_dot_string(), self.high_card_points(), self.length_points(), self.generic_support_points())
+
+# Tables indexed by the 13 bits of a single suit in a CompactHand's card_mask.
+_length_for_suit_bits = [bin(suit_bits).count('1') for suit_bits in range(1 << 13)]
+# The honors are the top five bits, and only the top four score points.
+_honors_for_suit_bits_above_nine = [tuple((honor_bits >> shift) & 1 for shift in (4, 3, 2, 1, 0)) for honor_bits in range(1 << 5)]
+_hcp_for_suit_bits_above_ten = [sum(Card.high_card_points(Card.card_for_index(9 + index)) for index in range(4) if (point_bits >> index) & 1) for point_bits in range(1 << 4)]
+
+
+# A Hand stored as a 52-bit mask of Card identifiers, for bulk simulations
+# which build and evaluate far more hands than they ever print.  Features
+# are computed the first time they're asked for and then cached.
+class CompactHand(HandBase):
+    __slots__ = ('card_mask', '_suit_lengths', '_high_card_points', '_cards_by_suit_index', '_shortness_counts')
+
+    def __init__(self, card_mask):
+        self.card_mask = card_mask
+        self._clear_features()
+        self._validate()
+
+    # Without these, pickle can't handle __slots__ (at least with protocols
+    # 0 and 1, which Board and Deal get by default).  The cached features
+    # are cheap to recompute.
+    def __getstate__(self):
+        return self.card_mask
+
+    def __setstate__(self, card_mask):
+        self.card_mask = card_mask
+        self._clear_features()
+
+    def _clear_features(self):
+        self._suit_lengths = None
+        self._high_card_points = None
+        self._cards_by_suit_index = None
+        self._shortness_counts = None
+
+    @classmethod
+    def from_cards_by_suit(cls, cards_by_suit):
+        card_mask = 0
+        for suit, cards in zip(SUITS, cards_by_suit):
+            for card in cards.upper():
+                card_mask |= 1 << Card.identifier_for_card(suit, card)
+        return CompactHand(card_mask)
+
+    @classmethod
+    def from_hand(cls, hand):
+        return cls.from_cards_by_suit(hand.cards_by_suit_index)
+
+    @classmethod
+    def from_cdhs_string(cls, string):
+        return cls.from_cards_by_suit(string.split('.'))
+
+    @classmethod
+    def random(cls):
+        card_mask = 0
+        for card_identifier in random.sample(xrange(52), 13):
+            card_mask |= 1 << card_identifier
+        return CompactHand(card_mask)
+
+    def _validate(self):
+        assert sum(self.suit_lengths()) == 13, self.cdhs_dot_string()
+
+    def _suit_bits(self, suit):
+        return (self.card_mask >> (suit.index * 13)) & 0x1fff
+
+    def play_card(self, suit, card_value):
+        card_bit = 1 << Card.identifier_for_card(suit, card_value)
+        assert self.card_mask & card_bit
+        self.card_mask &= ~card_bit
+        self._clear_features()
+
+    @property
+    def cards_by_suit_index(self):
+        if self._cards_by_suit_index is None:
+            self._cards_by_suit_index = tuple(map(self._cards_for_suit_bits, map(self._suit_bits, SUITS)))
+        return self._cards_by_suit_index
+
+    @classmethod
+    def _cards_for_suit_bits(cls, suit_bits):
+        return "".join(Card.card_for_index(index) for index in reversed(range(13)) if (suit_bits >> index) & 1)
+
+    def cards_in_suit(self, suit):
+        return self.cards_by_suit_index[suit.index]
+
+    def length_of_suit(self, suit):
+        return self.suit_lengths()[suit.index]
+
+    def suit_lengths(self):
+        if self._suit_lengths is None:
+            self._suit_lengths = [_length_for_suit_bits[self._suit_bits(suit)] for suit in SUITS]
+        # Hand returns a fresh list, so callers may modify it.
+        return list(self._suit_lengths)
+
+    def high_card_points(self):
+        if self._high_card_points is None:
+            self._high_card_points = sum(map(self.hcp_in_suit, SUITS))
+        return self._high_card_points
+
+    def hcp_in_suit(self, suit):
+        return _hcp_for_suit_bits_above_ten[self._suit_bits(suit) >> 9]
+
+    def honors_in_suit(self, suit):
+        return _honors_for_suit_bits_above_nine[self._suit_bits(suit) >> 8]
+
+    def shortness_counts(self):
+        if self._shortness_counts is None:
+            self._shortness_counts = HandBase.shortness_counts(self)
+        return self._shortness_counts
+
+    def __repr__(self):
+        return "CompactHand(%s)" % self.cdhs_dot_string()
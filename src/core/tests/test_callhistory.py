@@ -89,6 +89,14 @@ class CallHistoryTest(unittest2.TestCase):
         self.assertEquals(len(history.calls), 6)
         self.assertEquals(len(partial_history.calls), 4)
 
+    def test_copy_appending_call(self):
+        history = CallHistory.from_string("P 1N", 'E', 'N-S')
+        new_history = history.copy_appending_call(Call.from_string('P'))
+        self.assertEquals(history.calls_string(), "P 1N")
+        self.assertEquals(new_history.calls_string(), "P 1N P")
+        self.assertEquals(new_history.dealer, EAST)
+        self.assertEquals(new_history.vulnerability.name, 'N-S')
+
     def _assert_competative_auction(self, history_string, is_competative):
         self.assertEquals(CallHistory.from_string(history_string).competative_auction(), is_competative)
 
@@ -3,7 +3,9 @@
 # found in the LICENSE file.
 
 import unittest2
-from core.deal import Deal
+from core.deal import Deal, DealArray, numpy
+from core.position import POSITIONS
+from core.suit import SUITS
 
 
 class DealTest(unittest2.TestCase):
@@ -17,5 +19,29 @@ class DealTest(unittest2.TestCase):
         self.assertTrue(bool(Deal.random()))
 
 
+@unittest2.skipUnless(numpy, "DealArray requires numpy")
+class DealArrayTest(unittest2.TestCase):
+    def test_features_match_deals(self):
+        deals = DealArray.random(50, numpy.random.RandomState(1))
+        suit_lengths = deals.suit_lengths()
+        high_card_points = deals.high_card_points()
+        is_balanced = deals.is_balanced()
+        identifiers = deals.identifiers()
+        for index, deal in enumerate(deals):
+            self.assertEquals(identifiers[index], deal.identifier)
+            for position in POSITIONS:
+                hand = deal.hand_for(position)
+                self.assertEquals(list(suit_lengths[index, position.index]), hand.suit_lengths())
+                self.assertEquals(high_card_points[index, position.index], hand.high_card_points())
+                self.assertEquals(is_balanced[index, position.index], hand.is_balanced())
+
+    def test_one_suit_each(self):
+        deal = Deal.from_string("23456789TJQKA... .23456789TJQKA.. ..23456789TJQKA. ...23456789TJQKA")
+        # North holds every club, East every diamond, and so on.
+        deals = DealArray(numpy.array([[card / 13 for card in range(52)]], dtype=numpy.int8))
+        self.assertEquals(deals.identifiers(), [deal.identifier])
+        self.assertEquals(deals[0].pretty_one_line(), deal.pretty_one_line())
+
+
 if __name__ == '__main__':
     unittest2.main()
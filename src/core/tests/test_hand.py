@@ -2,8 +2,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import pickle
 import unittest2
-from core.hand import Hand
+from core.board import Board
+from core.deal import Deal
+from core.hand import Hand, CompactHand
 from core.suit import *
 
 
@@ -80,5 +83,56 @@ class HandTest(unittest2.TestCase):
         self.assertEquals(hand.shdc_dot_string(), "54.J9743.J.AKJ52")
 
 
+class CompactHandTest(unittest2.TestCase):
+    def _assert_matches_hand(self, hand_string):
+        hand = Hand.from_cdhs_string(hand_string)
+        compact_hand = CompactHand.from_cdhs_string(hand_string)
+        self.assertEquals(compact_hand.cdhs_dot_string(), hand.cdhs_dot_string())
+        self.assertEquals(compact_hand.suit_lengths(), hand.suit_lengths())
+        self.assertEquals(compact_hand.high_card_points(), hand.high_card_points())
+        self.assertEquals(compact_hand.shortness_counts(), hand.shortness_counts())
+        self.assertEquals(compact_hand.is_balanced(), hand.is_balanced())
+        self.assertEquals(compact_hand.generic_support_points(), hand.generic_support_points())
+        self.assertEquals(compact_hand.control_count(), hand.control_count())
+        for suit in SUITS:
+            self.assertEquals(compact_hand.hcp_in_suit(suit), hand.hcp_in_suit(suit))
+            self.assertEquals(compact_hand.honors_in_suit(suit), hand.honors_in_suit(suit))
+            self.assertEquals(compact_hand.support_points(suit), hand.support_points(suit))
+            self.assertEquals(compact_hand._runnability(suit), hand._runnability(suit))
+
+    def test_matches_hand(self):
+        self._assert_matches_hand("AKJ52.J.J9743.54")
+        self._assert_matches_hand("AKJ52..J9743.J54")
+        self._assert_matches_hand("732.Q32.AJ8.AKJ9")
+        self._assert_matches_hand("23456789TJQKA...")
+        for _ in range(20):
+            self._assert_matches_hand(CompactHand.random().cdhs_dot_string())
+
+    def test_play_card(self):
+        hand = CompactHand.from_cdhs_string("AKJ52.J.J9743.54")
+        self.assertEquals(hand.high_card_points(), 10)
+        hand.play_card(CLUBS, 'A')
+        self.assertEquals(hand.cards_in_suit(CLUBS), "KJ52")
+        self.assertEquals(hand.high_card_points(), 6)
+
+    def test_pickle(self):
+        hand = CompactHand.from_cdhs_string("AKJ52.J.J9743.54")
+        hand.high_card_points()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(hand, protocol))
+            self.assertEquals(unpickled.cdhs_dot_string(), hand.cdhs_dot_string())
+            self.assertEquals(unpickled.high_card_points(), 10)
+        # Played hands no longer hold 13 cards.
+        hand.play_card(CLUBS, 'A')
+        self.assertEquals(pickle.loads(pickle.dumps(hand)).cards_in_suit(CLUBS), "KJ52")
+
+    def test_pickle_random_deal(self):
+        deal = Deal.random()
+        unpickled = pickle.loads(pickle.dumps(deal))
+        self.assertEquals(unpickled.identifier, deal.identifier)
+        board = Board.random()
+        self.assertEquals(pickle.loads(pickle.dumps(board)).identifier, board.identifier)
+
+
 if __name__ == '__main__':
     unittest2.main()
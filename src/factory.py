@@ -17,6 +17,22 @@ class BidderFactory(object):
 
     @classmethod
     def configure_from_args(cls, args):
+        # -e keeps the z3b bidder, but answers its questions with
+        # z3b.enumerator rather than z3.
+        if '-e' in args:
+            z3b.bidder.use_enumerator()
+            args = [arg for arg in args if arg != '-e']
+        # --interpretation-cache=PATH keeps interpretations in an sqlite
+        # file at PATH, see z3b.interpretation_cache.
+        for arg in args:
+            if arg.startswith('--interpretation-cache='):
+                z3b.bidder.use_interpretation_cache(arg.split('=', 1)[1])
+        args = [arg for arg in args if not arg.startswith('--interpretation-cache=')]
+        # --solver=NAME picks one of z3b.model.solver_configurations.
+        for arg in args:
+            if arg.startswith('--solver='):
+                z3b.bidder.use_solver_configuration(arg.split('=', 1)[1])
+        args = [arg for arg in args if not arg.startswith('--solver=')]
         bidders_by_flag = {
             '-g' : gib.Gib,
             '-z' : z3b.bidder.Bidder,
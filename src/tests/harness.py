@@ -2,10 +2,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import functools
 import itertools
 import logging
 import multiprocessing
 import sys
+import time
 import traceback
 import unittest2
 
@@ -14,7 +16,7 @@ from core.callhistory import CallHistory, Vulnerability
 from core.hand import Hand
 from factory import BidderFactory
 from third_party import outputcapture
-from tests import test_sayc
+from tests import results_cache, test_sayc
 
 
 _log = logging.getLogger(__name__)
@@ -156,6 +158,16 @@ class ResultsAggregator(object):
         self._total_failures += fail_count
         print "Pass %s of %s hands" % (len(group.tests) - fail_count, len(group.tests))
         print
+        # Timings go to stderr to keep stdout comparable with the baseline.
+        # A group's tests are spread over many shards, so this is the time
+        # spent bidding them, not how long the group took (see
+        # TestHarness._print_shard_timings).
+        bidding_time = sum(self._results_by_identifier[test.identifier].duration for test in group.tests)
+        sys.stderr.write("%s: %.1fs bidding\n" % (group.name, bidding_time))
+
+    @property
+    def results(self):
+        return self._results_by_identifier.values()
 
     def add_results_callback(self, results):
         for result in results:
@@ -190,13 +202,24 @@ class ResultsAggregator(object):
         print "Pass %s (%.1f%%) of %s total hands" % (total_pass, percent, total_tests)
 
 
+# Each process keeps one Bidder, so its caches stay warm across shards.
+_bidder = None
+
+
+def _bidder_for_process():
+    global _bidder
+    if not _bidder:
+        _bidder = BidderFactory.default_bidder()
+    return _bidder
+
+
 # Pickle gets mad at us if we make this a member or even static function.
 # This call is executed in a different process when running tests in parallel.
 def _run_test(test):
-    # FIXME: There is no need to lookup the bidder every time.
-    bidder = BidderFactory.default_bidder()
+    bidder = _bidder_for_process()
     result = TestResult()
     result.test = test
+    start = time.time()
     # FIXME: OutputCapture captures logging channels as well which is probably a waste.
     output = outputcapture.OutputCapture()
     stdout, stderr = output.capture_output()
@@ -209,22 +232,41 @@ def _run_test(test):
 
             if result.last_three_rule_names and result.last_three_rule_names[-2] is None:
                 print "WARNING: Failed to interpret partner's last bid: %s" % test.call_history.copy_with_partial_history(-2)
-
     except Exception:
         result.exc_str = ''.join(traceback.format_exception(*sys.exc_info()))
+    if TestHarness.results_cache_path and not result.exc_str:
+        # Failing to find them only means the result isn't cached.
+        try:
+            result.dependencies = results_cache.dependencies_for(bidder, test.call_history)
+        except Exception:
+            result.dependencies = None
     output.restore_output()
     result.save_captured_logs(stdout, stderr)
+    result.duration = time.time() - start
     return result
 
 
+# Returns the results of shard, and when it started and finished.
+def _run_shard(shard):
+    start = time.time()
+    results = map(_run_test, shard)
+    return results, start, time.time()
+
+
 class TestHarness(unittest2.TestCase):
     use_multi_process = True
-    test_shard_size = 10
+    test_shard_size = 50
+    # Tests whose auctions start with the same calls share a shard.
+    shard_prefix_length = 2
+    # Set to reuse results of tests whose rules haven't changed, see results_cache.
+    results_cache_path = None
 
     def __init__(self, *args, **kwargs):
         super(TestHarness, self).__init__(*args, **kwargs)
         self.groups = []
         self.results = None
+        # {auction prefix: [(start, finish, test count)]} for each shard run.
+        self._shard_times = {}
 
     def collect_test_groups(self):
         # sorted happens to "just work" here since tuples are compared in item order.
@@ -234,25 +276,55 @@ class TestHarness(unittest2.TestCase):
             group.add_expectation_lines(expectations_list)
             self.groups.append(group)
 
-    def run_tests_single_process(self):
+    def _prefix(self, test):
+        return " ".join(call.name for call in test.call_history.calls[:self.shard_prefix_length])
+
+    def _shards(self, tests):
+        # Tests with a common auction prefix interpret the same Histories,
+        # so running them in one process lets them share its HistoryCache.
+        call_names = lambda test: [call.name for call in test.call_history.calls]
+        all_tests = sorted(tests, key=call_names)
+        shards = []
+        for _, family in itertools.groupby(all_tests, self._prefix):
+            family = list(family)
+            shards.extend(family[x : x + self.test_shard_size] for x in range(0, len(family), self.test_shard_size))
+        # Starting the biggest shards first keeps every worker busy until the end.
+        return sorted(shards, key=len, reverse=True)
+
+    def _add_shard_results(self, prefix, shard_result):
+        results, start, finish = shard_result
+        self._shard_times.setdefault(prefix, []).append((start, finish, len(results)))
+        self.results.add_results_callback(results)
+
+    # For each auction prefix, how long from its first shard starting to its
+    # last finishing, and the time its shards took between them.
+    def _print_shard_timings(self):
+        if not self._shard_times:
+            return
+        timings = []
+        for prefix, shard_times in self._shard_times.items():
+            wall_time = max(finish for _, finish, _ in shard_times) - min(start for start, _, _ in shard_times)
+            shard_time = sum(finish - start for start, finish, _ in shard_times)
+            test_count = sum(count for _, _, count in shard_times)
+            timings.append((wall_time, shard_time, len(shard_times), test_count, prefix or "(no calls)"))
+        sys.stderr.write("Auction prefix: wall time, shard time (shards, tests)\n")
+        for timing in sorted(timings, reverse=True):
+            sys.stderr.write("%s: %.1fs wall, %.1fs in shards (%d, %d)\n" % (timing[4], timing[0], timing[1], timing[2], timing[3]))
+
+    def run_tests_single_process(self, tests):
         # This follows the same logic-flow as the multi-process code, yet stays single threaded.
-        all_tests = list(itertools.chain.from_iterable(group.tests for group in self.groups))
-        for x in range(0, len(all_tests), self.test_shard_size):
-            shard = all_tests[x : x + self.test_shard_size]
-            results = map(_run_test, shard)
-            self.results.add_results_callback(results)
-
-    def run_tests_multi_process(self):
-        all_tests = list(itertools.chain.from_iterable(group.tests for group in self.groups))
+        for shard in self._shards(tests):
+            self._add_shard_results(self._prefix(shard[0]), _run_shard(shard))
+
+    def run_tests_multi_process(self, tests):
         pool = multiprocessing.Pool()
-        # FIXME: outstanding_jobs + map_async is a workaround for http://bugs.python.org/issue8296 (only fixed in python 3)
+        # FIXME: outstanding_jobs + apply_async is a workaround for http://bugs.python.org/issue8296 (only fixed in python 3)
         outstanding_jobs = []
-        for x in range(0, len(all_tests), self.test_shard_size):
-            results = pool.map_async(
-                _run_test,
-                all_tests[x : x + self.test_shard_size],
-                self.test_shard_size,
-                self.results.add_results_callback
+        for shard in self._shards(tests):
+            results = pool.apply_async(
+                _run_shard,
+                [shard],
+                callback=functools.partial(self._add_shard_results, self._prefix(shard[0])),
             )
             outstanding_jobs.append(results)
         pool.close()
@@ -298,13 +370,35 @@ class TestHarness(unittest2.TestCase):
             print "\n%s rules were never used for either bidding or interpretation:" % len(never_tested_rule_names)
             print "\n".join(sorted(never_tested_rule_names))
 
+    def _load_results_cache(self):
+        bidder = BidderFactory.default_bidder()
+        if not hasattr(getattr(bidder, 'system', None), 'rule_index'):
+            sys.stderr.write("Not caching results, %s has no rules.\n" % bidder.__class__.__name__)
+            return None
+        return results_cache.ResultsCache(self.results_cache_path, bidder)
+
     def test_main(self):
         self.collect_test_groups()
         self.results = ResultsAggregator(self.groups)
+        tests = list(itertools.chain.from_iterable(group.tests for group in self.groups))
+        cache = self._load_results_cache() if self.results_cache_path else None
+        if cache:
+            cached_results = []
+            for test in tests:
+                entry = cache.lookup(test)
+                if entry:
+                    cached_results.append(TestResult.from_cache_entry(test, entry))
+            sys.stderr.write("Reusing %s of %s results from %s\n" % (len(cached_results), len(tests), self.results_cache_path))
+            reused_tests = set(result.test for result in cached_results)
+            tests = [test for test in tests if test not in reused_tests]
+            self.results.add_results_callback(cached_results)
         if self.use_multi_process:
-            self.run_tests_multi_process()
+            self.run_tests_multi_process(tests)
         else:
-            self.run_tests_single_process()
+            self.run_tests_single_process(tests)
+        self._print_shard_timings()
+        if cache:
+            cache.save(self.results.results)
         self.results.print_summary()
         print
         self._print_coverage_summary()
@@ -318,8 +412,23 @@ class TestResult(object):
         # We only bother to store the last 3, as the subtest system will have handled all calls before that.
         self.last_three_rule_names = None
         self.exc_str = None
+        self.duration = 0
         self.stdout = None
         self.stderr = None
+        # (rule names, contexts) from results_cache.dependencies_for.
+        self.dependencies = None
+
+    @classmethod
+    def from_cache_entry(cls, test, entry):
+        result = cls()
+        result.test = test
+        result.call = Call.from_string(entry['call']) if entry['call'] else None
+        result.rule_name = entry['rule_name']
+        result.last_three_rule_names = entry['last_three_rule_names']
+        result.stdout = entry['stdout']
+        result.stderr = entry['stderr']
+        result.dependencies = (entry['rule_names'], entry['contexts'])
+        return result
 
     def fill_last_three_rule_names(self, call_selection):
         # FIXME: This is kinda an ugly z3b-dependant hack.
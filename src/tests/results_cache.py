@@ -0,0 +1,272 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from core.call import Call
+from z3b import enum
+import glob
+import hashlib
+import inspect
+import json
+import os
+import types
+import z3
+
+
+# Lets the harness skip tests whose outcome can't have changed since the last
+# run.  The rules a test can depend on are those RuleSelector considers over
+# each History in its auction: the ones RuleIndex returns for that History's
+# summary and legal calls (its "context").  For every test we store its result,
+# the names of those rules and its contexts.  A rule's fingerprint is a hash
+# of its compiled form (including where its priorities sit in the ordering),
+# so on the next run a test is reused unless:
+#  - the bidder's code outside of the rule classes changed (see
+#    _engine_version), including anything else in the files declaring rules,
+#  - one of its rules was changed or removed, or
+#  - a changed or new rule would now be considered in one of its contexts.
+
+default_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'z3b_results_cache.json')
+
+
+def _source_paths():
+    src_dir = os.path.dirname(os.path.dirname(__file__))
+    return glob.glob(os.path.join(src_dir, 'core', '*.py')) + glob.glob(os.path.join(src_dir, 'z3b', '*.py')) + [
+        # Picks the bidder and its solvers.
+        os.path.join(src_dir, 'factory.py'),
+        # Decides how long Histories (and their solvers) live.
+        os.path.join(src_dir, 'third_party', 'memoized.py'),
+        # Decides what a result is, and when it's still valid.
+        os.path.join(src_dir, 'tests', 'harness.py'),
+        os.path.join(src_dir, 'tests', 'results_cache.py'),
+    ]
+
+
+def _rule_source_paths(system):
+    return set(os.path.abspath(inspect.getsourcefile(rule.dsl_rule)) for rule in system.rules)
+
+
+# Rule classes are hashed by their fingerprints, but the rest of the files
+# declaring them (module-level constants, helper functions, abstract base
+# rules) can change any of their results.
+def _source_without_rule_classes(path, rules):
+    with open(path) as source_file:
+        lines = source_file.readlines()
+    for dsl_rule in set(rule.dsl_rule for rule in rules):
+        if os.path.abspath(inspect.getsourcefile(dsl_rule)) != path:
+            continue
+        class_lines, first_line = inspect.getsourcelines(dsl_rule)
+        lines[first_line - 1 : first_line - 1 + len(class_lines)] = [None] * len(class_lines)
+    return "".join(line for line in lines if line is not None)
+
+
+# Any source outside of the rule classes can change any result.
+def _engine_version(bidder):
+    from z3b.bidder import _solver_pool
+    rule_source_paths = _rule_source_paths(bidder.system)
+    sha = hashlib.sha1(bidder.__class__.__name__)
+    sha.update(z3.get_version_string())
+    # z3 and z3b.enumerator (and z3's configurations) should agree, but
+    # checking that they do is exactly when we mustn't reuse results.
+    sha.update("enumerator" if _solver_pool.use_enumerator else "z3")
+    sha.update(repr(sorted(vars(_solver_pool.configuration).items())))
+    for path in sorted(_source_paths()):
+        path = os.path.abspath(path)
+        if path in rule_source_paths:
+            sha.update(_source_without_rule_classes(path, bidder.system.rules))
+            continue
+        with open(path) as source_file:
+            sha.update(source_file.read())
+    return sha.hexdigest()
+
+
+class _RuleFingerprinter(object):
+    def __init__(self, system):
+        self.system = system
+        self._rule_source_paths = _rule_source_paths(system)
+        self._source_for_object = {}
+
+    # Constraints, preconditions and helper functions declared next to the
+    # rules are part of what a rule means, so we hash their source along with
+    # their arguments.
+    def _source_in_rule_files(self, class_or_function):
+        source = self._source_for_object.get(class_or_function)
+        if source is None:
+            source = ""
+            source_path = inspect.getsourcefile(class_or_function)
+            if source_path and os.path.abspath(source_path) in self._rule_source_paths:
+                source = inspect.getsource(class_or_function)
+            self._source_for_object[class_or_function] = source
+        return source
+
+    # A repr which is the same in every process, unlike the default
+    # object repr (which includes an address).
+    def _stable_repr(self, value):
+        if isinstance(value, z3.ExprRef):
+            return value.sexpr()
+        if isinstance(value, (enum.Enum.EnumValue, Call)):
+            return repr(value)
+        if isinstance(value, type):
+            return "%s.%s" % (value.__module__, value.__name__)
+        if isinstance(value, types.FunctionType):
+            return "%s%s" % (value.__name__, self._source_in_rule_files(value))
+        if isinstance(value, dict):
+            return "{%s}" % ", ".join(sorted("%s: %s" % (self._stable_repr(key), self._stable_repr(item)) for key, item in value.items()))
+        if isinstance(value, (set, frozenset)):
+            return "set(%s)" % ", ".join(sorted(map(self._stable_repr, value)))
+        if isinstance(value, (list, tuple)):
+            return "[%s]" % ", ".join(map(self._stable_repr, value))
+        if hasattr(value, '__dict__'):
+            cls = value.__class__
+            return "%s(%s)%s" % (cls.__name__, self._stable_repr(vars(value)), self._source_in_rule_files(cls))
+        return repr(value)
+
+    # CompiledRule.all_priorities misses priorities given with constraints.
+    def _priorities(self, rule):
+        priorities = set([rule.default_priority])
+        priorities.update(rule.priorities_per_call.values())
+        for constraints in rule.constraints.values():
+            if isinstance(constraints, (list, tuple)) and len(constraints) == 2:
+                priorities.add(constraints[1])
+        for conditional_priorities in rule.conditional_priorities_per_call.values():
+            priorities.update(priority for _, priority in conditional_priorities)
+        priorities.update(priority for _, priority in rule.dsl_rule.conditional_priorities)
+        return priorities
+
+    def fingerprint(self, rule):
+        ordering = self.system.priority_ordering.ordering
+        dsl_rule = rule.dsl_rule
+        # The rule's class (and the rules it inherits from) as written, for
+        # whatever compiling it doesn't capture, e.g. methods.
+        parts = [self._source_in_rule_files(cls) for cls in inspect.getmro(dsl_rule) if cls is not object]
+        parts += [(key, getattr(dsl_rule, key)) for key in sorted(dsl_rule.ALLOWED_KEYS)]
+        parts += [
+            rule.known_calls,
+            rule.preconditions,
+            rule.shared_constraints,
+            rule._annotations,
+            dict((priority, set(ordering.items_above(priority))) for priority in self._priorities(rule)),
+        ]
+        return hashlib.sha1(self._stable_repr(parts)).hexdigest()
+
+
+def _context_for_history(history):
+    summary = history.summary
+    return json.dumps([
+        sorted(position.index for position in summary.openers),
+        [call.name if call else None for call in summary.last_calls],
+        [sorted(annotation.key for annotation in last_call_annotations) for last_call_annotations in summary.last_call_annotations],
+        sorted(call.name for call in history.legal_calls),
+    ])
+
+
+def _summary_and_legal_calls_for_context(context):
+    from z3b.model import positions
+    from z3b.preconditions import annotations, HistorySummary
+    openers, last_calls, last_call_annotations, legal_calls = json.loads(context)
+    summary = HistorySummary(
+        openers=frozenset(positions[index] for index in openers),
+        last_calls=tuple(Call.from_string(name) if name else None for name in last_calls),
+        last_call_annotations=tuple(frozenset(map(annotations.get, keys)) for keys in last_call_annotations),
+    )
+    return summary, set(map(Call.from_string, legal_calls))
+
+
+# Returns (rule names, contexts) for a test over call_history, or None for
+# bidders which aren't built from rules.
+def dependencies_for(bidder, call_history):
+    system = getattr(bidder, 'system', None)
+    if not system or not hasattr(system, 'rule_index'):
+        return None
+    from z3b.bidder import Interpreter
+    rule_names = set()
+    contexts = set()
+    with Interpreter().create_history(call_history) as history:
+        for partial_history in history._walk_history():
+            rules = system.rule_index.rules_for(partial_history.summary, partial_history.legal_calls)
+            rule_names.update(rule.name for rule in rules)
+            contexts.add(_context_for_history(partial_history))
+    return sorted(rule_names), sorted(contexts)
+
+
+class ResultsCache(object):
+    def __init__(self, path, bidder):
+        self.path = path
+        self.bidder = bidder
+        self.version = _engine_version(bidder)
+        fingerprinter = _RuleFingerprinter(bidder.system)
+        self.fingerprints = dict((rule.name, fingerprinter.fingerprint(rule)) for rule in bidder.system.rules)
+        self._entries = {}
+        self._changed_rule_names = set()
+        self._dirty_contexts = set()
+        self._load()
+
+    @classmethod
+    def key_for_test(cls, test):
+        return "%s %s %s" % (test.group.name, test.identifier, test.expected_call.name)
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, ValueError):
+            return
+        if data.get('version') != self.version:
+            return
+        old_fingerprints = data['fingerprints']
+        self._entries = data['entries']
+        self._changed_rule_names = set(name for name in set(old_fingerprints) | set(self.fingerprints)
+            if old_fingerprints.get(name) != self.fingerprints.get(name))
+        self._dirty_contexts = self._contexts_with_changed_rules()
+
+    def _contexts_with_changed_rules(self):
+        from z3b.rule_compiler import RuleIndex
+        changed_rules = [rule for rule in self.bidder.system.rules if rule.name in self._changed_rule_names]
+        if not changed_rules:
+            return set()
+        changed_rule_index = RuleIndex(changed_rules)
+        contexts = set()
+        for entry in self._entries.itervalues():
+            contexts.update(entry['contexts'])
+        dirty_contexts = set()
+        for context in contexts:
+            summary, legal_calls = _summary_and_legal_calls_for_context(context)
+            if changed_rule_index.rules_for(summary, legal_calls):
+                dirty_contexts.add(context)
+        return dirty_contexts
+
+    # Returns the cached entry for test if it's still valid.
+    def lookup(self, test):
+        entry = self._entries.get(self.key_for_test(test))
+        if not entry:
+            return None
+        if self._changed_rule_names.intersection(entry['rule_names']):
+            return None
+        if self._dirty_contexts.intersection(entry['contexts']):
+            return None
+        return entry
+
+    def save(self, results):
+        entries = {}
+        for result in results:
+            # Exceptions are always worth seeing again.
+            if result.exc_str or result.dependencies is None:
+                continue
+            rule_names, contexts = result.dependencies
+            entries[self.key_for_test(result.test)] = {
+                'call': result.call.name if result.call else None,
+                'rule_name': result.rule_name,
+                'last_three_rule_names': result.last_three_rule_names,
+                'stdout': result.stdout,
+                'stderr': result.stderr,
+                'rule_names': rule_names,
+                'contexts': contexts,
+            }
+        # Write then rename so that ^C never leaves a partial cache.
+        temporary_path = "%s.%d" % (self.path, os.getpid())
+        with open(temporary_path, 'w') as cache_file:
+            json.dump({
+                'version': self.version,
+                'fingerprints': self.fingerprints,
+                'entries': entries,
+            }, cache_file)
+        os.rename(temporary_path, self.path)
@@ -0,0 +1,64 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest2
+from tests import test_sayc
+from tests.harness import CompiledTest, TestGroup
+from third_party import outputcapture
+from z3b import bidder
+
+
+def _sexprs(meanings):
+    return [(priority, meaning.sexpr()) for priority, meaning in meanings]
+
+
+# Every auction (and partial auction) test_sayc bids over, once each.
+def _call_histories():
+    call_histories = {}
+    group = TestGroup('test_meaning_cache')
+    for expectations_list in test_sayc.sayc_expectations.values():
+        for expectation in expectations_list:
+            call_history = CompiledTest.from_expectation_tuple_in_group(expectation, group).call_history
+            for index in range(len(call_history.calls) + 1):
+                partial_history = call_history.copy_with_partial_history(index)
+                call_histories[partial_history.identifier] = partial_history
+    return [call_histories[identifier] for identifier in sorted(call_histories)]
+
+
+# CompiledRule.meaning_of shares one compiled meaning between every history
+# with the same history_features, so any feature a Constraint forgets to
+# declare shows up here as a meaning compiled for some other auction.
+class MeaningCacheTest(unittest2.TestCase):
+    # Interpreting the auctions warns about ambiguous rules, and would leave
+    # their histories in the process's HistoryCache for the harness.
+    def setUp(self):
+        self.history_cache = bidder.history_cache
+        bidder.history_cache = bidder.HistoryCache()
+        self.output = outputcapture.OutputCapture()
+        self.output.capture_output()
+
+    def tearDown(self):
+        self.output.restore_output()
+        bidder.history_cache = self.history_cache
+
+    def test_cached_meanings_match_compiled(self):
+        interpreter = bidder.Interpreter()
+        system = interpreter.system
+        # {meaning key: the auction it was first compiled over}
+        first_auctions = {}
+        shared_count = 0
+        for call_history in _call_histories():
+            with interpreter.create_history(call_history) as history:
+                auction = call_history.calls_string()
+                for rule in system.rule_index.rules_for(history.summary, history.legal_calls):
+                    for _, call in rule.calls_over(history):
+                        key = rule._meaning_key(history, call)
+                        if key is not None:
+                            first_auction = first_auctions.setdefault(key, auction)
+                            if first_auction != auction:
+                                shared_count += 1
+                        self.assertEqual(_sexprs(rule.meaning_of(history, call)), _sexprs(rule._compile_meaning_of(history, call)),
+                            "%s for %s over %s" % (rule.name, call.name, auction))
+        # Otherwise this tested nothing.
+        self.assertGreater(shared_count, 0)
@@ -0,0 +1,102 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest2
+from core.call import Call
+from factory import BidderFactory
+from tests import results_cache
+from tests.harness import CompiledTest, TestGroup, TestResult
+
+
+def _result_for(bidder, expectation):
+    test = CompiledTest.from_expectation_tuple_in_group(expectation, TestGroup('test_results_cache'))
+    result = TestResult()
+    result.test = test
+    result.call = Call.from_string(expectation[1])
+    result.rule_name = 'Rule'
+    result.stdout = ''
+    result.stderr = ''
+    result.dependencies = results_cache.dependencies_for(bidder, test.call_history)
+    return result
+
+
+class ResultsCacheTest(unittest2.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bidder = BidderFactory.default_bidder()
+        cls.opening = _result_for(cls.bidder, ['AKQ2.K32.Q32.432', '1C', ''])
+        cls.response = _result_for(cls.bidder, ['AKQ2.K32.Q32.432', '1D', '1C P'])
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results.json')
+        results_cache.ResultsCache(self.path, self.bidder).save([self.opening, self.response])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _edit_cache_file(self, edit):
+        with open(self.path) as cache_file:
+            data = json.load(cache_file)
+        edit(data)
+        with open(self.path, 'w') as cache_file:
+            json.dump(data, cache_file)
+
+    def _reused(self):
+        cache = results_cache.ResultsCache(self.path, self.bidder)
+        return [bool(cache.lookup(result.test)) for result in (self.opening, self.response)]
+
+    def _entry(self, data, result):
+        return data['entries'][results_cache.ResultsCache.key_for_test(result.test)]
+
+    def test_unchanged(self):
+        self.assertEqual(self._reused(), [True, True])
+        entry = results_cache.ResultsCache(self.path, self.bidder).lookup(self.response.test)
+        self.assertEqual(entry['call'], '1D')
+
+    def test_version_mismatch(self):
+        def edit(data):
+            data['version'] = 'some other engine'
+        self._edit_cache_file(edit)
+        self.assertEqual(self._reused(), [False, False])
+
+    def test_changed_rule(self):
+        # A rule only the response could have used.
+        response_only = sorted(set(self.response.dependencies[0]) - set(self.opening.dependencies[0]))[0]
+
+        def edit(data):
+            data['fingerprints'][response_only] = 'an older fingerprint'
+        self._edit_cache_file(edit)
+        self.assertEqual(self._reused(), [True, False])
+
+    def test_removed_rule(self):
+        def edit(data):
+            data['fingerprints']['NoLongerARule'] = 'fingerprint'
+            self._entry(data, self.opening)['rule_names'].append('NoLongerARule')
+        self._edit_cache_file(edit)
+        self.assertEqual(self._reused(), [False, True])
+
+    def test_new_rule_in_cached_context(self):
+        # As if a rule which is now considered over the response's auction
+        # had been added since the cache was built.
+        response_only = sorted(set(self.response.dependencies[0]) - set(self.opening.dependencies[0]))[0]
+
+        def edit(data):
+            del data['fingerprints'][response_only]
+            self._entry(data, self.response)['rule_names'].remove(response_only)
+        self._edit_cache_file(edit)
+        self.assertEqual(self._reused(), [True, False])
+
+    def test_new_rule_elsewhere(self):
+        considered = set(self.opening.dependencies[0]) | set(self.response.dependencies[0])
+        elsewhere = sorted(rule.name for rule in self.bidder.system.rules if rule.name not in considered)[0]
+
+        def edit(data):
+            del data['fingerprints'][elsewhere]
+        self._edit_cache_file(edit)
+        self.assertEqual(self._reused(), [True, True])
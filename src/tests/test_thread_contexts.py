@@ -0,0 +1,74 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import sys
+import threading
+import traceback
+import unittest2
+from factory import BidderFactory
+from tests import test_sayc
+from tests.harness import CompiledTest, TestGroup
+from third_party import outputcapture
+from z3b import bidder
+
+
+# Every 12th test in test_sayc, so every group gets a few.
+def _tests():
+    tests = []
+    for group_name, expectations_list in sorted(test_sayc.sayc_expectations.items()):
+        group = TestGroup(group_name)
+        tests.extend(CompiledTest.from_expectation_tuple_in_group(expectation, group) for expectation in expectations_list)
+    return tests[::12]
+
+
+def _bid(call_selector, test):
+    call_selection = call_selector.call_selection_for(test.hand, test.call_history)
+    if not call_selection:
+        return None
+    return call_selection.call.name, str(call_selection.rule)
+
+
+class ThreadContextsTest(unittest2.TestCase):
+    thread_count = 4
+
+    # Bidding prints warnings about ambiguous rules.
+    def setUp(self):
+        self.output = outputcapture.OutputCapture()
+        self.output.capture_output()
+
+    def tearDown(self):
+        self.output.restore_output()
+        bidder._thread_state = None
+
+    def _bid_in_thread(self, call_selector, tests, results, solver_pools, errors):
+        try:
+            for test in tests:
+                results[test.identifier] = _bid(call_selector, test)
+            solver_pools.append(bidder._current_solver_pool())
+        except Exception:
+            errors.append(''.join(traceback.format_exception(*sys.exc_info())))
+
+    def test_threads_bid_like_one_thread(self):
+        call_selector = BidderFactory.default_bidder()
+        tests = _tests()
+        expected_results = dict((test.identifier, _bid(call_selector, test)) for test in tests)
+
+        bidder.use_thread_contexts()
+        results = {}
+        solver_pools = []
+        errors = []
+        # Each thread starts out with an empty HistoryCache and SolverPool,
+        # and they all share the main Context's lock.
+        threads = [threading.Thread(target=self._bid_in_thread, args=(call_selector, tests[index::self.thread_count], results, solver_pools, errors))
+            for index in range(self.thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, expected_results)
+        self.assertEqual(len(set(solver_pools)), self.thread_count)
+        self.assertNotIn(bidder._solver_pool, solver_pools)
+        self.assertTrue(all(solver_pool.borrows for solver_pool in solver_pools))
@@ -24,10 +24,15 @@ class memoized(object):
         del self._results_cache[args]
         return result
 
+    # Like take, but doesn't compute the result if it isn't cached.
+    def forget(self, *args):
+        return self._results_cache.pop(args, None)
+
     # Use python "descriptor" protocol __get__ to appear
     # invisible during property access.
     def __get__(self, instance, owner):
         # Return a function partial with obj already bound as self.
         partial = functools.partial(self.__call__, instance)
         partial.take = functools.partial(self.take, instance)
+        partial.forget = functools.partial(self.forget, instance)
         return partial
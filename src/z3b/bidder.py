@@ -6,13 +6,18 @@ from core.call import Call
 from core.callexplorer import CallExplorer
 from core.callhistory import CallHistory
 from itertools import chain
-from z3b import enum
+from z3b import enum, hand_evaluator
+from z3b.constraint_store import ConstraintStore
 from third_party.memoized import memoized
 from z3b.model import positions, expr_for_suit, is_possible, is_certain
-from z3b.preconditions import did_bid_annotation
+from z3b.preconditions import annotations, did_bid_annotation, HistorySummary
 import collections
-import copy
+import contextlib
 import core.suit as suit
+import sys
+import threading
+import traceback
+import weakref
 import z3
 import z3b.model as model
 import z3b.rules as rules
@@ -20,24 +25,130 @@ import z3b.sayc as sayc
 
 
 class SolverPool(object):
-    def __init__(self):
+    # use_assumptions selects between answering is_possible/is_certain via
+    # check(assumptions) on a model.AssumptionSolver or via push/pop.
+    # use_enumerator answers them with an enumerator.HandSetSolver instead.
+    # use_thread_context puts the solvers in a z3 Context of their own, see
+    # use_thread_contexts.  configuration is a model.SolverConfiguration,
+    # by default model.default_solver_configuration.
+    #
+    # At most max_size idle solvers are kept.  Solvers accumulate lemmas (and
+    # AssumptionSolver's guarded assertions) as they're used, so one is
+    # recycled, i.e. dropped for a fresh one, after recycle_after_borrows
+    # borrows.  z3 only reports the allocation of the whole process, so when
+    # that grows by more than recycle_above_bytes the idle solvers are all
+    # recycled at once, and growth is then measured from after they're gone.
+    # A borrowed solver which is garbage collected without being restored is
+    # counted in leaks; with debug set we also remember where each
+    # outstanding solver was borrowed, see outstanding_borrows.
+    def __init__(self, use_assumptions=True, use_enumerator=False, use_thread_context=False, configuration=None,
+            max_size=8, recycle_after_borrows=5000, recycle_above_bytes=1 << 30, debug=False):
+        # (solver, times borrowed) for each idle solver.
         self._pool = []
-
-    def _ensure_solver(self):
-        if self._pool:
-            return
-        solver = z3.SolverFor('QF_LIA')
+        self.use_assumptions = use_assumptions
+        self.use_enumerator = use_enumerator
+        self.configuration = configuration or model.solver_configurations[model.default_solver_configuration]
+        self._translator = self.configuration.translator(z3.Context() if use_thread_context else None)
+        # When set to a list, every check()'s latency is appended to it, see
+        # scripts/benchmark-solvers.
+        self.check_latencies = None
+        self.max_size = max_size
+        self.recycle_after_borrows = recycle_after_borrows
+        self.recycle_above_bytes = recycle_above_bytes
+        self.debug = debug
+        self._allocated_bytes_after_recycling = z3.Z3_get_estimated_alloc_size()
+        # {id(solver): (weakref, times borrowed, stack or None)} for each
+        # borrowed solver.
+        self._outstanding = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.creations = 0
+        self.borrows = 0
+        self.restores = 0
+        self.recycles = 0
+        self.discards = 0
+        self.leaks = 0
+
+    def stats(self):
+        return {
+            'creations': self.creations,
+            'borrows': self.borrows,
+            'restores': self.restores,
+            'recycles': self.recycles,
+            'discards': self.discards,
+            'leaks': self.leaks,
+            'idle': len(self._pool),
+            'outstanding': len(self._outstanding),
+        }
+
+    # The stacks which borrowed each solver still outstanding, if debug was
+    # set when they were borrowed.
+    def outstanding_borrows(self):
+        return [stack for _, _, stack in self._outstanding.values() if stack]
+
+    def _create_solver(self):
+        self.creations += 1
+        if self.use_enumerator:
+            # Imported here since the enumerator needs numpy.
+            from z3b import enumerator
+            return enumerator.HandSetSolver()
+        solver = self.configuration.solver(self._translator.ctx if self._translator else None)
+        if self._translator:
+            solver = model.ContextSolver(self._translator, solver)
+        if self.check_latencies is not None:
+            solver = model.TimedSolver(solver, self.check_latencies)
         solver.add(model.axioms)
-        self._pool.append(solver)
+        if self.use_assumptions:
+            solver = model.AssumptionSolver(solver)
+        return solver
+
+    def _leaked(self, solver_id):
+        _, _, stack = self._outstanding.pop(solver_id)
+        self.leaks += 1
+        if stack:
+            # stdout is compared against baselines, see scripts/test-sayc.
+            sys.stderr.write("WARNING: Solver was never restored to the pool, borrowed at:\n%s" % stack)
+
+    # Recycles every idle solver if z3's allocation has grown by more than
+    # recycle_above_bytes since we last did.
+    def _recycle_pool_if_over_memory_limit(self):
+        if not self.recycle_above_bytes:
+            return False
+        if z3.Z3_get_estimated_alloc_size() - self._allocated_bytes_after_recycling <= self.recycle_above_bytes:
+            return False
+        self.recycles += len(self._pool)
+        # Solvers are freed as soon as we drop them.
+        self._pool = []
+        self._allocated_bytes_after_recycling = z3.Z3_get_estimated_alloc_size()
+        return True
 
     def restore(self, solver):
+        _, borrow_count, _ = self._outstanding.pop(id(solver))
+        self.restores += 1
+        if self.recycle_after_borrows and borrow_count >= self.recycle_after_borrows:
+            self.recycles += 1
+            return
+        if self._recycle_pool_if_over_memory_limit():
+            self.recycles += 1
+            return
+        if len(self._pool) >= self.max_size:
+            self.discards += 1
+            return
         solver.pop()
-        self._pool.append(solver)
+        self._pool.append((solver, borrow_count))
 
     def borrow(self):
-        self._ensure_solver()
-        solver = self._pool.pop()
+        if self._pool:
+            solver, borrow_count = self._pool.pop()
+        else:
+            solver, borrow_count = self._create_solver(), 0
         solver.push()
+        self.borrows += 1
+        # The callback holds only the id, as the solver is gone by then.
+        solver_ref = weakref.ref(solver, lambda _, solver_id=id(solver): self._leaked(solver_id))
+        stack = "".join(traceback.format_stack()[:-1]) if self.debug else None
+        self._outstanding[id(solver)] = (solver_ref, borrow_count + 1, stack)
         return solver
 
     # This cannot be memoized, or we would leak a solver on every call if
@@ -47,10 +158,40 @@ class SolverPool(object):
         solver.add(model.expr_for_hand(hand))
         return solver
 
+    # For solvers which needn't outlive a block:
+    #   with solver_pool.borrowed() as solver:
+    @contextlib.contextmanager
+    def borrowed(self, hand=None):
+        solver = self.borrow_solver_for_hand(hand) if hand else self.borrow()
+        try:
+            yield solver
+        finally:
+            self.restore(solver)
+
 
 _solver_pool = SolverPool()
 
 
+# Histories built after this answer their questions by enumerating hands.
+# Call it before use_thread_contexts.
+def use_enumerator():
+    _solver_pool.use_enumerator = True
+    _solver_pool._pool = []
+
+
+# Histories built after this use the named model.solver_configurations.
+# Call it before use_thread_contexts.
+def use_solver_configuration(name):
+    _solver_pool.configuration = model.solver_configurations[name]
+    _solver_pool._translator = _solver_pool.configuration.translator()
+    _solver_pool._pool = []
+
+
+# When set, possible_calls_for_hand checks every meaning with z3 as well as
+# hand_evaluator and asserts that they agree.
+check_hand_evaluator = False
+
+
 # Intra-bid priorities, first phase, "interpretation priorities", like "natural, conventional" (possibly should be called types?) These select which "1N" meaning is correct.
 # Inter-bid priorities, "which do you look at first" -- these order preference between "1H, vs. 1S"
 # Tie-breaker-priorities -- planner stage, when 2 bids match which we make.
@@ -129,6 +270,9 @@ class PositionView(object):
     def could_have_more_points_than(self, points):
         return self.history.could_have_more_points_than(self.position, points)
 
+    def solve_all_bounds(self):
+        self.history.solve_all_bounds_for_position(self.position)
+
     def min_length(self, suit):
         return self.history.min_length_for_position(self.position, suit)
 
@@ -154,11 +298,18 @@ class History(object):
     def __init__(self, previous_history=None, call=None, annotations=None, constraints=None, rule=None):
         self._previous_history = previous_history
         self._annotations_for_last_call = annotations if annotations else []
-        self._constraints_for_last_call = constraints if constraints else []
+        # An InternedConstraint from constraint_store, or None for no constraints.
+        self._constraint = constraint_store.intern(constraints) if constraints else None
         self._rule_for_last_call = rule
-        self.call_history = copy.deepcopy(self._previous_history.call_history) if self._previous_history else CallHistory()
-        if call:
-            self.call_history.calls.append(call)
+        # Solved min/max bounds, see _solve_for_bounds.
+        self._bounds = {}
+        self._is_balanced = None
+        if self._previous_history:
+            # Histories are immutable, so we share the dealer, vulnerability and
+            # Call objects with our parent rather than deep-copying them.
+            self.call_history = self._previous_history.call_history.copy_with_calls_appended([call] if call else [])
+        else:
+            self.call_history = CallHistory()
 
     def extend_with(self, call, annotations, constraints, rule):
         return History(
@@ -169,6 +320,12 @@ class History(object):
             rule=rule,
         )
 
+    @property
+    def _constraints_for_last_call(self):
+        if self._constraint is None:
+            return []
+        return self._constraint.simplified
+
     @property
     @memoized
     def legal_calls(self):
@@ -194,13 +351,28 @@ class History(object):
             previous_history = self._history_after_last_call_for(position)
             if not previous_history:
                 continue
-            _solver_pool.restore(previous_history._solver.take())
+            previous_history._release_solver()
+
+    # Each solver is handed down the chain of Histories four calls apart, so
+    # at most one History in a chain holds it: the latest which has built one.
+    def _release_solver(self):
+        history = self
+        while history:
+            solver = history._solver.forget()
+            if solver is not None:
+                _current_solver_pool().restore(solver)
+                return
+            history = history._four_calls_ago
 
     @memoized
     def _solver(self):
         previous_history = self._four_calls_ago
-        solver = previous_history._solver.take() if previous_history else _solver_pool.borrow()
-        solver.add(self._constraints_for_last_call)
+        solver = previous_history._solver.take() if previous_history else _current_solver_pool().borrow()
+        try:
+            solver.add(self._constraints_for_last_call)
+        except:
+            _current_solver_pool().restore(solver)
+            raise
         return solver
 
     @property
@@ -249,9 +421,24 @@ class History(object):
             return None
         return history._constraints_for_last_call
 
+    # Everything the position has shown, not just with its last call.
+    def constraints_for_position(self, position):
+        constraints = [history._constraints_for_last_call for history in self._walk_history_for(position)]
+        # Histories extended without constraints hold an empty list.
+        return [constraint for constraint in constraints if not isinstance(constraint, list)]
+
     def annotations_for_position(self, position):
         return chain.from_iterable(self._walk_annotations_for(position))
 
+    @property
+    @memoized
+    def summary(self):
+        return HistorySummary(
+            openers=frozenset(position for position in positions if annotations.Opening in self.annotations_for_position(position)),
+            last_calls=tuple(self.last_call_for_position(position) for position in positions),
+            last_call_annotations=tuple(frozenset(self.annotations_for_last_call(position)) for position in positions),
+        )
+
     def _walk_history(self):
         history = self
         while history:
@@ -270,24 +457,53 @@ class History(object):
         constraints = constraints if constraints is not None else z3.BoolVal(True)
         history = self._history_after_last_call_for(position)
         if not history:
-            solver = _solver_pool.borrow()
-            result = is_possible(solver, constraints)
-            _solver_pool.restore(solver)
-            return result
+            with _current_solver_pool().borrowed() as solver:
+                return is_possible(solver, constraints)
         return history._solve_for_consistency(constraints)
 
     # can't memoize due to unhashable parameter
     def _solve_for_consistency(self, constraints):
         return is_possible(self._solver(), constraints)
 
-    @memoized
+    # Bounds are keyed by suit, or by None for points.  Historically
+    # min_points has measured playing_points, while max_points measures points.
+    def _expr_and_limit_for_bound(self, key, is_max):
+        if key is None:
+            return (model.points, 37) if is_max else (model.playing_points, 0)
+        return (expr_for_suit(key), 13 if is_max else 0)
+
+    # Solves for any of the requested bounds we don't already know in one
+    # batch, see model.solve_for_bounds.  Values are None if the solver is unsat.
+    def _solve_for_bounds(self, min_keys=(), max_keys=()):
+        bound_keys = [(key, False) for key in min_keys] + [(key, True) for key in max_keys]
+        bound_keys = [bound_key for bound_key in bound_keys if bound_key not in self._bounds]
+        if not bound_keys:
+            return
+        min_keys = [key for key, is_max in bound_keys if not is_max]
+        max_keys = [key for key, is_max in bound_keys if is_max]
+        bounds = model.solve_for_bounds(self._solver(),
+            minimize=[self._expr_and_limit_for_bound(key, False) for key in min_keys],
+            maximize=[self._expr_and_limit_for_bound(key, True) for key in max_keys],
+        )
+        mins, maxes = bounds or ([None] * len(min_keys), [None] * len(max_keys))
+        self._bounds.update(zip(bound_keys, mins + maxes))
+
+    def _solve_for_bound(self, key, is_max):
+        self._solve_for_bounds(*([], [key]) if is_max else ([key], []))
+        return self._bounds[(key, is_max)]
+
+    # ConstraintsSerializer and friends want every bound, which is much
+    # cheaper to find in one batch than one at a time.
+    def solve_all_bounds_for_position(self, position):
+        history = self._history_after_last_call_for(position)
+        if history:
+            keys = suit.SUITS + [None]
+            history._solve_for_bounds(keys, keys)
+
     def _solve_for_min_length(self, suit):
-        solver = self._solver()
-        suit_expr = expr_for_suit(suit)
-        for length in range(0, 13):
-            if is_possible(solver, suit_expr == length):
-                return length
-        return 0
+        min_length = self._solve_for_bound(suit, False)
+        # Holding all 13 cards of a suit has always been reported as 0.
+        return min_length if min_length not in (None, 13) else 0
 
     def min_length_for_position(self, position, suit):
         history = self._history_after_last_call_for(position)
@@ -295,14 +511,9 @@ class History(object):
             return history._solve_for_min_length(suit)
         return 0
 
-    @memoized
     def _solve_for_max_length(self, suit):
-        solver = self._solver()
-        suit_expr = expr_for_suit(suit)
-        for length in range(13, 0, -1):
-            if is_possible(solver, suit_expr == length):
-                return length
-        return 0
+        max_length = self._solve_for_bound(suit, True)
+        return max_length if max_length is not None else 0
 
     def max_length_for_position(self, position, suit):
         history = self._history_after_last_call_for(position)
@@ -310,9 +521,10 @@ class History(object):
             return history._solve_for_max_length(suit)
         return 13
 
-    @memoized
     def _solve_for_is_balanced(self):
-        return is_certain(self._solver(), model.balanced)
+        if self._is_balanced is None:
+            self._is_balanced = is_certain(self._solver(), model.balanced)
+        return self._is_balanced
 
     def is_balanced_for_position(self, position):
         history = self._history_after_last_call_for(position)
@@ -320,22 +532,9 @@ class History(object):
             return history._solve_for_is_balanced()
         return False
 
-    def _lower_bound(self, predicate, lo, hi):
-        if lo == hi:
-            return hi
-        assert lo < hi
-        pos = int((lo + hi) / 2)
-        if predicate(pos):
-            return self._lower_bound(predicate, lo, pos)
-        return self._lower_bound(predicate, pos + 1, hi)
-
-    @memoized
     def _solve_for_min_points(self):
-        solver = self._solver()
-        predicate = lambda points: is_possible(solver, model.playing_points == points)
-        if predicate(0):
-            return 0
-        return self._lower_bound(predicate, 1, 37)
+        min_points = self._solve_for_bound(None, False)
+        return min(min_points, 37) if min_points is not None else 37
 
     def min_points_for_position(self, position):
         history = self._history_after_last_call_for(position)
@@ -343,13 +542,9 @@ class History(object):
             return history._solve_for_min_points()
         return 0
 
-    @memoized
     def _solve_for_max_points(self):
-        solver = self._solver()
-        for cap in range(37, 0, -1):
-            if is_possible(solver, cap == model.points):
-                return cap
-        return 0
+        max_points = self._solve_for_bound(None, True)
+        return max_points if max_points is not None else 0
 
     def max_points_for_position(self, position):
         history = self._history_after_last_call_for(position)
@@ -467,29 +662,38 @@ class Bidder(object):
         # Assuming SAYC for all sides.
         self.system = sayc.StandardAmericanYellowCard
 
+    def _call_selection_for_hand(self, rule_selector, hand, expected_call=None):
+        # Compute inter-bid priorities (priority) for each using the hand.
+        possible_calls = rule_selector.possible_calls_for_hand(hand, expected_call)
+        maximal_calls_and_priorities = possible_calls.maximal_calls_and_priorities()
+        # We don't currently support tie-breaking priorities, but we do have some bids that
+        # we don't make without a planner.
+        no_planning_filter = lambda call_priority_tuple: not rule_selector.rule_for_call(call_priority_tuple[0]).requires_planning
+        maximal_calls_and_priorities = filter(no_planning_filter, maximal_calls_and_priorities)
+        if not maximal_calls_and_priorities:
+            return None # If we failed to find any call, this is an error.
+        maximal_calls, maximal_priorities = zip(*maximal_calls_and_priorities)
+        if len(maximal_calls) != 1:
+            rules = map(rule_selector.rule_for_call, maximal_calls)
+            call_names = map(lambda call: call.name, maximal_calls)
+            print "WARNING: Unordered: %s rules: %s priorities: %s" % (call_names, rules, maximal_priorities)
+            return None
+
+        call = maximal_calls[0]
+        return CallSelection(call, rule_selector)
+
     def call_selection_for(self, hand, call_history, expected_call=None):
-        with Interpreter().create_history(call_history) as history:
+        with model.main_context_lock, Interpreter().create_history(call_history) as history:
             # Select highest-intra-bid-priority (category) rules for all possible bids
             rule_selector = RuleSelector(self.system, history, expected_call)
+            return self._call_selection_for_hand(rule_selector, hand, expected_call)
 
-            # Compute inter-bid priorities (priority) for each using the hand.
-            possible_calls = rule_selector.possible_calls_for_hand(hand, expected_call)
-            maximal_calls_and_priorities = possible_calls.maximal_calls_and_priorities()
-            # We don't currently support tie-breaking priorities, but we do have some bids that
-            # we don't make without a planner.
-            no_planning_filter = lambda call_priority_tuple: not rule_selector.rule_for_call(call_priority_tuple[0]).requires_planning
-            maximal_calls_and_priorities = filter(no_planning_filter, maximal_calls_and_priorities)
-            if not maximal_calls_and_priorities:
-                return None # If we failed to find any call, this is an error.
-            maximal_calls, maximal_priorities = zip(*maximal_calls_and_priorities)
-            if len(maximal_calls) != 1:
-                rules = map(rule_selector.rule_for_call, maximal_calls)
-                call_names = map(lambda call: call.name, maximal_calls)
-                print "WARNING: Unordered: %s rules: %s priorities: %s" % (call_names, rules, maximal_priorities)
-                return None
-
-            call = maximal_calls[0]
-            return CallSelection(call, rule_selector)
+    # Interprets call_history and compiles the meaning of each legal call once,
+    # then checks every hand against those same expressions.
+    def call_selections_for_hands(self, hands, call_history):
+        with model.main_context_lock, Interpreter().create_history(call_history) as history:
+            rule_selector = RuleSelector(self.system, history)
+            return [self._call_selection_for_hand(rule_selector, hand) for hand in hands]
 
     def find_call_for(self, hand, call_history, expected_call=None):
         call_selection = self.call_selection_for(hand, call_history, expected_call)
@@ -518,7 +722,7 @@ class RuleSelector(object):
     @memoized
     def _call_to_rule(self):
         maximal = {}
-        for rule in self.system.rules:
+        for rule in self.system.rule_index.rules_for(self.history.summary, self.history.legal_calls, self.expected_call):
             for category, call in rule.calls_over(self.history, self.expected_call):
                 if not self.history.call_history.is_legal_call(call):
                     continue
@@ -549,37 +753,96 @@ class RuleSelector(object):
     def rule_for_call(self, call):
         return self._call_to_rule.get(call)
 
+    # constraints_for_call needs the meaning of every other call, so we only
+    # want to ask each rule once.
+    @memoized
+    def _meaning_of(self, call):
+        return self.rule_for_call(call).meaning_of(self.history, call)
+
+    # Every meaning of every call, as a list of (priority, Or(meanings)) with
+    # one entry per distinct priority.
+    @property
+    @memoized
+    def _meanings_by_priority(self):
+        meanings_by_priority = {}
+        priorities = []
+        for unmade_call in self._call_to_rule:
+            for unmade_priority, unmade_z3_meaning in self._meaning_of(unmade_call):
+                if unmade_priority not in meanings_by_priority:
+                    meanings_by_priority[unmade_priority] = []
+                    priorities.append(unmade_priority)
+                meanings_by_priority[unmade_priority].append(unmade_z3_meaning)
+        return [(priority, z3.Or(meanings_by_priority[priority])) for priority in priorities]
+
+    # Making a call at priority means we could not make any higher priority
+    # call.  The per-priority disjunctions are shared by every call, so this
+    # is linear in the number of meanings rather than quadratic.
+    @memoized
+    def _negation_of_meanings_above(self, priority):
+        higher_meanings = [meanings for unmade_priority, meanings in self._meanings_by_priority
+            if self.system.priority_ordering.lt(priority, unmade_priority)]
+        if not higher_meanings:
+            return None
+        return z3.Not(z3.Or(higher_meanings))
+
+    def _explain_negations(self, call, priority):
+        rule = self.rule_for_call(call)
+        for unmade_call, unmade_rule in self._call_to_rule.iteritems():
+            for unmade_priority, unmade_z3_meaning in self._meaning_of(unmade_call):
+                if self.system.priority_ordering.lt(priority, unmade_priority):
+                    print "Adding negation %s (%s) to %s:" % (unmade_rule.name, unmade_call.name, rule.name)
+                    print " %s" % z3.simplify(z3.Not(unmade_z3_meaning))
+
     @memoized
     def constraints_for_call(self, call):
         situations = []
-        rule = self.rule_for_call(call)
-        for priority, z3_meaning in rule.meaning_of(self.history, call):
+        for priority, z3_meaning in self._meaning_of(call):
+            if self.explain and self.expected_call == call:
+                self._explain_negations(call, priority)
             situational_exprs = [z3_meaning]
-            for unmade_call, unmade_rule in self._call_to_rule.iteritems():
-                for unmade_priority, unmade_z3_meaning in unmade_rule.meaning_of(self.history, unmade_call):
-                    if self.system.priority_ordering.lt(priority, unmade_priority):
-                        if self.explain and self.expected_call == call:
-                            print "Adding negation %s (%s) to %s:" % (unmade_rule.name, unmade_call.name, rule.name)
-                            print " %s" % z3.simplify(z3.Not(unmade_z3_meaning))
-                        situational_exprs.append(z3.Not(unmade_z3_meaning))
+            negation = self._negation_of_meanings_above(priority)
+            if negation is not None:
+                situational_exprs.append(negation)
             situations.append(z3.And(situational_exprs))
 
         return z3.Or(situations)
 
-    def possible_calls_for_hand(self, hand, expected_call):
-        possible_calls = PossibleCalls(self.system.priority_ordering)
-        solver = _solver_pool.borrow_solver_for_hand(hand)
+    @property
+    @memoized
+    def _calls_priorities_and_meanings(self):
+        calls_priorities_and_meanings = []
         for call in self.history.legal_calls:
             rule = self.rule_for_call(call)
             if not rule:
                 continue
+            for priority, z3_meaning in self._meaning_of(call):
+                compiled_meaning = hand_evaluator.compile_expr(z3_meaning)
+                calls_priorities_and_meanings.append((call, priority, z3_meaning, compiled_meaning))
+        return calls_priorities_and_meanings
 
-            for priority, z3_meaning in rule.meaning_of(self.history, call):
-                if is_possible(solver, z3_meaning):
+    def possible_calls_for_hand(self, hand, expected_call):
+        possible_calls = PossibleCalls(self.system.priority_ordering)
+        hand_values = hand_evaluator.values_for_hand(hand)
+        solver = None
+        try:
+            for call, priority, z3_meaning, compiled_meaning in self._calls_priorities_and_meanings:
+                # The hand is known, so we can usually skip the solver entirely.
+                if compiled_meaning and not check_hand_evaluator:
+                    fits_hand = compiled_meaning.is_possible(hand_values)
+                else:
+                    if solver is None:
+                        solver = _current_solver_pool().borrow_solver_for_hand(hand)
+                    fits_hand = is_possible(solver, z3_meaning)
+                    if compiled_meaning:
+                        assert fits_hand == compiled_meaning.is_possible(hand_values), \
+                            "hand_evaluator disagrees with z3 about %s for %s" % (z3_meaning, hand.pretty_one_line())
+                if fits_hand:
                     possible_calls.add_call_with_priority(call, priority)
                 elif call == expected_call:
-                    print "%s does not fit hand: %s" % (rule, z3_meaning)
-        _solver_pool.restore(solver)
+                    print "%s does not fit hand: %s" % (self.rule_for_call(call), z3_meaning)
+        finally:
+            if solver is not None:
+                _current_solver_pool().restore(solver)
         return possible_calls
 
 
@@ -590,34 +853,135 @@ class InconsistentHistoryException(Exception):
         self.rule = rule
 
 
-class HistoryCache(object):
-    # FIXME: size_limit has not been tuned at all.
-    def __init__(self, size_limit=100):
-        self.lru = collections.deque(maxlen=size_limit)
+class _HistoryCacheNode(object):
+    def __init__(self, parent=None, call=None):
+        self.parent = parent
+        self.call = call
+        self.children = {}
+        self.history = None
+
 
-    # Python 3.2's functools has an @lru_cache decorator, but we can't use that yet.
+class HistoryCache(object):
+    def __init__(self, size_limit=1000):
+        self.size_limit = size_limit
+        self._root = _HistoryCacheNode()
+        # Nodes holding a History, least recently used first.
+        self._lru = collections.OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _touch(self, node):
+        del self._lru[node]
+        self._lru[node] = None
+
+    def _evict(self, node):
+        del self._lru[node]
+        # Otherwise its solver stays borrowed for as long as the History is
+        # memoized, which is forever.
+        node.history._release_solver()
+        node.history = None
+        self.evictions += 1
+        # Prune the branch back to the nearest node which is still useful.
+        while node.parent and node.history is None and not node.children:
+            del node.parent.children[node.call]
+            node = node.parent
+
+    # Walks the trie one call at a time, so lookup is linear in the length of
+    # the auction and independent of how many histories are cached.
     def lookup(self, call_history):
-        calls_string = call_history.calls_string()
-        best_match = ""
-        best_history = None
-        for call_string_and_history in self.lru:
-            key = call_string_and_history[0]
-            if len(key) > len(best_match) and calls_string.startswith(key):
-                best_match = key
-                best_history = call_string_and_history[1]
+        calls = call_history.calls
+        node = self._root
+        best_node = None
+        matched_count = 0
+        for index, call in enumerate(calls):
+            node = node.children.get(call)
+            if node is None:
+                break
+            if node.history is not None:
+                best_node = node
+                matched_count = index + 1
+
+        if best_node is None:
+            self.misses += 1
+            return History(), calls
+
+        if matched_count == len(calls):
+            self.hits += 1
+        else:
+            self.partial_hits += 1
+        self._touch(best_node)
+        return best_node.history, calls[matched_count:]
 
-        if len(best_match):
-            calls_matched = best_match.count(' ') + 1
-            return best_history, call_history.calls[calls_matched:]
+    def add(self, history):
+        node = self._root
+        for call in history.call_history.calls:
+            child = node.children.get(call)
+            if child is None:
+                child = _HistoryCacheNode(node, call)
+                node.children[call] = child
+            node = child
 
-        return History(), call_history.calls
+        if node.history is not None:
+            self._touch(node)
+        else:
+            self._lru[node] = None
+        node.history = history
 
-    def add(self, history):
-        call_string_and_history = (history.call_history.calls_string(), history)
-        self.lru.append(call_string_and_history)
+        while len(self._lru) > self.size_limit:
+            self._evict(next(iter(self._lru)))
 
 
 history_cache = HistoryCache()
+constraint_store = ConstraintStore()
+
+# Set by use_thread_contexts.
+_thread_state = None
+
+
+class _ThreadState(threading.local):
+    def __init__(self):
+        self.solver_pool = SolverPool(use_enumerator=_solver_pool.use_enumerator, use_thread_context=True,
+            configuration=_solver_pool.configuration)
+        self.history_cache = HistoryCache(history_cache.size_limit)
+
+
+# Lets several threads bid at once.  A History holds on to a solver from the
+# pool, and cached Histories keep theirs, so each thread gets a HistoryCache
+# of its own, and a SolverPool whose solvers live in the thread's own z3
+# Context.  Everything else still uses z3's main Context, so Bidder and
+# Interpreter hold model.main_context_lock, which those solvers release while
+# they check.  Anything else using Histories (e.g. dist/gae's handlers) must
+# hold it too.
+def use_thread_contexts():
+    global _thread_state
+    _thread_state = _ThreadState()
+
+
+def _current_solver_pool():
+    return _thread_state.solver_pool if _thread_state else _solver_pool
+
+
+def _current_history_cache():
+    return _thread_state.history_cache if _thread_state else history_cache
+
+# Optionally set to an interpretation_cache.InterpretationCache to persist
+# interpretations across processes and restarts, see use_interpretation_cache.
+interpretation_cache = None
+
+
+def use_interpretation_cache(path, solve_bounds=False):
+    # Imported here since few processes want sqlite.
+    from z3b.interpretation_cache import InterpretationCache
+    global interpretation_cache
+    interpretation_cache = InterpretationCache(path, solve_bounds=solve_bounds)
 
 
 class Interpreter(object):
@@ -625,7 +989,17 @@ class Interpreter(object):
         # Assuming SAYC for all sides.
         self.system = sayc.StandardAmericanYellowCard
 
+    # Both extend_history and create_history hold model.main_context_lock,
+    # see use_thread_contexts.
     def extend_history(self, history, call, explain=False):
+        with model.main_context_lock:
+            return self._extend_history(history, call, explain)
+
+    def create_history(self, call_history, explain=False):
+        with model.main_context_lock:
+            return self._create_history(call_history, explain)
+
+    def _extend_history(self, history, call, explain):
         if explain:
             print call.name
 
@@ -644,12 +1018,41 @@ class Interpreter(object):
             raise InconsistentHistoryException(annotations, constraints, rule)
 
         new_history = history.extend_with(call, annotations, constraints, rule)
-        history_cache.add(new_history)
+        _current_history_cache().add(new_history)
         return new_history
 
-    def create_history(self, call_history, explain=False):
-        history, remaining_calls = history_cache.lookup(call_history)
-        for call in remaining_calls:
+    def _extend_history_from_interpretation_cache(self, history, call, calls_string):
+        cached = interpretation_cache.lookup(calls_string)
+        if not cached:
+            return None
+        rule = self.system.rules_by_name[cached.rule_name] if cached.rule_name else None
+        new_history = history.extend_with(call, cached.annotations, cached.constraints, rule)
+        new_history._bounds.update(cached.bounds)
+        new_history._is_balanced = cached.is_balanced
+        _current_history_cache().add(new_history)
+        return new_history
+
+    def _add_to_interpretation_cache(self, history, calls_string):
+        # Solving everything up front costs a few checks now, even for
+        # interpretations nobody looks up, but saves every later process
+        # from having to build this History's solver.
+        if interpretation_cache.solve_bounds:
+            history.solve_all_bounds_for_position(positions.RHO)
+            history._solve_for_is_balanced()
+        interpretation_cache.add(calls_string, history)
+
+    def _create_history(self, call_history, explain):
+        history, remaining_calls = _current_history_cache().lookup(call_history)
+        # explain wants to see the RuleSelector work, so never use the cache.
+        use_interpretation_cache = interpretation_cache and not explain
+        interpreted_count = len(call_history.calls) - len(remaining_calls)
+        for index, call in enumerate(remaining_calls, interpreted_count + 1):
+            calls_string = call_history.copy_with_partial_history(index).calls_string()
+            if use_interpretation_cache:
+                cached_history = self._extend_history_from_interpretation_cache(history, call, calls_string)
+                if cached_history:
+                    history = cached_history
+                    continue
             try:
                 history = self.extend_history(history, call, explain=explain)
             except InconsistentHistoryException, e:
@@ -657,4 +1060,6 @@ class Interpreter(object):
                     print "WARNING: History is not consistent, ignoring %s from %s" % (call.name, e.rule)
                     print e.constraints
                 history = history.extend_with(call, [], model.NO_CONSTRAINTS, None)
+            if use_interpretation_cache:
+                self._add_to_interpretation_cache(history, calls_string)
         return history
@@ -0,0 +1,59 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import weakref
+import z3
+
+
+# What ConstraintStore.intern returns: a constraint as given, and as
+# simplified (shared with every other constraint which simplifies to the
+# same AST).
+class InternedConstraint(object):
+    def __init__(self, given, simplified):
+        self.given = given
+        self.simplified = simplified
+
+
+# Interns the constraints Histories are extended with.  Each is simplified
+# once, when first seen, and constraints which simplify to the same AST share
+# one simplified expression.  z3 hash-conses its ASTs, so structurally
+# identical expressions have the same get_id() for as long as one of them is
+# alive.
+#
+# The store only holds its entries weakly, so it is as big as the set of
+# Histories still alive (see memoized and HistoryCache) rather than every
+# History ever built.  Each InternedConstraint holds on to the expressions
+# it is looked up by, so their ids can't be recycled while it's in the store.
+class ConstraintStore(object):
+    def __init__(self):
+        # {ast id: InternedConstraint} for constraints as given.
+        self._by_given_id = weakref.WeakValueDictionary()
+        # {ast id: InternedConstraint} for constraints as simplified.
+        self._by_simplified_id = weakref.WeakValueDictionary()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    # The number of distinct simplified constraints still in use.
+    def __len__(self):
+        return len(self._by_simplified_id)
+
+    def intern(self, expr):
+        interned = self._by_given_id.get(expr.get_id())
+        if interned:
+            self.hits += 1
+            return interned
+
+        self.misses += 1
+        simplified = z3.simplify(expr)
+        sibling = self._by_simplified_id.get(simplified.get_id())
+        if sibling:
+            simplified = sibling.simplified
+        interned = InternedConstraint(expr, simplified)
+        if not sibling:
+            self._by_simplified_id[simplified.get_id()] = interned
+        self._by_given_id[expr.get_id()] = interned
+        return interned
@@ -13,6 +13,24 @@ class Constraint(object):
     def expr(self, history, call):
         raise NotImplementedError
 
+    # Returns a hashable tuple of every history (and call) feature expr reads,
+    # or None if expr can't be shared.  RuleCompiler reuses one expr for all
+    # histories with the same features, so this must cover everything expr
+    # depends on besides the Constraint's own (immutable) configuration.
+    def history_features(self, history, call):
+        return None
+
+
+def _features_for_child(constraint, history, call):
+    if isinstance(constraint, Constraint):
+        return constraint.history_features(history, call)
+    return ()
+
+
+def _features_for_children(constraints, history, call):
+    features = tuple(_features_for_child(constraint, history, call) for constraint in constraints)
+    return None if None in features else features
+
 
 class ConstraintAnd(Constraint):
     def __init__(self, *constraints):
@@ -21,6 +39,9 @@ class ConstraintAnd(Constraint):
     def expr(self, history, call):
         return z3.And([constraint.expr(history, call) if isinstance(constraint, Constraint) else constraint for constraint in self.constraints])
 
+    def history_features(self, history, call):
+        return _features_for_children(self.constraints, history, call)
+
 
 class ConstraintOr(Constraint):
     def __init__(self, *constraints):
@@ -29,6 +50,9 @@ class ConstraintOr(Constraint):
     def expr(self, history, call):
         return z3.Or([constraint.expr(history, call) if isinstance(constraint, Constraint) else constraint for constraint in self.constraints])
 
+    def history_features(self, history, call):
+        return _features_for_children(self.constraints, history, call)
+
 
 class ConstraintNot(Constraint):
     def __init__(self, constraint):
@@ -37,22 +61,32 @@ class ConstraintNot(Constraint):
     def expr(self, history, call):
         return z3.Not(self.constraint.expr(history, call))
 
+    def history_features(self, history, call):
+        return self.constraint.history_features(history, call)
+
 
 class MinimumCombinedLength(Constraint):
     def __init__(self, min_count, use_partners_last_suit=False):
         self.min_count = min_count
         self.use_partners_last_suit = use_partners_last_suit
 
-    def expr(self, history, call):
-        suit = call.strain
+    def _suit(self, history, call):
         if self.use_partners_last_suit:
             # We should assert here, except this is used to pass after a transfer accept (which is artificial)
             # assert annotations.Artificial not in history.partner.annotations_for_last_call
-            suit = history.partner.last_call.strain
+            return history.partner.last_call.strain
+        return call.strain
+
+    def expr(self, history, call):
+        suit = self._suit(history, call)
         partner_promised_length = history.partner.min_length(suit)
         implied_length = max(self.min_count - partner_promised_length, 0)
         return expr_for_suit(suit) >= implied_length
 
+    def history_features(self, history, call):
+        suit = self._suit(history, call)
+        return (suit, history.partner.min_length(suit))
+
 
 class MinimumCombinedPoints(Constraint):
     def __init__(self, min_points):
@@ -61,6 +95,9 @@ class MinimumCombinedPoints(Constraint):
     def expr(self, history, call):
         return model.points >= max(0, self.min_points - history.partner.min_points)
 
+    def history_features(self, history, call):
+        return (history.partner.min_points,)
+
 
 class MinimumCombinedSupportPoints(Constraint):
     def __init__(self, min_points, use_partners_last_suit=False):
@@ -76,6 +113,12 @@ class MinimumCombinedSupportPoints(Constraint):
         return z3.And(model.support_points_expr_for_suit(suit) >= implied_min_points,
                       model.playing_points >= implied_min_points)
 
+    def history_features(self, history, call):
+        if self.use_partners_last_suit:
+            return (history.partner.min_points, history.partner.last_call.strain,
+                annotations.Artificial in history.partner.annotations_for_last_call)
+        return (history.partner.min_points, call.strain)
+
 
 class MinimumSupportPointsForPartnersLastSuit(Constraint):
     def __init__(self, min_points):
@@ -86,6 +129,9 @@ class MinimumSupportPointsForPartnersLastSuit(Constraint):
         # assert annotations.Artificial not in history.partner.annotations_for_last_call
         return model.support_points_expr_for_suit(history.partner.last_call.strain) >= self.min_points
 
+    def history_features(self, history, call):
+        return (history.partner.last_call.strain,)
+
 
 class MaximumSupportPointsForPartnersLastSuit(Constraint):
     def __init__(self, max_points):
@@ -95,6 +141,9 @@ class MaximumSupportPointsForPartnersLastSuit(Constraint):
         assert annotations.Artificial not in history.partner.annotations_for_last_call
         return model.support_points_expr_for_suit(history.partner.last_call.strain) <= self.max_points
 
+    def history_features(self, history, call):
+        return (history.partner.last_call.strain, annotations.Artificial in history.partner.annotations_for_last_call)
+
 
 class MaximumCombinedPoints(Constraint):
     def __init__(self, max_points):
@@ -103,6 +152,9 @@ class MaximumCombinedPoints(Constraint):
     def expr(self, history, call):
         return model.points <= max(0, self.max_points - history.partner.max_points)
 
+    def history_features(self, history, call):
+        return (history.partner.max_points,)
+
 
 class MinLength(Constraint):
     def __init__(self, min_length, suits=None):
@@ -113,6 +165,9 @@ class MinLength(Constraint):
         suits = self.suits or [call.strain]
         return z3.And([expr_for_suit(suit) >= self.min_length for suit in suits])
 
+    def history_features(self, history, call):
+        return () if self.suits else (call.strain,)
+
 
 class MaxLength(Constraint):
     def __init__(self, max_length):
@@ -121,6 +176,9 @@ class MaxLength(Constraint):
     def expr(self, history, call):
         return expr_for_suit(call.strain) <= self.max_length
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 class MaxLengthInLastContractSuit(Constraint):
     def __init__(self, max_length):
@@ -129,6 +187,9 @@ class MaxLengthInLastContractSuit(Constraint):
     def expr(self, history, call):
         return expr_for_suit(history.last_contract.strain) <= self.max_length
 
+    def history_features(self, history, call):
+        return (history.last_contract.strain,)
+
 
 class MaxLengthInUnbidMajors(Constraint):
     def __init__(self, max_length):
@@ -137,6 +198,9 @@ class MaxLengthInUnbidMajors(Constraint):
     def expr(self, history, call):
         return z3.And([expr_for_suit(major) <= self.max_length for major in suit.MAJORS if major != call.strain])
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 # class AdditionalLength(Constraint):
 #     def __init__(self, additional_length):
@@ -155,6 +219,9 @@ class SupportForPartnerLastBid(Constraint):
         partner_suit = history.partner.last_call.strain
         return expr_for_suit(partner_suit) >= self._min_count
 
+    def history_features(self, history, call):
+        return (history.partner.last_call.strain,)
+
 
 class SupportForMultipleSuits(Constraint):
     def _four_in_almost_every_suit(self, missing_suit, suits):
@@ -175,6 +242,9 @@ class SupportForUnbidSuits(SupportForMultipleSuits):
         unbid_suits = history.unbid_suits
         return self._support_for_suits(history.unbid_suits, history)
 
+    def history_features(self, history, call):
+        return (tuple(history.unbid_suits),)
+
 
 # We support any suit partner has shown life in.  Used for cuebid responses to doubles.
 class SupportForPartnersSuits(SupportForMultipleSuits):
@@ -186,6 +256,9 @@ class SupportForPartnersSuits(SupportForMultipleSuits):
         partners_suits = set(suit.SUITS) - set(history.them.bid_suits)
         return self._support_for_suits(partners_suits, history)
 
+    def history_features(self, history, call):
+        return (frozenset(history.them.bid_suits),)
+
 
 class Unusual2NShape(Constraint):
     # 5-5 in two lowest unbid suits
@@ -193,6 +266,9 @@ class Unusual2NShape(Constraint):
         unbid_suits = sorted(list(history.unbid_suits))[:2]
         return z3.And([expr_for_suit(suit) >= 5 for suit in unbid_suits])
 
+    def history_features(self, history, call):
+        return (tuple(history.unbid_suits),)
+
 
 class StopperInRHOSuit(Constraint):
     def expr(self, history, call):
@@ -201,6 +277,9 @@ class StopperInRHOSuit(Constraint):
             return model.NO_CONSTRAINTS
         return model.stopper_expr_for_suit(rho_suit)
 
+    def history_features(self, history, call):
+        return (history.rho.last_call.strain,)
+
 
 class StoppersInUnbidSuits(Constraint):
     def expr(self, history, call):
@@ -208,6 +287,9 @@ class StoppersInUnbidSuits(Constraint):
             return model.NO_CONSTRAINTS
         return z3.And([model.stopper_expr_for_suit(suit) for suit in history.unbid_suits])
 
+    def history_features(self, history, call):
+        return (tuple(history.unbid_suits),)
+
 
 class StoppersInOpponentsSuits(Constraint):
     def expr(self, history, call):
@@ -215,11 +297,17 @@ class StoppersInOpponentsSuits(Constraint):
             return model.NO_CONSTRAINTS
         return z3.And([model.stopper_expr_for_suit(suit) for suit in history.them.bid_suits])
 
+    def history_features(self, history, call):
+        return (frozenset(history.them.bid_suits),)
+
 
 class Stopper(Constraint):
     def expr(self, history, call):
         return model.stopper_expr_for_suit(call.strain)
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 class LongestSuitExceptOpponentSuits(Constraint):
     def expr(self, history, call):
@@ -227,6 +315,9 @@ class LongestSuitExceptOpponentSuits(Constraint):
         # Including hearts >= hearts in this And doesn't hurt, but just reads funny when debugging.
         return z3.And([suit_expr >= expr_for_suit(suit) for suit in history.them.unbid_suits if suit != call.strain])
 
+    def history_features(self, history, call):
+        return (call.strain, frozenset(history.them.unbid_suits))
+
 
 class LongestOfPartnersSuits(Constraint):
     def expr(self, history, call):
@@ -237,6 +328,9 @@ class LongestOfPartnersSuits(Constraint):
         # Including hearts >= hearts in this And doesn't hurt, but just reads funny when debugging.
         return z3.And([suit_expr >= expr_for_suit(suit) for suit in history.partner.bid_suits if suit != call.strain])
 
+    def history_features(self, history, call):
+        return (call.strain, frozenset(history.partner.bid_suits))
+
 
 
 class TwoOfTheTopThree(Constraint):
@@ -248,6 +342,9 @@ class TwoOfTheTopThree(Constraint):
             model.two_of_the_top_three_spades,
         )[call.strain.index]
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 class ThreeOfTheTopFiveOrBetter(Constraint):
     def __init__(self, suit=None):
@@ -262,6 +359,9 @@ class ThreeOfTheTopFiveOrBetter(Constraint):
             model.three_of_the_top_five_spades_or_better,
         )[strain.index]
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 class ThirdRoundStopper(Constraint):
     def expr(self, history, call):
@@ -272,16 +372,25 @@ class ThirdRoundStopper(Constraint):
             model.third_round_stopper_spades,
         )[call.strain.index]
 
+    def history_features(self, history, call):
+        return (call.strain,)
+
 
 class OpeningRuleConstraint(Constraint):
+    def _is_early_position(self, history):
+        return history.rho.last_call is None or history.partner.last_call is None or history.lho.last_call is None
+
     def expr(self, history, call):
-        if history.rho.last_call is None or history.partner.last_call is None or history.lho.last_call is None:
+        if self._is_early_position(history):
             return model.rule_of_twenty
         # FIXME: We play rule-of-nineteen, but it's inconsistent with some test cases
         #if history.lho.last_call is None:
         #    return model.rule_of_nineteen
         return model.rule_of_fifteen
 
+    def history_features(self, history, call):
+        return (self._is_early_position(history),)
+
 
 class MinCombinedPointsForPartnerMinimumSuitedRebid(Constraint):
     def expr(self, history, call):
@@ -294,3 +403,6 @@ class MinCombinedPointsForPartnerMinimumSuitedRebid(Constraint):
         # NOTE: This math matches NaturalSuited (almost):
         expected_points = 19 + (rebid_level - 2) * 3
         return model.points >= expected_points - history.partner.min_points
+
+    def history_features(self, history, call):
+        return (call, history.partner.last_call.strain, history.partner.min_points)
@@ -0,0 +1,197 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from core import suit
+from core.deal import Deal
+from core.hand import CompactHand
+from z3b import hand_evaluator, model
+from z3b.model import positions
+import bisect
+import contextlib
+import itertools
+import random
+import z3
+
+
+# Deals hands consistent with what a History says about each position.
+#
+# Rejection sampling over Hand.random is hopeless for anything shapely, so
+# we first ask z3 which shapes (suit length 4-tuples) the constraints allow.
+# A candidate hand picks one of those shapes, weighted by how many hands of
+# that shape can be dealt from the remaining cards, and then random cards of
+# each suit.  That makes every hand with an allowed shape equally likely, so
+# keeping only candidates which satisfy the constraints (cheaply checked
+# against the compact hand's hcp, then with hand_evaluator) leaves each
+# consistent hand equally likely too.
+
+_all_cards_mask = (1 << 52) - 1
+_all_shapes = [lengths + (13 - sum(lengths),) for lengths in itertools.product(range(14), repeat=3) if sum(lengths) <= 13]
+_max_attempts = 10000
+
+
+def _choose(n, k):
+    if k < 0 or k > n:
+        return 0
+    result = 1
+    for index in range(k):
+        result = result * (n - index) / (index + 1)
+    return result
+
+
+def _hand_count(cards_by_suit, lengths):
+    count = 1
+    for cards, length in zip(cards_by_suit, lengths):
+        count *= _choose(len(cards), length)
+    return count
+
+
+def _cards_in_suit(card_mask, hand_suit):
+    offset = hand_suit.index * 13
+    return [offset + index for index in range(13) if (card_mask >> (offset + index)) & 1]
+
+
+class NoHandsException(Exception):
+    pass
+
+
+# Solvers come from solver_pool, by default the bidder's (so they follow
+# use_enumerator, use_solver_configuration and use_thread_contexts), and
+# like the bidder we only touch the main z3 Context under
+# model.main_context_lock.
+class HandSampler(object):
+    def __init__(self, constraints, random_state=None, solver_pool=None):
+        self.random_state = random_state or random.Random()
+        self._solver_pool = solver_pool
+        with model.main_context_lock:
+            self._expr = z3.And(constraints) if constraints else None
+            self._compiled_expr = hand_evaluator.compile_expr(self._expr) if self._expr is not None else None
+        self._shapes = None
+        self._hcp_range = (0, 37)
+
+    @contextlib.contextmanager
+    def _constrained_solver(self):
+        # Imported here since z3b.bidder builds the whole rule system.
+        from z3b import bidder
+        solver_pool = self._solver_pool or bidder._current_solver_pool()
+        with model.main_context_lock, solver_pool.borrowed() as solver:
+            if self._expr is not None:
+                solver.add(self._expr)
+            yield solver
+
+    # Every suit length 4-tuple (in SUITS order) the constraints allow.
+    @property
+    def shapes(self):
+        if self._shapes is None:
+            self._shapes = self._solve_for_shapes()
+        return self._shapes
+
+    def _solve_for_shapes(self):
+        if self._expr is None:
+            return _all_shapes
+
+        with self._constrained_solver() as solver:
+            length_exprs = map(model.expr_for_suit, suit.SUITS)
+            bounds = model.solve_for_bounds(solver,
+                minimize=[(expr, 0) for expr in length_exprs] + [(model.high_card_points, 0)],
+                maximize=[(expr, 13) for expr in length_exprs] + [(model.high_card_points, 37)],
+            )
+            if not bounds:
+                return []
+            mins, maxes = bounds
+            self._hcp_range = (mins[-1], maxes[-1])
+
+            shapes = []
+            length_ranges = [range(low, high + 1) for low, high in zip(mins[:-1], maxes[:-1])]
+            for lengths in itertools.product(*length_ranges[:3]):
+                lengths += (13 - sum(lengths),)
+                if not mins[3] <= lengths[3] <= maxes[3]:
+                    continue
+                shape_expr = z3.And([expr == length for expr, length in zip(length_exprs, lengths)])
+                if model.is_possible(solver, shape_expr):
+                    shapes.append(lengths)
+            return shapes
+
+    def _fits(self, hand):
+        low, high = self._hcp_range
+        if not low <= hand.high_card_points() <= high:
+            return False
+        if self._expr is None:
+            return True
+        if self._compiled_expr:
+            return self._compiled_expr.is_possible(hand_evaluator.values_for_hand(hand))
+        with self._constrained_solver() as solver:
+            return model.is_possible(solver, model.expr_for_hand(hand))
+
+    def _random_candidate(self, cards_by_suit, shapes, cumulative_weights):
+        index = bisect.bisect_right(cumulative_weights, self.random_state.random() * cumulative_weights[-1])
+        card_mask = 0
+        for cards, length in zip(cards_by_suit, shapes[index]):
+            for card_identifier in self.random_state.sample(cards, length):
+                card_mask |= 1 << card_identifier
+        return CompactHand(card_mask)
+
+    # Returns a CompactHand dealt from available_cards_mask, or raises
+    # NoHandsException if none seem to fit.
+    def random_hand(self, available_cards_mask=_all_cards_mask, max_attempts=_max_attempts):
+        cards_by_suit = [_cards_in_suit(available_cards_mask, hand_suit) for hand_suit in suit.SUITS]
+        shapes = []
+        cumulative_weights = []
+        total_weight = 0
+        for lengths in self.shapes:
+            weight = _hand_count(cards_by_suit, lengths)
+            if weight:
+                total_weight += weight
+                shapes.append(lengths)
+                cumulative_weights.append(total_weight)
+        if not shapes:
+            raise NoHandsException()
+
+        for _ in xrange(max_attempts):
+            hand = self._random_candidate(cards_by_suit, shapes, cumulative_weights)
+            if self._fits(hand):
+                return hand
+        raise NoHandsException()
+
+
+# Deals for the position to call next after a History, with every position's
+# hand consistent with the calls it has made.
+class Dealer(object):
+    def __init__(self, history, random_state=None):
+        self.history = history
+        self.random_state = random_state or random.Random()
+        self._samplers = {}
+
+    def sampler_for(self, position):
+        sampler = self._samplers.get(position.index)
+        if not sampler:
+            sampler = HandSampler(self.history.constraints_for_position(position), self.random_state)
+            self._samplers[position.index] = sampler
+        return sampler
+
+    def random_hand(self, position=positions.Me):
+        return self.sampler_for(position).random_hand()
+
+    # model.positions are relative to the position to call next (Me), and
+    # ordered RHO, Partner, LHO, Me.
+    def _core_position(self, position):
+        return self.history.call_history.position_to_call().position_after_n_calls(positions.Me.index - position.index)
+
+    def random_deal(self, max_attempts=100):
+        # The fewest possible shapes is a decent proxy for most constrained,
+        # and dealing those first leaves them the most cards to choose from.
+        ordered_positions = sorted(positions, key=lambda position: len(self.sampler_for(position).shapes))
+        for _ in xrange(max_attempts):
+            hands = [None] * len(positions)
+            available_cards_mask = _all_cards_mask
+            try:
+                for position in ordered_positions:
+                    # A position which fails here may just need other cards, so
+                    # we only try it briefly before dealing the others again.
+                    hand = self.sampler_for(position).random_hand(available_cards_mask, max_attempts=100)
+                    available_cards_mask &= ~hand.card_mask
+                    hands[self._core_position(position).index] = hand
+            except NoHandsException:
+                continue
+            return Deal(hands)
+        raise NoHandsException()
@@ -0,0 +1,653 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from core import suit
+from z3b import model
+import itertools
+import numpy
+import operator
+import z3
+
+
+# The hand model is finite: once the suit lengths and which of the AKQJT of
+# each suit are held are known, every other variable in model.axioms is
+# determined, except playing_points (see HandSetSolver).  So instead of asking
+# z3, we can list every such abstract hand (about 34 million of them) once and
+# answer questions about a set of constraints with the set of abstract hands
+# which satisfy them.
+#
+# The hands are grouped into blocks by shape and high card points, and each
+# block is padded to a whole number of bytes.  Most constraints only look at
+# lengths and points, which are the same for every hand in a block, so a
+# HandSet records for each block whether it holds all, none or some of its
+# hands, and only keeps a bit per hand for the blocks where it holds some.
+
+_honor_bits = dict(zip(model._honor_names, range(len(model._honor_names))))
+_mask_high_card_points = numpy.array([sum(value for bit, value in enumerate(model._honor_values) if mask & (1 << bit)) for mask in range(32)], dtype=numpy.int32)
+_mask_honor_counts = numpy.array([bin(mask).count('1') for mask in range(32)], dtype=numpy.int32)
+_byte_popcounts = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.int32)
+# Hands holding n of the 8 spot cards (2-9) in a suit.
+_spot_card_choices = numpy.array([reduce(operator.mul, range(8 - n + 1, 9), 1) / reduce(operator.mul, range(1, n + 1), 1) if n <= 8 else 0 for n in range(14)], dtype=numpy.int64)
+_max_playing_points = 55
+
+EMPTY, FULL, PARTIAL = 0, 1, 2
+
+
+def _shapes():
+    for lengths in itertools.product(range(14), repeat=3):
+        if sum(lengths) <= 13:
+            yield lengths + (13 - sum(lengths),)
+
+
+class HandUniverse(object):
+    def __init__(self):
+        masks_for_length = [numpy.array([mask for mask in range(32) if _mask_honor_counts[mask] <= length], dtype=numpy.uint8) for length in range(14)]
+        suit_masks = [[] for _ in suit.SUITS]
+        valid = []
+        block_lengths, block_high_card_points, block_sizes, block_hand_counts = [], [], [], []
+        for lengths in _shapes():
+            # Every combination of honors for this shape, sorted by points.
+            grids = numpy.meshgrid(*[masks_for_length[length] for length in lengths], indexing='ij')
+            masks = [grid.ravel() for grid in grids]
+            high_card_points = sum(_mask_high_card_points[mask] for mask in masks)
+            order = numpy.argsort(high_card_points, kind='mergesort')
+            masks = [mask[order] for mask in masks]
+            high_card_points = high_card_points[order]
+            hand_counts = reduce(operator.mul, [_spot_card_choices[length - _mask_honor_counts[mask]] for length, mask in zip(lengths, masks)])
+
+            points, starts, counts = numpy.unique(high_card_points, return_index=True, return_counts=True)
+            padded_counts = (counts + 7) // 8 * 8
+            padded_starts = numpy.concatenate(([0], numpy.cumsum(padded_counts)[:-1]))
+            block_of_hand = numpy.repeat(numpy.arange(len(points)), counts)
+            positions = padded_starts[block_of_hand] + numpy.arange(len(order)) - starts[block_of_hand]
+            for suit_index, mask in enumerate(masks):
+                padded_mask = numpy.zeros(padded_counts.sum(), dtype=numpy.uint8)
+                padded_mask[positions] = mask
+                suit_masks[suit_index].append(padded_mask)
+            padded_valid = numpy.zeros(padded_counts.sum(), dtype=bool)
+            padded_valid[positions] = True
+            valid.append(padded_valid)
+
+            block_lengths.extend([lengths] * len(points))
+            block_high_card_points.extend(points)
+            block_sizes.extend(padded_counts)
+            block_hand_counts.extend(numpy.add.reduceat(hand_counts, starts))
+
+        self.suit_masks = [numpy.concatenate(masks) for masks in suit_masks]
+        self.valid_bits = numpy.packbits(numpy.concatenate(valid))
+        self.size = len(self.suit_masks[0])
+        # Suit lengths are in SUITS order.
+        self.block_lengths = numpy.array(block_lengths, dtype=numpy.int32)
+        self.block_high_card_points = numpy.array(block_high_card_points, dtype=numpy.int32)
+        self.block_sizes = numpy.array(block_sizes, dtype=numpy.int64)
+        self.block_hand_counts = numpy.array(block_hand_counts, dtype=numpy.int64)
+        self.block_byte_sizes = self.block_sizes // 8
+        self.block_byte_starts = numpy.concatenate(([0], numpy.cumsum(self.block_byte_sizes)[:-1]))
+        self.block_valid_counts = numpy.add.reduceat(_byte_popcounts[self.valid_bits], self.block_byte_starts)
+        self.block_count = len(self.block_sizes)
+        self.block_starts = self.block_byte_starts * 8
+        self._block_columns = self._compute_block_columns()
+
+    def _compute_block_columns(self):
+        columns = {}
+        hcp = self.block_high_card_points
+        columns['high_card_points'] = hcp
+        columns['points'] = hcp
+        for count_name, count in (('void', 0), ('singleton', 1), ('doubleton', 2)):
+            suit_columns = [(self.block_lengths[:, hand_suit.index] == count).astype(numpy.int32) for hand_suit in suit.SUITS]
+            for hand_suit, column in zip(suit.SUITS, suit_columns):
+                columns["%s_in_%s" % (count_name, hand_suit.name.lower())] = column
+            columns[count_name + "s"] = sum(suit_columns)
+        for hand_suit in suit.SUITS:
+            length = self.block_lengths[:, hand_suit.index]
+            columns[hand_suit.name.lower()] = length
+            # Mirrors the points_supporting_* axioms in model.py.
+            shortness = columns['doubletons'] + numpy.where(length == 3, 2 * columns['singletons'] + 3 * columns['voids'], 3 * columns['singletons'] + 5 * columns['voids'])
+            columns['points_supporting_' + hand_suit.name.lower()] = numpy.where(length <= 2, hcp, hcp + shortness)
+        return columns
+
+    def is_block_variable(self, name):
+        return name in self._block_columns
+
+    def block_column(self, name):
+        return self._block_columns[name]
+
+    # The indices of the bytes (or with element_indices, the hands) of the
+    # blocks in block_mask, in order.
+    def byte_indices(self, block_mask):
+        return _concatenated_ranges(self.block_byte_starts[block_mask], self.block_byte_sizes[block_mask])
+
+    def element_indices(self, block_mask):
+        return _concatenated_ranges(self.block_starts[block_mask], self.block_sizes[block_mask])
+
+    # Looks up variables for the hands in the blocks of block_mask.
+    def columns_for(self, block_mask):
+        block_sizes = self.block_sizes[block_mask]
+        element_indices = self.element_indices(block_mask)
+        columns = {}
+
+        def column(name):
+            values = columns.get(name)
+            if values is None:
+                if self.is_block_variable(name):
+                    values = numpy.repeat(self._block_columns[name][block_mask], block_sizes)
+                else:
+                    honor_name, suit_name = name.split('_of_')
+                    hand_suit = suit.Suit.from_char(suit_name[0].upper())
+                    values = (self.suit_masks[hand_suit.index][element_indices] >> _honor_bits[honor_name]) & 1
+                columns[name] = values
+            return values
+        return column
+
+    # Looks up variables for every holding (0-31) of the honors of a single
+    # suit in each block of block_mask, in that order.
+    def columns_for_holdings(self, block_mask):
+        block_count = block_mask.sum()
+        holdings = numpy.tile(numpy.arange(32, dtype=numpy.uint8), block_count)
+        columns = {}
+
+        def column(name):
+            values = columns.get(name)
+            if values is None:
+                if self.is_block_variable(name):
+                    values = numpy.repeat(self._block_columns[name][block_mask], 32)
+                else:
+                    values = (holdings >> _honor_bits[name.split('_of_')[0]]) & 1
+                columns[name] = values
+            return values
+        return column
+
+    # For every hand of the blocks in block_mask, its index into the values
+    # columns_for_holdings would give.
+    def holding_indices(self, block_mask, suit_index):
+        block_sizes = self.block_sizes[block_mask]
+        local_blocks = numpy.repeat(numpy.arange(len(block_sizes), dtype=numpy.int32) * 32, block_sizes)
+        return local_blocks + self.suit_masks[suit_index][self.element_indices(block_mask)]
+
+
+# Hands are indexed with int32s, which is plenty and halves the memory.
+def _concatenated_ranges(starts, sizes):
+    offsets = numpy.cumsum(sizes) - sizes
+    return numpy.repeat((starts - offsets).astype(numpy.int32), sizes) + numpy.arange(sizes.sum(), dtype=numpy.int32)
+
+
+_universe = None
+
+
+# Listing every hand takes a few seconds and a few hundred MB, so we only do
+# it the first time it's needed.
+def universe():
+    global _universe
+    if _universe is None:
+        _universe = HandUniverse()
+    return _universe
+
+
+# An immutable set of abstract hands.  blocks holds EMPTY, FULL or PARTIAL for
+# every block, and partial_bits the bits of just the PARTIAL blocks, in order.
+# Constraints rarely leave many blocks PARTIAL, so sets stay small.
+class HandSet(object):
+    def __init__(self, blocks, partial_bits=None):
+        self.blocks = blocks
+        self.partial_bits = partial_bits if partial_bits is not None else numpy.zeros(0, dtype=numpy.uint8)
+
+    @classmethod
+    def from_block_mask(cls, block_mask):
+        return cls(numpy.broadcast_to(block_mask, (universe().block_count,)).astype(numpy.int8))
+
+    # The set with the blocks of block_mask (all EMPTY in blocks) filled in
+    # from bits, a byte string for just those blocks.
+    @classmethod
+    def _with_bits(cls, blocks, block_mask, bits):
+        hand_universe = universe()
+        if not len(bits):
+            return cls(blocks)
+        bits &= hand_universe.valid_bits[hand_universe.byte_indices(block_mask)]
+        byte_sizes = hand_universe.block_byte_sizes[block_mask]
+        counts = numpy.add.reduceat(_byte_popcounts[bits], numpy.cumsum(byte_sizes) - byte_sizes)
+        classes = numpy.where(counts == 0, EMPTY, numpy.where(counts == hand_universe.block_valid_counts[block_mask], FULL, PARTIAL)).astype(numpy.int8)
+        blocks[block_mask] = classes
+        return cls(blocks, bits[numpy.repeat(classes == PARTIAL, byte_sizes)])
+
+    # The bits of the blocks in block_mask.
+    def bits_for(self, block_mask):
+        hand_universe = universe()
+        byte_sizes = hand_universe.block_byte_sizes[block_mask]
+        blocks = self.blocks[block_mask]
+        bits = numpy.repeat(numpy.where(blocks == FULL, 0xFF, 0).astype(numpy.uint8), byte_sizes)
+        partial = self.blocks == PARTIAL
+        if partial.any():
+            wanted = numpy.repeat(block_mask[partial], hand_universe.block_byte_sizes[partial])
+            bits[numpy.repeat(blocks == PARTIAL, byte_sizes)] = self.partial_bits[wanted]
+        return bits
+
+    # The set with the blocks outside keep made EMPTY or FULL.
+    def _replacing_blocks(self, keep, replacement):
+        blocks = numpy.where(keep, self.blocks, replacement).astype(numpy.int8)
+        partial = self.blocks == PARTIAL
+        if not partial.any():
+            return HandSet(blocks)
+        return HandSet(blocks, self.partial_bits[numpy.repeat(keep[partial], universe().block_byte_sizes[partial])])
+
+    def has_partial_blocks(self):
+        return len(self.partial_bits) > 0
+
+    def __and__(self, other):
+        # Most constraints only mention lengths and points, so usually one
+        # side doesn't need looking at hand by hand.
+        if not other.has_partial_blocks():
+            return self._replacing_blocks(other.blocks != EMPTY, EMPTY)
+        if not self.has_partial_blocks():
+            return other._replacing_blocks(self.blocks != EMPTY, EMPTY)
+        full = (self.blocks == FULL) & (other.blocks == FULL)
+        combined = (self.blocks != EMPTY) & (other.blocks != EMPTY) & ~full
+        blocks = full.astype(numpy.int8)
+        return HandSet._with_bits(blocks, combined, self.bits_for(combined) & other.bits_for(combined))
+
+    def __or__(self, other):
+        if not other.has_partial_blocks():
+            return self._replacing_blocks(other.blocks != FULL, FULL)
+        if not self.has_partial_blocks():
+            return other._replacing_blocks(self.blocks != FULL, FULL)
+        full = (self.blocks == FULL) | (other.blocks == FULL)
+        combined = ((self.blocks == PARTIAL) | (other.blocks == PARTIAL)) & ~full
+        blocks = full.astype(numpy.int8)
+        return HandSet._with_bits(blocks, combined, self.bits_for(combined) | other.bits_for(combined))
+
+    def __invert__(self):
+        partial = self.blocks == PARTIAL
+        blocks = numpy.where(partial, PARTIAL, self.blocks == EMPTY).astype(numpy.int8)
+        return HandSet(blocks, ~self.partial_bits & universe().valid_bits[universe().byte_indices(partial)])
+
+    def is_empty(self):
+        # PARTIAL blocks always hold at least one hand.
+        return not self.blocks.any()
+
+    def nonempty_blocks(self):
+        return self.blocks != EMPTY
+
+    # Which hands of the nonempty blocks are in the set.  FULL blocks have
+    # every bit set, so the padding has to be masked off.
+    def element_mask(self):
+        block_mask = self.nonempty_blocks()
+        bits = self.bits_for(block_mask) & universe().valid_bits[universe().byte_indices(block_mask)]
+        return numpy.unpackbits(bits).astype(bool)
+
+    # The number of abstract hands in the set.
+    def __len__(self):
+        hand_universe = universe()
+        full_count = hand_universe.block_valid_counts[self.blocks == FULL].sum()
+        return int(full_count + _byte_popcounts[self.partial_bits].sum())
+
+    # The number of 13 card hands in the set, out of 635013559600.
+    def hand_count(self):
+        hand_universe = universe()
+        count = hand_universe.block_hand_counts[self.blocks == FULL].sum()
+        partial = self.blocks == PARTIAL
+        if partial.any():
+            element_mask = numpy.unpackbits(self.partial_bits).astype(bool)
+            indices = hand_universe.element_indices(partial)[element_mask]
+            blocks = numpy.repeat(numpy.flatnonzero(partial), hand_universe.block_sizes[partial])[element_mask]
+            hand_counts = numpy.ones(len(indices), dtype=numpy.int64)
+            for hand_suit in suit.SUITS:
+                spot_cards = hand_universe.block_lengths[blocks, hand_suit.index] - _mask_honor_counts[hand_universe.suit_masks[hand_suit.index][indices]]
+                hand_counts *= _spot_card_choices[spot_cards]
+            count += hand_counts.sum()
+        return int(count)
+
+
+def _fold(function, values):
+    return reduce(function, values)
+
+
+_boolean_operators = {
+    z3.Z3_OP_AND: numpy.logical_and,
+    z3.Z3_OP_OR: numpy.logical_or,
+}
+
+_binary_operators = {
+    z3.Z3_OP_EQ: operator.eq,
+    z3.Z3_OP_IFF: operator.eq,
+    z3.Z3_OP_XOR: operator.ne,
+    z3.Z3_OP_LE: operator.le,
+    z3.Z3_OP_LT: operator.lt,
+    z3.Z3_OP_GE: operator.ge,
+    z3.Z3_OP_GT: operator.gt,
+}
+
+_folded_operators = {
+    z3.Z3_OP_ADD: operator.add,
+    z3.Z3_OP_SUB: operator.sub,
+    z3.Z3_OP_MUL: operator.mul,
+}
+
+# Where each comparison with a constant can start to differ, as cuts between
+# playing_points values: op(playing_points, c) is the same for every value
+# in [cut, next cut).
+_cuts_for_comparison = {
+    z3.Z3_OP_GE: lambda constant: [constant],
+    z3.Z3_OP_GT: lambda constant: [constant + 1],
+    z3.Z3_OP_LE: lambda constant: [constant + 1],
+    z3.Z3_OP_LT: lambda constant: [constant],
+    z3.Z3_OP_EQ: lambda constant: [constant, constant + 1],
+}
+
+_flipped_comparisons = {
+    z3.Z3_OP_GE: z3.Z3_OP_LE,
+    z3.Z3_OP_GT: z3.Z3_OP_LT,
+    z3.Z3_OP_LE: z3.Z3_OP_GE,
+    z3.Z3_OP_LT: z3.Z3_OP_GT,
+    z3.Z3_OP_EQ: z3.Z3_OP_EQ,
+}
+
+
+# Maps an expr id to (expr, variable names, playing_points cuts).  As in
+# hand_evaluator, holding the expr keeps its id from being recycled.
+_analysis_by_id = {}
+# Maps (expr id, playing_points or None) to (expr, HandSet) for exprs which
+# only mention block variables, and for the honor constraints hand_set_for
+# has had to check across most of the universe.
+_block_hand_sets = {}
+_cache_size_limit = 10000
+_honor_hand_sets = {}
+_honor_cache_byte_limit = 256 * 1024 * 1024
+_honor_cache_bytes = 0
+# Honor constraints are checked hand by hand for sets with fewer than
+# 1/_direct_evaluation_ratio of all hands' blocks.
+_direct_evaluation_ratio = 16
+# The number of hands _evaluate_within looks at in one go.
+_chunk_size = 1 << 20
+
+
+def _analyze(expr):
+    expr_id = expr.get_id()
+    analysis = _analysis_by_id.get(expr_id)
+    if analysis:
+        return analysis
+    kind = expr.decl().kind()
+    if kind == z3.Z3_OP_UNINTERPRETED and expr.num_args() == 0:
+        variable_names = frozenset([expr.decl().name()])
+        cuts = frozenset()
+    else:
+        children = map(_analyze, expr.children())
+        variable_names = frozenset().union(*[names for _, names, _ in children])
+        cuts = frozenset().union(*[child_cuts for _, _, child_cuts in children])
+        if 'playing_points' in variable_names:
+            cuts |= _playing_points_cuts(expr, kind)
+    analysis = (expr, variable_names, cuts)
+    _analysis_by_id[expr_id] = analysis
+    return analysis
+
+
+def _is_playing_points(expr):
+    return z3.is_const(expr) and expr.decl().name() == 'playing_points'
+
+
+# Our rules only ever compare playing_points with constants.  For anything
+# else we fall back to trying every value.
+def _playing_points_cuts(expr, kind):
+    if kind not in _cuts_for_comparison or z3.is_bool(expr.arg(0)):
+        return frozenset()
+    lhs, rhs = expr.children()
+    if _is_playing_points(rhs):
+        lhs, rhs = rhs, lhs
+        kind = _flipped_comparisons[kind]
+    if _is_playing_points(lhs) and rhs.decl().kind() == z3.Z3_OP_ANUM:
+        return frozenset(_cuts_for_comparison[kind](rhs.as_long()))
+    return frozenset(range(1, _max_playing_points + 1))
+
+
+def _variable_names(expr):
+    return _analyze(expr)[1]
+
+
+def _mentions_honors(expr):
+    hand_universe = universe()
+    return any(not hand_universe.is_block_variable(name) for name in _variable_names(expr) if name != 'playing_points')
+
+
+# Evaluates expr with the given value of playing_points, looking up other
+# variables with column (for every block, or every hand of some blocks).
+def _evaluate(expr, column, playing_points):
+    kind = expr.decl().kind()
+    if kind == z3.Z3_OP_ANUM:
+        return expr.as_long()
+    if kind == z3.Z3_OP_TRUE:
+        return True
+    if kind == z3.Z3_OP_FALSE:
+        return False
+    if kind == z3.Z3_OP_UNINTERPRETED and expr.num_args() == 0:
+        name = expr.decl().name()
+        if name == 'playing_points':
+            return playing_points
+        return column(name)
+
+    children = [_evaluate(child, column, playing_points) for child in expr.children()]
+    if kind in _boolean_operators:
+        return _fold(_boolean_operators[kind], children)
+    if kind == z3.Z3_OP_NOT:
+        return numpy.logical_not(children[0])
+    if kind == z3.Z3_OP_IMPLIES:
+        return numpy.logical_or(numpy.logical_not(children[0]), children[1])
+    if kind == z3.Z3_OP_ITE:
+        return numpy.where(*children)
+    if kind == z3.Z3_OP_DISTINCT:
+        return _fold(numpy.logical_and, [operator.ne(lhs, rhs) for lhs, rhs in itertools.combinations(children, 2)])
+    if kind == z3.Z3_OP_UMINUS:
+        return -children[0]
+    if kind in _binary_operators:
+        return _binary_operators[kind](*children)
+    if kind in _folded_operators:
+        return _fold(_folded_operators[kind], children)
+    raise ValueError("Unsupported expression: %s" % expr)
+
+
+def _cache_key(expr, playing_points):
+    return (expr.get_id(), playing_points if 'playing_points' in _variable_names(expr) else None)
+
+
+def _block_hand_set_for(expr, playing_points):
+    key = _cache_key(expr, playing_points)
+    cached = _block_hand_sets.get(key)
+    if cached:
+        return cached[1]
+    hand_set = HandSet.from_block_mask(_evaluate(expr, universe().block_column, playing_points))
+    if len(_block_hand_sets) > _cache_size_limit:
+        _block_hand_sets.clear()
+    _block_hand_sets[key] = (expr, hand_set)
+    return hand_set
+
+
+def _honor_suit_indices(expr):
+    hand_universe = universe()
+    return set(suit.Suit.from_char(name.split('_of_')[1][0].upper()).index for name in _variable_names(expr) if name != 'playing_points' and not hand_universe.is_block_variable(name))
+
+
+def _element_bits(expr, playing_points, block_mask):
+    hand_universe = universe()
+    suit_indices = _honor_suit_indices(expr)
+    if len(suit_indices) == 1:
+        # Every hand of a block with the same honors in this suit gets the
+        # same answer, so there are only 32 to work out per block.
+        suit_index = suit_indices.pop()
+        values = _evaluate(expr, hand_universe.columns_for_holdings(block_mask), playing_points)
+        values = numpy.broadcast_to(values, (block_mask.sum() * 32,))
+        element_mask = values[hand_universe.holding_indices(block_mask, suit_index)]
+    else:
+        element_mask = numpy.broadcast_to(_evaluate(expr, hand_universe.columns_for(block_mask), playing_points), (hand_universe.block_sizes[block_mask].sum(),))
+    return numpy.packbits(element_mask)
+
+
+def _evaluate_within(expr, playing_points, within):
+    hand_universe = universe()
+    block_mask = within.nonempty_blocks()
+    # Working through the blocks a chunk at a time keeps the temporary
+    # arrays small, which matters much more than the number of numpy calls.
+    block_ids = numpy.flatnonzero(block_mask)
+    chunk_ends = numpy.cumsum(hand_universe.block_sizes[block_ids]) // _chunk_size
+    bits = []
+    for chunk in numpy.split(block_ids, numpy.flatnonzero(numpy.diff(chunk_ends)) + 1):
+        chunk_mask = numpy.zeros(hand_universe.block_count, dtype=bool)
+        chunk_mask[chunk] = True
+        bits.append(_element_bits(expr, playing_points, chunk_mask))
+    blocks = numpy.zeros(hand_universe.block_count, dtype=numpy.int8)
+    return HandSet._with_bits(blocks, block_mask, numpy.concatenate(bits) & within.bits_for(block_mask))
+
+
+# Checking every hand of the universe is slow, so we remember the answer for
+# honor constraints while they fit in _honor_cache_byte_limit.
+def _honor_hand_set_for(expr, playing_points):
+    global _honor_cache_bytes
+    key = _cache_key(expr, playing_points)
+    cached = _honor_hand_sets.get(key)
+    if cached:
+        return cached[1]
+    hand_set = _evaluate_within(expr, playing_points, _all_hands())
+    if _honor_cache_bytes + hand_set.partial_bits.nbytes > _honor_cache_byte_limit:
+        _honor_hand_sets.clear()
+        _honor_cache_bytes = 0
+    _honor_hand_sets[key] = (expr, hand_set)
+    _honor_cache_bytes += hand_set.partial_bits.nbytes
+    return hand_set
+
+
+# The hands of within which satisfy expr, for playing_points in an interval
+# where none of expr's comparisons with it change.  Only the blocks within
+# holds are ever looked at hand by hand.
+def hand_set_for(expr, playing_points=_max_playing_points, within=None):
+    expr = _analyze(expr)[0]
+    if within is None:
+        within = _all_hands()
+    if not _mentions_honors(expr):
+        return within & _block_hand_set_for(expr, playing_points)
+    if within.is_empty():
+        return within
+
+    kind = expr.decl().kind()
+    # Keep the parts which only mention lengths and points at block level.
+    if kind == z3.Z3_OP_AND:
+        for child in expr.children():
+            within = hand_set_for(child, playing_points, within)
+        return within
+    if kind == z3.Z3_OP_OR:
+        return _fold(operator.or_, [hand_set_for(child, playing_points, within) for child in expr.children()])
+    if kind == z3.Z3_OP_NOT:
+        return within & ~hand_set_for(expr.children()[0], playing_points, within)
+
+    hand_universe = universe()
+    if hand_universe.block_sizes[within.nonempty_blocks()].sum() * _direct_evaluation_ratio < hand_universe.size:
+        return _evaluate_within(expr, playing_points, within)
+    return within & _honor_hand_set_for(expr, playing_points)
+
+
+def _all_hands():
+    return HandSet.from_block_mask(True)
+
+
+def _hands_with_at_most(high_card_points):
+    return HandSet.from_block_mask(universe().block_column('high_card_points') <= high_card_points)
+
+
+# The playing_points intervals (lo, hi) which cuts splits [lo, hi] into.
+def _split_interval(lo, hi, cuts):
+    starts = [lo] + sorted(cut for cut in cuts if lo < cut <= hi)
+    return zip(starts, [start - 1 for start in starts[1:]] + [hi])
+
+
+# A drop-in for the z3 solvers History uses, see model.is_possible and
+# model.solve_for_bounds.  playing_points is only bounded by the axioms to
+# [high_card_points, 55], so each scope holds a list of (lo, hi, HandSet):
+# the hands which satisfy the constraints for some playing_points in [lo, hi]
+# (and at least their high_card_points).  The intervals are split wherever a
+# constraint compares playing_points with a constant, so every constraint
+# has the same value throughout each one.
+class HandSetSolver(object):
+    def __init__(self):
+        self._scopes = [[(0, _max_playing_points, _all_hands())]]
+
+    def push(self):
+        self._scopes.append(list(self._scopes[-1]))
+
+    def pop(self):
+        self._scopes.pop()
+
+    def _split(self, intervals, cuts):
+        if not cuts:
+            return intervals
+        split_intervals = []
+        for lo, hi, hand_set in intervals:
+            for split_lo, split_hi in _split_interval(lo, hi, cuts):
+                split_set = hand_set if split_hi == hi else hand_set & _hands_with_at_most(split_hi)
+                split_intervals.append((split_lo, split_hi, split_set))
+        return split_intervals
+
+    def _constrained(self, intervals, expr):
+        _, _, cuts = _analyze(expr)
+        constrained = []
+        for lo, hi, hand_set in self._split(intervals, cuts):
+            hand_set = hand_set_for(expr, lo, hand_set)
+            if not hand_set.is_empty():
+                constrained.append((lo, hi, hand_set))
+        return constrained
+
+    def add(self, *exprs):
+        for expr in exprs:
+            if isinstance(expr, (list, tuple)):
+                self.add(*expr)
+            else:
+                self._scopes[-1] = self._constrained(self._scopes[-1], expr)
+
+    def is_possible(self, expr):
+        return bool(self._constrained(self._scopes[-1], expr))
+
+    def check(self):
+        return z3.sat if self._scopes[-1] else z3.unsat
+
+    # The hands for which some playing_points satisfies the constraints.
+    def hand_set(self):
+        intervals = self._scopes[-1]
+        if not intervals:
+            return HandSet.from_block_mask(False)
+        return _fold(operator.or_, [hand_set for _, _, hand_set in intervals])
+
+    def _values(self, expr, hand_set, playing_points):
+        block_mask = hand_set.nonempty_blocks()
+        if _mentions_honors(expr):
+            values = _evaluate(expr, universe().columns_for(block_mask), playing_points)
+            return numpy.broadcast_to(values, (universe().block_sizes[block_mask].sum(),))[hand_set.element_mask()]
+        values = _evaluate(expr, universe().block_column, playing_points)
+        return numpy.broadcast_to(values, (universe().block_count,))[block_mask]
+
+    def _bounds(self, expr):
+        if _is_playing_points(expr):
+            intervals = self._scopes[-1]
+            # Each hand can take any playing_points from max(lo, its hcp) to hi.
+            lowest = min(max(lo, universe().block_high_card_points[hand_set.nonempty_blocks()].min()) for lo, _, hand_set in intervals)
+            return lowest, max(hi for _, hi, _ in intervals)
+        if 'playing_points' not in _variable_names(expr):
+            values = self._values(expr, self.hand_set(), None)
+            return values.min(), values.max()
+        values = []
+        for lo, hi, hand_set in self._scopes[-1]:
+            for playing_points in range(lo, hi + 1):
+                values.extend(self._values(expr, hand_set & _hands_with_at_most(playing_points), playing_points))
+        return min(values), max(values)
+
+    # Matches model.solve_for_bounds, but exact rather than a search.
+    def solve_for_bounds(self, minimize=(), maximize=()):
+        if not self._scopes[-1]:
+            return None
+        mins = [int(self._bounds(expr)[0]) for expr, _ in minimize]
+        maxes = [int(self._bounds(expr)[1]) for expr, _ in maximize]
+        return mins, maxes
+
+    def hand_count(self):
+        return self.hand_set().hand_count()
+
+
+# How many 13 card hands satisfy all of constraints.
+def hand_count(constraints):
+    solver = HandSetSolver()
+    solver.add(constraints)
+    return solver.hand_count()
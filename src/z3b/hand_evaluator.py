@@ -0,0 +1,187 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from core import suit
+from z3b import model
+import operator
+import z3
+
+
+# Once the hand is known every variable in model.axioms has a single value,
+# except playing_points, which the axioms only bound to [hcp, 55].  So instead
+# of asking a solver whether a meaning fits a hand, we compute those values in
+# Python and evaluate the meaning directly, trying each playing_points value
+# when the meaning mentions it.
+
+_max_playing_points = 55
+
+
+def _support_points(length, hcp, doubletons, singletons, voids):
+    # Mirrors the points_supporting_* axioms in model.py.
+    if length <= 2:
+        return hcp
+    if length == 3:
+        return hcp + doubletons + 2 * singletons + 3 * voids
+    return hcp + doubletons + 3 * singletons + 5 * voids
+
+
+def values_for_hand(hand):
+    values = {}
+    lengths = hand.suit_lengths()
+    for hand_suit, length in zip(suit.SUITS, lengths):
+        suit_name = hand_suit.name.lower()
+        values[suit_name] = length
+        for honor_name, has_honor in zip(model._honor_names, hand.honors_in_suit(hand_suit)):
+            values["%s_of_%s" % (honor_name, suit_name)] = has_honor
+        for count_name, count in (('void', 0), ('singleton', 1), ('doubleton', 2)):
+            values["%s_in_%s" % (count_name, suit_name)] = int(length == count)
+
+    hcp = hand.high_card_points()
+    values['high_card_points'] = hcp
+    values['points'] = hcp
+    values['playing_points'] = hcp
+    values['voids'], values['singletons'], values['doubletons'] = hand.shortness_counts()
+    for hand_suit, length in zip(suit.SUITS, lengths):
+        values['points_supporting_' + hand_suit.name.lower()] = _support_points(
+            length, hcp, values['doubletons'], values['singletons'], values['voids'])
+    return values
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+def _fold(function, evaluators):
+    return lambda values: reduce(function, [evaluator(values) for evaluator in evaluators])
+
+
+def _all(evaluators):
+    return lambda values: all(evaluator(values) for evaluator in evaluators)
+
+
+def _any(evaluators):
+    return lambda values: any(evaluator(values) for evaluator in evaluators)
+
+
+def _distinct(evaluators):
+    def evaluate(values):
+        results = [evaluator(values) for evaluator in evaluators]
+        return len(set(results)) == len(results)
+    return evaluate
+
+
+def _ite(condition, if_true, if_false):
+    return lambda values: if_true(values) if condition(values) else if_false(values)
+
+
+_binary_operators = {
+    z3.Z3_OP_EQ: operator.eq,
+    z3.Z3_OP_IFF: operator.eq,
+    z3.Z3_OP_XOR: operator.ne,
+    z3.Z3_OP_LE: operator.le,
+    z3.Z3_OP_LT: operator.lt,
+    z3.Z3_OP_GE: operator.ge,
+    z3.Z3_OP_GT: operator.gt,
+}
+
+_folded_operators = {
+    z3.Z3_OP_ADD: operator.add,
+    z3.Z3_OP_SUB: operator.sub,
+    z3.Z3_OP_MUL: operator.mul,
+}
+
+
+# Maps an expr id to (expr, evaluator, variable names) for every expression
+# and subexpression compiled so far.  z3 hash-conses its ASTs, so identical
+# meanings built for different Histories share an id and get compiled only
+# once.  Holding the expr keeps its id from being recycled.
+_compiled_by_id = {}
+# Cleared when it grows past this, so a long-running server can't leak.
+_compiled_size_limit = 100000
+
+
+def _compile(expr):
+    expr_id = expr.get_id()
+    compiled = _compiled_by_id.get(expr_id)
+    if compiled:
+        return compiled
+    evaluator, variable_names = _compile_uncached(expr)
+    compiled = (expr, evaluator, variable_names)
+    _compiled_by_id[expr_id] = compiled
+    return compiled
+
+
+def _compile_uncached(expr):
+    kind = expr.decl().kind()
+    if kind == z3.Z3_OP_ANUM:
+        value = expr.as_long()
+        return (lambda values: value), frozenset()
+    if kind == z3.Z3_OP_TRUE:
+        return (lambda values: True), frozenset()
+    if kind == z3.Z3_OP_FALSE:
+        return (lambda values: False), frozenset()
+    if kind == z3.Z3_OP_UNINTERPRETED and expr.num_args() == 0:
+        name = expr.decl().name()
+        return (lambda values: values[name]), frozenset([name])
+
+    compiled_children = map(_compile, expr.children())
+    children = [evaluator for _, evaluator, _ in compiled_children]
+    variable_names = frozenset().union(*[names for _, _, names in compiled_children])
+    return _evaluator_for(kind, children, expr), variable_names
+
+
+def _evaluator_for(kind, children, expr):
+    if kind == z3.Z3_OP_AND:
+        return _all(children)
+    if kind == z3.Z3_OP_OR:
+        return _any(children)
+    if kind == z3.Z3_OP_NOT:
+        child = children[0]
+        return lambda values: not child(values)
+    if kind == z3.Z3_OP_IMPLIES:
+        premise, conclusion = children
+        return lambda values: not premise(values) or conclusion(values)
+    if kind == z3.Z3_OP_ITE:
+        return _ite(*children)
+    if kind == z3.Z3_OP_DISTINCT:
+        return _distinct(children)
+    if kind == z3.Z3_OP_UMINUS:
+        child = children[0]
+        return lambda values: -child(values)
+    if kind in _binary_operators:
+        function = _binary_operators[kind]
+        lhs, rhs = children
+        return lambda values: function(lhs(values), rhs(values))
+    if kind in _folded_operators:
+        return _fold(_folded_operators[kind], children)
+    raise UnsupportedExpression(expr)
+
+
+class CompiledExpr(object):
+    def __init__(self, expr):
+        self.expr, self._evaluate, self.variable_names = _compile(expr)
+
+    def evaluate(self, values):
+        return self._evaluate(values)
+
+    # Equivalent to model.is_possible on a solver holding the axioms and
+    # model.expr_for_hand for the hand values came from.
+    def is_possible(self, values):
+        if 'playing_points' not in self.variable_names:
+            return self._evaluate(values)
+        values = dict(values)
+        for playing_points in range(values['high_card_points'], _max_playing_points + 1):
+            values['playing_points'] = playing_points
+            if self._evaluate(values):
+                return True
+        return False
+
+
+def compile_expr(expr):
+    if len(_compiled_by_id) > _compiled_size_limit:
+        _compiled_by_id.clear()
+    try:
+        return CompiledExpr(expr)
+    except UnsupportedExpression:
+        return None
@@ -0,0 +1,120 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from core import suit
+from z3b import model
+from z3b.preconditions import annotations
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import z3
+
+
+# Any edit to the bidder (or to the core classes it builds on) can change
+# how a call is interpreted, so we version cached interpretations by the
+# source of the whole z3b and core packages.
+def _source_version():
+    src_dir = os.path.dirname(os.path.dirname(__file__))
+    sha = hashlib.sha1()
+    for package in ('core', 'z3b'):
+        for path in sorted(glob.glob(os.path.join(src_dir, package, '*.py'))):
+            with open(path) as source_file:
+                sha.update(source_file.read())
+    return sha.hexdigest()
+
+
+def _model_decls():
+    # The axioms mention every variable in the model, which is all that
+    # serialized constraints can refer to.
+    decls = {}
+    exprs = list(model.axioms)
+    while exprs:
+        expr = exprs.pop()
+        if z3.is_const(expr) and expr.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+            decls[expr.decl().name()] = expr
+        exprs.extend(expr.children())
+    return decls
+
+
+class CachedInterpretation(object):
+    def __init__(self, rule_name, annotations, constraints, bounds, is_balanced):
+        self.rule_name = rule_name
+        self.annotations = annotations
+        self.constraints = constraints
+        self.bounds = bounds
+        self.is_balanced = is_balanced
+
+
+# Maps a call sequence to how the Interpreter understood its last call (the
+# rule, annotations and constraints) along with the bounds solved for the
+# resulting History.  Unlike HistoryCache this lives in an sqlite file, so it
+# survives restarts and is shared between processes.  With solve_bounds set,
+# every interpretation added has all of RHO's bounds solved first, so that
+# later processes can skip those checks too.
+class InterpretationCache(object):
+    def __init__(self, path, version=None, solve_bounds=False):
+        self.path = path
+        self.version = version or _source_version()
+        self.solve_bounds = solve_bounds
+        self._local = threading.local()
+        self._decls = None
+
+    # sqlite connections can't be shared across a fork, nor by default
+    # between threads, so each thread of each process (e.g. every
+    # multiprocessing worker, or server thread) opens its own.
+    def _connection(self):
+        connection_and_pid = getattr(self._local, 'connection_and_pid', None)
+        if connection_and_pid and connection_and_pid[1] == os.getpid():
+            return connection_and_pid[0]
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("""CREATE TABLE IF NOT EXISTS interpretations (
+            version TEXT NOT NULL,
+            calls TEXT NOT NULL,
+            rule_name TEXT,
+            annotations TEXT NOT NULL,
+            constraints TEXT NOT NULL,
+            bounds TEXT NOT NULL,
+            is_balanced INTEGER,
+            PRIMARY KEY (version, calls))""")
+        self._local.connection_and_pid = (connection, os.getpid())
+        return connection
+
+    def _parse_constraints(self, smtlib_string):
+        if self._decls is None:
+            self._decls = _model_decls()
+        return z3.parse_smt2_string("(assert %s)" % smtlib_string, decls=self._decls)
+
+    def lookup(self, calls_string):
+        row = self._connection().execute(
+            "SELECT rule_name, annotations, constraints, bounds, is_balanced FROM interpretations WHERE version = ? AND calls = ?",
+            (self.version, calls_string)).fetchone()
+        if not row:
+            return None
+        rule_name, annotation_keys, constraints, bounds, is_balanced = row
+        bounds = dict(((suit.SUITS[index] if index is not None else None, is_max), value)
+            for index, is_max, value in json.loads(bounds))
+        return CachedInterpretation(
+            rule_name=rule_name,
+            annotations=set(map(annotations.get, json.loads(annotation_keys))),
+            constraints=self._parse_constraints(constraints),
+            bounds=bounds,
+            is_balanced=bool(is_balanced) if is_balanced is not None else None,
+        )
+
+    def add(self, calls_string, history):
+        rule = history._rule_for_last_call
+        bounds = [(key.index if key is not None else None, is_max, value) for (key, is_max), value in history._bounds.items()]
+        self._connection().execute(
+            "INSERT OR REPLACE INTO interpretations VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                self.version,
+                calls_string,
+                rule.name if rule else None,
+                json.dumps(sorted(annotation.key for annotation in history._annotations_for_last_call)),
+                history._constraints_for_last_call.sexpr(),
+                json.dumps(bounds),
+                history._is_balanced,
+            ))
@@ -3,7 +3,11 @@
 # found in the LICENSE file.
 
 from z3b import enum
+import contextlib
 import core.suit as suit
+import operator
+import threading
+import time
 import z3
 
 
@@ -46,6 +50,24 @@ doubleton_in_spades, doubleton_in_hearts, doubleton_in_diamonds, doubleton_in_cl
 
 voids, singletons, doubletons = z3.Ints('voids singletons doubletons')
 
+# An upper bound (not always the least) on each variable, given the axioms.
+# They are all at least 0.  See BitVecTranslator.
+variable_maximums = dict(
+    [(str(suit_count), 13) for suit_count in (clubs, diamonds, hearts, spades)]
+    + [(str(honor), 1) for honor_suit in suit.SUITS for honor in _honor_vars(honor_suit)]
+    + [(str(count), 1) for count in (
+        void_in_spades, void_in_hearts, void_in_diamonds, void_in_clubs,
+        singleton_in_spades, singleton_in_hearts, singleton_in_diamonds, singleton_in_clubs,
+        doubleton_in_spades, doubleton_in_hearts, doubleton_in_diamonds, doubleton_in_clubs,
+    )]
+    + [(str(count), 4) for count in (voids, singletons, doubletons)]
+    + [(str(high_card_points), 37), (str(points), 37), (str(playing_points), 55)]
+    # high_card_points + doubletons + 3 * singletons + 5 * voids
+    + [(str(supporting), 37 + 4 + 3 * 4 + 5 * 4) for supporting in (
+        points_supporting_spades, points_supporting_hearts, points_supporting_diamonds, points_supporting_clubs,
+    )]
+)
+
 
 def named_count_expr(count_name, count):
     exprs = []
@@ -196,41 +218,11 @@ def support_points_expr_for_suit(suit):
 
 
 def expr_for_hand(hand):
-    cards_in_spades = hand.cards_in_suit(suit.SPADES)
-    cards_in_hearts = hand.cards_in_suit(suit.HEARTS)
-    cards_in_diamonds = hand.cards_in_suit(suit.DIAMONDS)
-    cards_in_clubs = hand.cards_in_suit(suit.CLUBS)
-
-    return z3.And(
-        spades == len(cards_in_spades),
-        hearts == len(cards_in_hearts),
-        diamonds == len(cards_in_diamonds),
-        clubs == len(cards_in_clubs),
-
-        ace_of_spades == int('A' in cards_in_spades),
-        king_of_spades == int('K' in cards_in_spades),
-        queen_of_spades == int('Q' in cards_in_spades),
-        jack_of_spades == int('J' in cards_in_spades),
-        ten_of_spades == int('T' in cards_in_spades),
-
-        ace_of_hearts == int('A' in cards_in_hearts),
-        king_of_hearts == int('K' in cards_in_hearts),
-        queen_of_hearts == int('Q' in cards_in_hearts),
-        jack_of_hearts == int('J' in cards_in_hearts),
-        ten_of_hearts == int('T' in cards_in_hearts),
-
-        ace_of_diamonds == int('A' in cards_in_diamonds),
-        king_of_diamonds == int('K' in cards_in_diamonds),
-        queen_of_diamonds == int('Q' in cards_in_diamonds),
-        jack_of_diamonds == int('J' in cards_in_diamonds),
-        ten_of_diamonds == int('T' in cards_in_diamonds),
-
-        ace_of_clubs == int('A' in cards_in_clubs),
-        king_of_clubs == int('K' in cards_in_clubs),
-        queen_of_clubs == int('Q' in cards_in_clubs),
-        jack_of_clubs == int('J' in cards_in_clubs),
-        ten_of_clubs == int('T' in cards_in_clubs),
-    )
+    hand_suits = (suit.SPADES, suit.HEARTS, suit.DIAMONDS, suit.CLUBS)
+    exprs = [expr_for_suit(hand_suit) == hand.length_of_suit(hand_suit) for hand_suit in hand_suits]
+    for hand_suit in hand_suits:
+        exprs.extend(honor_var == has_honor for honor_var, has_honor in zip(_honor_vars(hand_suit), hand.honors_in_suit(hand_suit)))
+    return z3.And(*exprs)
 
 
 positions = enum.Enum(
@@ -241,17 +233,421 @@ positions = enum.Enum(
 )
 
 
+# Wraps a z3 solver so that repeated queries are answered with
+# check(assumptions) instead of push()/add()/check()/pop().  The second time
+# an expression is queried it is asserted once, guarded by a fresh boolean
+# literal, and every later query of it just assumes that literal.  Since
+# nothing is popped between those queries, the solver keeps the lemmas it
+# learned answering earlier ones.  Expressions which are only ever queried
+# once (most of the meanings checked against a hand) still use push/pop, as
+# guarding them would only grow the solver.
+class AssumptionSolver(object):
+    def __init__(self, solver):
+        self._solver = solver
+        # One {expr id: (expr, literal)} dict per push() scope, since pop()
+        # also discards the guarded assertions added within that scope.
+        # The literal is None for expressions we have only queried once.
+        self._literal_scopes = [{}]
+
+    def __getattr__(self, name):
+        return getattr(self._solver, name)
+
+    def push(self):
+        self._solver.push()
+        self._literal_scopes.append({})
+
+    def pop(self):
+        self._solver.pop()
+        self._literal_scopes.pop()
+
+    def _lookup(self, expr_id):
+        for literals in reversed(self._literal_scopes):
+            expr_and_literal = literals.get(expr_id)
+            if expr_and_literal:
+                return expr_and_literal
+        return None
+
+    def _check_once(self, expr):
+        self._solver.push()
+        self._solver.add(expr)
+        result = self._solver.check()
+        self._solver.pop()
+        return result
+
+    def is_possible(self, expr):
+        # z3 hash-conses its ASTs, so structurally identical expressions
+        # share an id for as long as one of them is alive.  We hold on to
+        # the expression to keep its id from being recycled.
+        expr_id = expr.get_id()
+        expr_and_literal = self._lookup(expr_id)
+        if not expr_and_literal:
+            self._literal_scopes[-1][expr_id] = (expr, None)
+            return self._check_once(expr) == z3.sat
+        literal = expr_and_literal[1]
+        if literal is None:
+            literal = z3.FreshBool('assume')
+            self._solver.add(z3.Implies(literal, expr))
+            self._literal_scopes[-1][expr_id] = (expr, literal)
+        return self._solver.check(literal) == z3.sat
+
+
+# Every expression here, and every one the rules build from them, lives in
+# z3's main Context.  Like any z3 Context it mustn't be used by two threads
+# at once, so threads which bid concurrently hold main_context_lock while
+# they do, see z3b.bidder.use_thread_contexts.  It is reentrant, and
+# released() lets it go entirely while a thread works in its own Context.
+class MainContextLock(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def __enter__(self):
+        depth = self._depth()
+        if not depth:
+            self._lock.acquire()
+        self._local.depth = depth + 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.depth -= 1
+        if not self._local.depth:
+            self._lock.release()
+
+    @contextlib.contextmanager
+    def released(self):
+        depth = self._depth()
+        if depth:
+            self._local.depth = 0
+            self._lock.release()
+        try:
+            yield
+        finally:
+            if depth:
+                self._lock.acquire()
+                self._local.depth = depth
+
+
+main_context_lock = MainContextLock()
+
+
+# Translates expressions from the main Context into ctx.  The same meanings
+# are asked about over and over, so translations are remembered (holding the
+# expr keeps its id from being recycled).
+class ContextTranslator(object):
+    cache_size_limit = 20000
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self._translations = {}
+
+    def translate(self, expr):
+        expr_id = expr.get_id()
+        translation = self._translations.get(expr_id)
+        if translation is None:
+            if len(self._translations) > self.cache_size_limit:
+                self._translations.clear()
+            translation = (expr, expr.translate(self.ctx))
+            self._translations[expr_id] = translation
+        return translation[1]
+
+
+_bit_vec_ops = {
+    z3.Z3_OP_AND: z3.And,
+    z3.Z3_OP_OR: z3.Or,
+    z3.Z3_OP_NOT: z3.Not,
+    z3.Z3_OP_IMPLIES: z3.Implies,
+    z3.Z3_OP_XOR: z3.Xor,
+    z3.Z3_OP_ITE: z3.If,
+    z3.Z3_OP_DISTINCT: z3.Distinct,
+    z3.Z3_OP_EQ: operator.eq,
+    z3.Z3_OP_IFF: operator.eq,
+    # Python's comparisons of bit-vectors are the signed ones.
+    z3.Z3_OP_LE: operator.le,
+    z3.Z3_OP_LT: operator.lt,
+    z3.Z3_OP_GE: operator.ge,
+    z3.Z3_OP_GT: operator.gt,
+    z3.Z3_OP_ADD: lambda *args: reduce(operator.add, args),
+    z3.Z3_OP_SUB: lambda *args: reduce(operator.sub, args),
+    z3.Z3_OP_MUL: lambda *args: reduce(operator.mul, args),
+    z3.Z3_OP_UMINUS: operator.neg,
+}
+
+
+def _product_range(low, high, other_low, other_high):
+    products = [low * other_low, low * other_high, high * other_low, high * other_high]
+    return min(products), max(products)
+
+
+# The range of a op b, given the ranges of a and b.
+_bit_vec_range_ops = {
+    z3.Z3_OP_ADD: lambda low, high, other_low, other_high: (low + other_low, high + other_high),
+    z3.Z3_OP_SUB: lambda low, high, other_low, other_high: (low - other_high, high - other_low),
+    z3.Z3_OP_MUL: _product_range,
+}
+
+
+# Translates expressions over our Ints into ctx (or the main Context, if
+# None) with every Int as a bit-vector of bit_width bits.  Bit-vector
+# arithmetic wraps around, and the axioms alone (e.g. suit lengths are only
+# >= 0 and sum to 13) leave room for it to, so each variable is an unsigned
+# bit-vector just wide enough for its variable_maximums, zero-extended to
+# bit_width.  We then know the range of every term, and refuse any which
+# might not fit in bit_width bits, so both encodings have the same models.
+# Unlike ContextTranslator we translate node by node, remembering every
+# node, as the rules share most of theirs.
+class BitVecTranslator(object):
+    cache_size_limit = 100000
+
+    def __init__(self, bit_width, ctx=None):
+        self.bit_width = bit_width
+        self.ctx = ctx
+        self._min_value = -(1 << (bit_width - 1))
+        self._max_value = (1 << (bit_width - 1)) - 1
+        # {ast id: (expr, translation, (min, max) or None for Bools)}
+        self._translations = {}
+
+    def translate(self, expr):
+        if len(self._translations) > self.cache_size_limit:
+            self._translations.clear()
+        return self._translate(expr)[0]
+
+    # The translation of expr and the range of its values.
+    def _translate(self, expr):
+        expr_id = expr.get_id()
+        translation = self._translations.get(expr_id)
+        if translation is None:
+            translation = (expr,) + self._encode(expr)
+            self._translations[expr_id] = translation
+        return translation[1:]
+
+    def _encode(self, expr):
+        if z3.is_true(expr) or z3.is_false(expr):
+            return z3.BoolVal(z3.is_true(expr), self.ctx), None
+        if z3.is_int_value(expr):
+            value = expr.as_long()
+            return z3.BitVecVal(value, self.bit_width, self.ctx), self._checked_range(expr, value, value)
+        if z3.is_const(expr):
+            name = expr.decl().name()
+            if z3.is_int(expr):
+                assert name in variable_maximums, "No maximum for %s, see variable_maximums" % name
+                variable_bits = variable_maximums[name].bit_length()
+                variable = z3.BitVec(name, variable_bits, self.ctx)
+                return z3.ZeroExt(self.bit_width - variable_bits, variable), self._checked_range(expr, 0, (1 << variable_bits) - 1)
+            assert z3.is_bool(expr), "Can't encode %s as a bit-vector" % expr
+            return z3.Bool(name, self.ctx), None
+        kind = expr.decl().kind()
+        op = _bit_vec_ops.get(kind)
+        assert op, "Can't encode %s as a bit-vector" % expr
+        args, ranges = zip(*map(self._translate, expr.children()))
+        args = list(args)
+        # Without a Context as their last argument, these assume the main one.
+        if op in (z3.And, z3.Or):
+            args.append(self.ctx or z3.main_ctx())
+        return op(*args), self._range(expr, kind, ranges)
+
+    def _range(self, expr, kind, ranges):
+        if not z3.is_int(expr):
+            return None
+        if kind == z3.Z3_OP_ITE:
+            ranges = ranges[1:]
+            return self._checked_range(expr, min(low for low, _ in ranges), max(high for _, high in ranges))
+        if kind == z3.Z3_OP_UMINUS:
+            low, high = ranges[0]
+            return self._checked_range(expr, -high, -low)
+        # Each partial result has to fit too.
+        low, high = ranges[0]
+        for other_low, other_high in ranges[1:]:
+            low, high = self._checked_range(expr, *_bit_vec_range_ops[kind](low, high, other_low, other_high))
+        return low, high
+
+    def _checked_range(self, expr, low, high):
+        assert self._min_value <= low and high <= self._max_value, "%s may not fit in %s bits" % (expr, self.bit_width)
+        return low, high
+
+
+class _TranslatingModel(object):
+    def __init__(self, model, translator):
+        self._model = model
+        self._translator = translator
+
+    def eval(self, expr, model_completion=False):
+        value = self._model.eval(self._translator.translate(expr), model_completion)
+        # Callers expect the Int they asked about.
+        if z3.is_bv_value(value):
+            return z3.IntVal(value.as_signed_long())
+        return value
+
+
+# A solver which takes expressions from the main Context, and has translator
+# translate them for solver.  check() does the real work, and if solver is
+# in a Context of its own, releases main_context_lock (and, inside z3, the
+# GIL) so that other threads can carry on meanwhile.
+class ContextSolver(object):
+    def __init__(self, translator, solver):
+        self._translator = translator
+        self._solver = solver
+
+    def add(self, *exprs):
+        for expr in exprs:
+            if isinstance(expr, (list, tuple)):
+                self.add(*expr)
+            else:
+                self._solver.add(self._translator.translate(expr))
+
+    def push(self):
+        self._solver.push()
+
+    def pop(self):
+        self._solver.pop()
+
+    def check(self, *assumptions):
+        assumptions = map(self._translator.translate, assumptions)
+        if self._translator.ctx is None:
+            return self._solver.check(*assumptions)
+        with main_context_lock.released():
+            return self._solver.check(*assumptions)
+
+    def model(self):
+        return _TranslatingModel(self._solver.model(), self._translator)
+
+
+# Records how long each check() takes, in seconds, in latencies.
+class TimedSolver(object):
+    def __init__(self, solver, latencies):
+        self._solver = solver
+        self._latencies = latencies
+
+    def __getattr__(self, name):
+        return getattr(self._solver, name)
+
+    def check(self, *assumptions):
+        start = time.time()
+        result = self._solver.check(*assumptions)
+        self._latencies.append(time.time() - start)
+        return result
+
+
+# How a SolverPool's solvers encode and solve constraints.  encoding is 'int'
+# or 'bitvec' (see BitVecTranslator).  The solver is z3's for logic, unless
+# tactics names a chain of tactics to build one from.  params are set on it,
+# e.g. {'arith.solver': 2} for plain simplex.
+class SolverConfiguration(object):
+    def __init__(self, logic='QF_LIA', encoding='int', bit_width=10, tactics=None, params=None):
+        assert encoding in ('int', 'bitvec'), "Unknown encoding %s" % encoding
+        self.logic = logic
+        self.encoding = encoding
+        self.bit_width = bit_width
+        self.tactics = tactics
+        self.params = params or {}
+
+    # None when expressions can be used as they are.
+    def translator(self, ctx=None):
+        if self.encoding == 'bitvec':
+            return BitVecTranslator(self.bit_width, ctx)
+        return ContextTranslator(ctx) if ctx else None
+
+    def solver(self, ctx=None):
+        if self.tactics:
+            tactics = [z3.Tactic(name, ctx) for name in self.tactics]
+            solver = reduce(z3.Then, tactics).solver()
+        else:
+            solver = z3.SolverFor(self.logic, ctx=ctx)
+        for name, value in sorted(self.params.items()):
+            solver.set(name, value)
+        return solver
+
+
+# See scripts/benchmark-solvers for how they compare.
+solver_configurations = {
+    'lia': SolverConfiguration(),
+    'lia-simplex': SolverConfiguration(params={'arith.solver': 2}),
+    'smt': SolverConfiguration(logic=None, tactics=['simplify', 'solve-eqs', 'smt']),
+    'bv': SolverConfiguration(logic='QF_BV', encoding='bitvec'),
+    'fd': SolverConfiguration(logic='QF_FD', encoding='bitvec'),
+    # z3 4.5's 'sat' tactic finds bogus models after 'bit-blast', so we
+    # leave bit-blasting to 'qfbv'.
+    'qfbv': SolverConfiguration(logic=None, encoding='bitvec', tactics=['qfbv']),
+}
+default_solver_configuration = 'lia'
+
+
 def is_certain(solver, expr):
-    solver.push()
-    solver.add(z3.Not(expr))
-    result = solver.check() == z3.unsat
-    solver.pop()
-    return result
+    return not is_possible(solver, z3.Not(expr))
 
 
 def is_possible(solver, expr):
+    # AssumptionSolver and enumerator.HandSetSolver answer for themselves.
+    if hasattr(solver, 'is_possible'):
+        return solver.is_possible(expr)
     solver.push()
     solver.add(expr)
     result = solver.check() == z3.sat
     solver.pop()
     return result
+
+
+def _model_with(solver, expr):
+    solver.push()
+    solver.add(expr)
+    model = solver.model() if solver.check() == z3.sat else None
+    solver.pop()
+    return model
+
+
+# Finds the minimum of each (expr, floor) in minimize and the maximum of each
+# (expr, ceiling) in maximize together, as one simultaneous binary search.
+# Each check asks whether *any* unresolved bound can reach the midpoint of
+# its remaining range.  A model improves the witnessed value of every expr it
+# beats, while unsat halves every remaining range at once, so the number of
+# checks grows with the widest range rather than with the number of exprs.
+# Returns (mins, maxes) in the order given, or None if the solver is unsat.
+def solve_for_bounds(solver, minimize=(), maximize=()):
+    if hasattr(solver, 'solve_for_bounds'):
+        return solver.solve_for_bounds(minimize, maximize)
+    # Each bound is [expr, sign, proven, witnessed], with sign -1 for minimums
+    # so that both directions can be searched as maximums of sign * expr.
+    # proven is the best value not yet ruled out, witnessed the best seen.
+    bounds = [[expr, -1, -floor, None] for expr, floor in minimize]
+    bounds += [[expr, 1, ceiling, None] for expr, ceiling in maximize]
+
+    def witness(model, bounds):
+        for bound in bounds:
+            expr, sign, _, witnessed = bound
+            signed_value = sign * model.eval(expr, model_completion=True).as_long()
+            if witnessed is None or signed_value > witnessed:
+                bound[3] = signed_value
+
+    def model_reaching(bounds, targets):
+        goals = [expr >= target if sign > 0 else expr <= -target
+            for (expr, sign, _, _), target in zip(bounds, targets)]
+        return _model_with(solver, z3.Or(goals) if len(goals) > 1 else goals[0])
+
+    # Bounds commonly sit right at their limits (e.g. a min_length of 0), so
+    # we first check for that directly, which is often all we need.
+    model = model_reaching(bounds, [proven for _, _, proven, _ in bounds])
+    if not model:
+        for bound in bounds:
+            bound[2] -= 1
+        if solver.check() != z3.sat:
+            return None
+        model = solver.model()
+    witness(model, bounds)
+
+    while True:
+        unresolved = [bound for bound in bounds if bound[3] < bound[2]]
+        if not unresolved:
+            break
+        # The midpoint rounds up so that it is always beyond the witness.
+        midpoints = [(witnessed + proven + 1) / 2 for _, _, proven, witnessed in unresolved]
+        model = model_reaching(unresolved, midpoints)
+        if model:
+            witness(model, unresolved)
+            continue
+        for bound, midpoint in zip(unresolved, midpoints):
+            bound[2] = midpoint - 1
+
+    mins = [-witnessed for _, _, _, witnessed in bounds[:len(minimize)]]
+    maxes = [witnessed for _, _, _, witnessed in bounds[len(minimize):]]
+    return mins, maxes
@@ -157,6 +157,9 @@ class SufficientCombinedPoints(Constraint):
             min_points = points_for_sound_suited_bid_at_level[call.level]
         return points >= max(0, min_points - history.partner.min_points)
 
+    def history_features(self, history, call):
+        return (call, history.partner.min_points)
+
 
 class SufficientCombinedLength(MinimumCombinedLength):
     def __init__(self):
@@ -168,6 +171,11 @@ class SufficientCombinedLength(MinimumCombinedLength):
             return NO_CONSTRAINTS
         return MinimumCombinedLength.expr(self, history, call)
 
+    def history_features(self, history, call):
+        if call.strain == suit.NOTRUMP:
+            return (call.strain,)
+        return MinimumCombinedLength.history_features(self, history, call)
+
 
 class LengthSatisfiesLawOfTotalTricks(Constraint):
     def expr(self, history, call):
@@ -175,6 +183,9 @@ class LengthSatisfiesLawOfTotalTricks(Constraint):
         my_count = call.level + 6 - history.partner.min_length(call.strain)
         return expr_for_suit(call.strain) >= my_count
 
+    def history_features(self, history, call):
+        return (call, history.partner.min_length(call.strain))
+
 
 class Natural(Rule):
     category = categories.Natural
@@ -212,11 +223,19 @@ class SufficientStoppers(Constraint):
             return call.level > last_contract.level + 1
         return call.level > last_contract.level
 
+    def _needs_stoppers(self, history, call):
+        return self._is_jump(history.last_contract, call) and not history.partner.is_balanced
+
     def expr(self, history, call):
-        if self._is_jump(history.last_contract, call) and not history.partner.is_balanced:
+        if self._needs_stoppers(history, call):
             return StoppersInOpponentsSuits().expr(history, call)
         return NO_CONSTRAINTS
 
+    def history_features(self, history, call):
+        if self._needs_stoppers(history, call):
+            return (True, frozenset(history.them.bid_suits))
+        return (False,)
+
 
 class NaturalNotrump(SoundNaturalBid):
     preconditions = WeHaveShownMorePointsThanThem()
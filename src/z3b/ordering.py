@@ -1,5 +1,4 @@
 import functools
-import networkx
 
 class Ordering(object):
     @functools.total_ordering
@@ -15,13 +14,40 @@ class Ordering(object):
             return self._ordering.lt(self._item, other._item)
 
     def __init__(self):
-        self._graph = networkx.DiGraph()
+        # A DAG as a map from each item to the set of items directly above it.
+        # Items appear in the order they were first ordered.
+        self._higher_items = {}
+        self._items = []
         self._compiled = True
+        # Set by _compile: a dense id for every item, in topological order,
+        # and for each id a bitset of the ids of every item above it.
+        self._ids = {}
+        self._items_by_id = []
+        self._reachable = []
+        self._bits = []
 
     def lt(self, left, right):
-        self._compile()
-
-        return self._graph.has_edge(left, right)
+        if not self._compiled:
+            self._compile()
+
+        # Items we've never been told about are unordered (id -1), and edges
+        # always point up the topological order.
+        left_id = self._ids.get(left, -1)
+        right_id = self._ids.get(right, -1)
+        if left_id < 0 or right_id <= left_id:
+            return False
+        return self._reachable[left_id] & self._bits[right_id] != 0
+
+    # Every item above item, in topological order.
+    def items_above(self, item):
+        if not self._compiled:
+            self._compile()
+
+        item_id = self._ids.get(item, -1)
+        if item_id < 0:
+            return []
+        reachable = self._reachable[item_id]
+        return [self._items_by_id[higher_id] for higher_id in range(item_id + 1, len(self._items_by_id)) if reachable & self._bits[higher_id]]
 
     def key(self, item):
         return Ordering.OrderedItem(self, item)
@@ -37,25 +63,65 @@ class Ordering(object):
         for i in range(len(args)-1):
             for lower in self._iterate(args[i]):
                 for higher in self._iterate(args[i+1]):
-                    self._graph.add_edge(lower, higher)
+                    self._add_edge(lower, higher)
 
         return result
 
+    def _add_item(self, item):
+        if item not in self._higher_items:
+            self._higher_items[item] = set()
+            self._items.append(item)
+
+    def _add_edge(self, lower, higher):
+        self._add_item(lower)
+        self._add_item(higher)
+        self._higher_items[lower].add(higher)
+
+    # The declared (lower, higher) pairs, not their transitive closure.
+    def edges(self):
+        for lower in self._items:
+            for higher in self._higher_items[lower]:
+                yield lower, higher
+
+    def _topological_order(self):
+        lower_counts = dict((item, 0) for item in self._items)
+        for higher_items in self._higher_items.itervalues():
+            for higher in higher_items:
+                lower_counts[higher] += 1
+
+        ready = [item for item in self._items if not lower_counts[item]]
+        topological_order = []
+        while ready:
+            item = ready.pop()
+            topological_order.append(item)
+            for higher in self._higher_items[item]:
+                lower_counts[higher] -= 1
+                if not lower_counts[higher]:
+                    ready.append(higher)
+
+        # Items on a cycle never run out of lower items.
+        assert len(topological_order) == len(self._items), "Cycle detected"
+        return topological_order
+
     def _compile(self):
         if self._compiled:
             return
 
-        for left in self._graph.nodes_iter():
-            for right in networkx.descendants(self._graph, left):
-                self._graph.add_edge(left, right)
-
-        self._check_cycles()
+        # Rather than materializing the transitive closure as edges, we
+        # accumulate reachability bitsets from the top of the order down.
+        topological_order = self._topological_order()
+        self._ids = dict((item, index) for index, item in enumerate(topological_order))
+        self._items_by_id = topological_order
+        self._reachable = [0] * len(topological_order)
+        self._bits = [1 << index for index in range(len(topological_order))]
+        for index in reversed(range(len(topological_order))):
+            reachable = 0
+            for higher in self._higher_items[topological_order[index]]:
+                higher_id = self._ids[higher]
+                reachable |= self._reachable[higher_id] | self._bits[higher_id]
+            self._reachable[index] = reachable
         self._compiled = True
 
-    def _check_cycles(self):
-        if not networkx.is_directed_acyclic_graph(self._graph):
-            assert False, "Cycle detected"
-
     def _iterate(self, list_or_not):
         try:
             for item in list_or_not:
@@ -4,6 +4,7 @@
 
 from z3b import enum
 from core import suit
+from z3b.model import positions
 
 
 # The ordering of these values does not matter.  We only use Enum so that
@@ -67,6 +68,28 @@ def did_bid_annotation(suit):
     )[suit.index]
 
 
+# The cheap facts about a history which RuleIndex buckets rules by, see
+# Precondition.fits_summary.  The per-position tuples are indexed by
+# position.index.
+class HistorySummary(object):
+    def __init__(self, openers, last_calls, last_call_annotations):
+        self.openers = openers
+        self.last_calls = last_calls
+        self.last_call_annotations = last_call_annotations
+
+    def _key(self):
+        return (self.openers, self.last_calls, self.last_call_annotations)
+
+    def __eq__(self, other):
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+
 # FIXME: Consider adding a CallPrecondition and HistoryPrecondition subclasses
 # which could then easily be filtered to the front of the preconditions list
 # for faster matching, or asserting about unreachable call_names, etc.
@@ -84,6 +107,12 @@ class Precondition(object):
     def fits(self, history, call):
         raise NotImplementedError
 
+    # Preconditions which only look at facts in a HistorySummary can answer
+    # here, letting RuleIndex skip the rule for every history with the same
+    # summary.  None means fits has to decide.
+    def fits_summary(self, summary):
+        return None
+
 
 class InvertedPrecondition(Precondition):
     repr_name = "Not"
@@ -98,6 +127,10 @@ class InvertedPrecondition(Precondition):
     def fits(self, history, call):
         return not self.precondition.fits(history, call)
 
+    def fits_summary(self, summary):
+        fits = self.precondition.fits_summary(summary)
+        return None if fits is None else not fits
+
 
 class SummaryPrecondition(Precondition):
     def __init__(self, *preconditions):
@@ -114,6 +147,12 @@ class EitherPrecondition(SummaryPrecondition):
     def fits(self, history, call):
         return any(precondition.fits(history, call) for precondition in self.preconditions)
 
+    def fits_summary(self, summary):
+        fits = [precondition.fits_summary(summary) for precondition in self.preconditions]
+        if True in fits:
+            return True
+        return None if None in fits else False
+
 
 class AndPrecondition(SummaryPrecondition):
     repr_name = "And"
@@ -121,11 +160,20 @@ class AndPrecondition(SummaryPrecondition):
     def fits(self, history, call):
         return all(precondition.fits(history, call) for precondition in self.preconditions)
 
+    def fits_summary(self, summary):
+        fits = [precondition.fits_summary(summary) for precondition in self.preconditions]
+        if False in fits:
+            return False
+        return None if None in fits else True
+
 
 class NoOpening(Precondition):
     def fits(self, history, call):
         return annotations.Opening not in history.annotations
 
+    def fits_summary(self, summary):
+        return not summary.openers
+
 
 class Opened(Precondition):
     def __init__(self, position):
@@ -138,11 +186,17 @@ class Opened(Precondition):
     def fits(self, history, call):
         return annotations.Opening in history.annotations_for_position(self.position)
 
+    def fits_summary(self, summary):
+        return self.position in summary.openers
+
 
 class TheyOpened(Precondition):
     def fits(self, history, call):
         return annotations.Opening in history.them.annotations
 
+    def fits_summary(self, summary):
+        return positions.LHO in summary.openers or positions.RHO in summary.openers
+
 
 # FIXME: Rename to NotrumpOpeningBook?
 class NotrumpSystemsOn(Precondition):
@@ -226,6 +280,9 @@ class LastBidHasAnnotation(Precondition):
     def fits(self, history, call):
         return self.annotation in history.view_for(self.position).annotations_for_last_call
 
+    def fits_summary(self, summary):
+        return self.annotation in summary.last_call_annotations[self.position.index]
+
 
 class LastBidHasStrain(Precondition):
     def __init__(self, position, strain_or_strains):
@@ -243,6 +300,10 @@ class LastBidHasStrain(Precondition):
         last_call = history.view_for(self.position).last_call
         return last_call and last_call.strain in self.strains
 
+    def fits_summary(self, summary):
+        last_call = summary.last_calls[self.position.index]
+        return bool(last_call and last_call.strain in self.strains)
+
 
 class LastBidHasSuit(Precondition):
     def __init__(self, position=None):
@@ -257,6 +318,12 @@ class LastBidHasSuit(Precondition):
         last_call = history.last_contract if not self.position else history.view_for(self.position).last_call
         return last_call and last_call.strain in suit.SUITS
 
+    def fits_summary(self, summary):
+        if not self.position:
+            return None
+        last_call = summary.last_calls[self.position.index]
+        return bool(last_call and last_call.strain in suit.SUITS)
+
 
 class LastBidHasLevel(Precondition):
     def __init__(self, position, level):
@@ -271,6 +338,10 @@ class LastBidHasLevel(Precondition):
         last_call = history.view_for(self.position).last_call
         return last_call and last_call.level == self.level
 
+    def fits_summary(self, summary):
+        last_call = summary.last_calls[self.position.index]
+        return bool(last_call and last_call.level == self.level)
+
 
 class LastBidWas(Precondition):
     def __init__(self, position, call_name):
@@ -285,6 +356,10 @@ class LastBidWas(Precondition):
         last_call = history.view_for(self.position).last_call
         return last_call and last_call.name == self.call_name
 
+    def fits_summary(self, summary):
+        last_call = summary.last_calls[self.position.index]
+        return bool(last_call and last_call.name == self.call_name)
+
 
 class RaiseOfPartnersLastSuit(Precondition):
     def fits(self, history, call):
@@ -30,6 +30,9 @@ def _decl_cmp(*args):
 
 def pretty_print_model(model):
     for decl in sorted(model.decls(), cmp=_decl_cmp):
+        # Skip the boolean literals model.AssumptionSolver guards queries with.
+        if not z3.is_int_value(model[decl]):
+            continue
         if model[decl].as_long() != 0:
             print "%s: %s" % (decl, model[decl])
 
@@ -67,6 +67,8 @@ class CompiledRule(object):
         self.priorities_per_call = priorities_per_call
         # FIXME: Should forcing be an annotation instead?  It has an awkward tri-state currently.
         self.forcing = self.dsl_rule.forcing
+        # Maps (call, history features) to the meaning_of list, see _meaning_key.
+        self._meanings = {}
 
     @property
     def all_priorities(self):
@@ -114,6 +116,9 @@ class CompiledRule(object):
             raise
         return True
 
+    def fits_summary(self, summary):
+        return all(precondition.fits_summary(summary) is not False for precondition in self.preconditions)
+
     def calls_over(self, history, expected_call=None):
         for call in history.legal_calls.intersection(self.known_calls):
             if self._fits_preconditions(history, call, expected_call):
@@ -127,22 +132,44 @@ class CompiledRule(object):
         exprs.extend(RuleCompiler.exprs_from_constraints(self.shared_constraints, history, call))
         return exprs
 
-    def meaning_of(self, history, call):
-        try:
-            exprs = self._constraint_exprs_for_call(history, call)
-            per_call_conditionals = self.conditional_priorities_per_call.get(call.name)
-            if per_call_conditionals:
-                for condition, priority in per_call_conditionals:
-                    condition_exprs = RuleCompiler.exprs_from_constraints(condition, history, call)
-                    yield priority, z3.And(exprs + condition_exprs)
-
-            for condition, priority in self.dsl_rule.conditional_priorities:
+    def _compile_meaning_of(self, history, call):
+        exprs = self._constraint_exprs_for_call(history, call)
+        per_call_conditionals = self.conditional_priorities_per_call.get(call.name)
+        if per_call_conditionals:
+            for condition, priority in per_call_conditionals:
                 condition_exprs = RuleCompiler.exprs_from_constraints(condition, history, call)
                 yield priority, z3.And(exprs + condition_exprs)
 
-            _, priority = self.per_call_constraints_and_priority(history, call)
-            assert priority
-            yield priority, z3.And(exprs)
+        for condition, priority in self.dsl_rule.conditional_priorities:
+            condition_exprs = RuleCompiler.exprs_from_constraints(condition, history, call)
+            yield priority, z3.And(exprs + condition_exprs)
+
+        _, priority = self.per_call_constraints_and_priority(history, call)
+        assert priority
+        yield priority, z3.And(exprs)
+
+    # The meaning of a call only depends on the history through the features
+    # its constraints declare, so histories which agree on those share the
+    # same exprs.  Returns None if some constraint can't be shared.
+    def _meaning_key(self, history, call):
+        per_call_constraints, _ = self.per_call_constraints_and_priority(history, call)
+        constraints = [per_call_constraints, self.shared_constraints]
+        constraints.extend(condition for condition, _ in self.conditional_priorities_per_call.get(call.name, []))
+        constraints.extend(condition for condition, _ in self.dsl_rule.conditional_priorities)
+        features = RuleCompiler.features_from_constraints(constraints, history, call)
+        if features is None:
+            return None
+        return call, features
+
+    def meaning_of(self, history, call):
+        try:
+            key = self._meaning_key(history, call)
+            meanings = self._meanings.get(key) if key else None
+            if meanings is None:
+                meanings = list(self._compile_meaning_of(history, call))
+                if key:
+                    self._meanings[key] = meanings
+            return meanings
         except:
             print "Exception compiling meaning_of %s over %s with %s" % (call, history.call_history.calls_string(), self)
             raise
@@ -166,6 +193,46 @@ class CompiledRule(object):
         return constraints_tuple
 
 
+# Buckets a system's rules by cheap discriminators so that RuleSelector only
+# has to run the preconditions of rules which could possibly apply: those
+# with a known call which is legal, and whose preconditions accept the
+# history's HistorySummary (who opened, and each position's last call and
+# its annotations).  Since the legal calls start above the last contract,
+# this also filters by level.
+class RuleIndex(object):
+    def __init__(self, rules):
+        self.rules = rules
+        self._rule_indices_by_call = {}
+        for index, rule in enumerate(rules):
+            for call in rule.known_calls:
+                self._rule_indices_by_call.setdefault(call, set()).add(index)
+        # Auctions reach relatively few distinct summaries, so this is
+        # filled lazily.
+        self._rule_indices_by_summary = {}
+
+    def _rule_indices_for_summary(self, summary):
+        rule_indices = self._rule_indices_by_summary.get(summary)
+        if rule_indices is None:
+            rule_indices = set(index for index, rule in enumerate(self.rules) if rule.fits_summary(summary))
+            self._rule_indices_by_summary[summary] = rule_indices
+        return rule_indices
+
+    def _rule_indices_for_call(self, call):
+        return self._rule_indices_by_call.get(call, ())
+
+    # Returns candidate rules in the same order as self.rules.
+    def rules_for(self, summary, legal_calls, expected_call=None):
+        rule_indices = set()
+        for call in legal_calls:
+            rule_indices.update(self._rule_indices_for_call(call))
+        rule_indices &= self._rule_indices_for_summary(summary)
+        # Rules for expected_call are always checked so that calls_over can
+        # explain which of their preconditions failed.
+        if expected_call:
+            rule_indices.update(self._rule_indices_for_call(expected_call))
+        return [self.rules[index] for index in sorted(rule_indices)]
+
+
 class RuleCompiler(object):
     @classmethod
     def exprs_from_constraints(cls, constraints, history, call):
@@ -180,6 +247,18 @@ class RuleCompiler(object):
 
         return chain.from_iterable([cls.exprs_from_constraints(constraint, history, call) for constraint in constraints])
 
+    # Mirrors exprs_from_constraints, collecting Constraint.history_features.
+    @classmethod
+    def features_from_constraints(cls, constraints, history, call):
+        if not constraints or isinstance(constraints, z3.ExprRef):
+            return ()
+
+        if isinstance(constraints, Constraint):
+            return constraints.history_features(history, call)
+
+        features = tuple(cls.features_from_constraints(constraint, history, call) for constraint in constraints)
+        return None if None in features else features
+
     @classmethod
     def _collect_from_ancestors(cls, dsl_class, property_name):
         getter = lambda ancestor: getattr(ancestor, property_name, [])
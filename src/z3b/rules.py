@@ -469,6 +469,9 @@ class ShapeForNegativeDouble(Constraint):
             '1S 2H': z3.And(clubs >= 3, diamonds >= 3),
         }[call_string]
 
+    def history_features(self, history, call):
+        return (history.partner.last_call, history.rho.last_call)
+
 
 class NegativeDouble(ResponseToOneLevelSuitedOpen):
     call_names = 'X'
@@ -1209,6 +1212,9 @@ class SufficientPointsForFourthSuitForcing(Constraint):
     def expr(self, history, call):
         return points >= max(0, points_for_sound_notrump_bid_at_level[call.level] - history.partner.min_points)
 
+    def history_features(self, history, call):
+        return (call.level, history.partner.min_points)
+
 
 fourth_suit_forcing = enum.Enum(
     "TwoLevel",
@@ -1283,6 +1289,9 @@ class StopperInFouthSuit(Constraint):
         strain = history.partner.last_call.strain
         return stopper_expr_for_suit(strain)
 
+    def history_features(self, history, call):
+        return (history.partner.last_call.strain,)
+
 
 class NotrumpResponseToFourthSuitForcing(ResponseToFourthSuitForcing):
     preconditions = NotJumpFromLastContract()
@@ -1509,6 +1518,9 @@ class QuantitativeFourNotrumpJumpConstraint(Constraint):
         # Invites opener to bid 6N if at a maxium, otherwise pass.
         return points + history.partner.max_points >= 33
 
+    def history_features(self, history, call):
+        return (history.partner.max_points,)
+
 
 class QuantitativeFourNotrumpJump(NotrumpResponse):
     call_names = '4N'
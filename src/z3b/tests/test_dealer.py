@@ -0,0 +1,65 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import random
+import unittest2
+import z3
+from core.callhistory import CallHistory
+from z3b import model
+from z3b.bidder import Interpreter, SolverPool
+from z3b.dealer import Dealer, HandSampler
+from z3b.model import positions
+
+
+class DealerTest(unittest2.TestCase):
+    def _history(self, calls_string):
+        return Interpreter().create_history(CallHistory.from_string(calls_string))
+
+    def _assert_fits(self, hand, constraints):
+        solver = z3.SolverFor('QF_LIA')
+        solver.add(model.axioms)
+        solver.add(model.expr_for_hand(hand))
+        solver.add(constraints)
+        self.assertEquals(solver.check(), z3.sat, "%s does not fit %s" % (hand.pretty_one_line(), constraints))
+
+    def test_hands_fit_history(self):
+        history = self._history("1N P 2C P")
+        dealer = Dealer(history, random.Random(1))
+        # The next call is the 1N opener's, answering Stayman.
+        self.assertEquals(history.me.min_points, 15)
+        for position in positions:
+            constraints = history.constraints_for_position(position)
+            for _ in range(5):
+                self._assert_fits(dealer.random_hand(position), constraints)
+
+    def test_opener_hands(self):
+        sampler = HandSampler(self._history("1N P 2C P").constraints_for_position(positions.Me), random.Random(2))
+        for _ in range(10):
+            hand = sampler.random_hand()
+            self.assertTrue(15 <= hand.high_card_points() <= 17)
+            self.assertTrue(hand.is_balanced())
+
+    def test_deals_use_every_card_once(self):
+        history = self._history("1N P 2C P")
+        dealer = Dealer(history, random.Random(3))
+        for _ in range(5):
+            deal = dealer.random_deal()
+            card_masks = [hand.card_mask for hand in deal.hands]
+            self.assertEquals(reduce(lambda left, right: left | right, card_masks), (1 << 52) - 1)
+            self.assertEquals(sum(bin(card_mask).count('1') for card_mask in card_masks), 52)
+            # Each hand is the one dealt for its position in the auction.
+            opener = deal.hand_for(history.call_history.position_to_call())
+            self._assert_fits(opener, history.constraints_for_position(positions.Me))
+            for position in positions:
+                self._assert_fits(deal.hand_for(dealer._core_position(position)), history.constraints_for_position(position))
+
+    def test_solvers_come_from_the_pool(self):
+        constraints = self._history("1N P 2C P").constraints_for_position(positions.Me)
+        expected_shapes = HandSampler(constraints).shapes
+        for configuration_name in ['lia', 'bv']:
+            solver_pool = SolverPool(configuration=model.solver_configurations[configuration_name])
+            sampler = HandSampler(constraints, random.Random(4), solver_pool=solver_pool)
+            self.assertEquals(sampler.shapes, expected_shapes)
+            self.assertEquals(solver_pool.stats()['borrows'], 1)
+            self.assertEquals(solver_pool.stats()['outstanding'], 0)
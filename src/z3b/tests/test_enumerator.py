@@ -0,0 +1,106 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import operator
+import unittest2
+import z3
+from z3b import model
+from z3b.model import spades, hearts, diamonds, clubs, high_card_points, points, playing_points, ace_of_spades, king_of_spades, queen_of_hearts, number_of_aces
+
+try:
+    from z3b import enumerator
+except ImportError:
+    # The enumerator needs numpy.
+    enumerator = None
+
+
+def _choose(n, k):
+    if k < 0 or k > n:
+        return 0
+    return reduce(operator.mul, range(n - k + 1, n + 1), 1) / reduce(operator.mul, range(1, k + 1), 1)
+
+
+def _z3_solver(constraints):
+    solver = z3.Solver()
+    solver.add(model.axioms)
+    solver.add(constraints)
+    return solver
+
+
+def _hand_set_solver(constraints):
+    solver = enumerator.HandSetSolver()
+    solver.add(constraints)
+    return solver
+
+
+# (expr, floor, ceiling) for every bound History solves for.
+_bounds = [
+    (spades, 0, 13),
+    (hearts, 0, 13),
+    (diamonds, 0, 13),
+    (clubs, 0, 13),
+    (high_card_points, 0, 37),
+    (points, 0, 37),
+    (playing_points, 0, 55),
+    (number_of_aces, 0, 4),
+]
+
+# Honor constraints are checked hand by hand, so these keep to a few shapes
+# to keep the test quick.
+_constraint_sets = [
+    [spades >= 5, high_card_points >= 12, high_card_points <= 21],
+    [hearts + spades >= 9, clubs <= 1],
+    [ace_of_spades == 1, king_of_spades == 1, spades == 3, hearts >= 5],
+    [number_of_aces >= 3, queen_of_hearts == 0, hearts == 2, spades >= 5],
+    [playing_points >= 22, high_card_points <= 15, spades >= 5],
+    [playing_points <= 14, spades >= 6, ace_of_spades + king_of_spades == 2],
+    [model.stopper_spades, spades <= 2, hearts >= 5, high_card_points <= 3],
+    [model.two_of_the_top_three_spades, model.points_supporting_spades >= 18, diamonds == 0],
+]
+
+
+@unittest2.skipIf(enumerator is None, "z3b.enumerator needs numpy")
+class EnumeratorTest(unittest2.TestCase):
+    def test_hand_count(self):
+        self.assertEqual(enumerator.hand_count([]), _choose(52, 13))
+        self.assertEqual(enumerator.hand_count([spades == 13]), 1)
+        self.assertEqual(enumerator.hand_count([spades >= 5]), sum(_choose(13, length) * _choose(39, 13 - length) for length in range(5, 14)))
+        self.assertEqual(enumerator.hand_count([spades == 4, hearts == 4, diamonds == 4]), _choose(13, 4) ** 3 * 13)
+        self.assertEqual(enumerator.hand_count([ace_of_spades == 1, king_of_spades == 0, spades == 2]), 11 * _choose(39, 11))
+        self.assertEqual(enumerator.hand_count([ace_of_spades == 1, spades == 5, hearts == 4]), _choose(12, 4) * _choose(13, 4) * _choose(26, 4))
+        self.assertEqual(enumerator.hand_count([number_of_aces == 4, spades == 4, hearts == 3, diamonds == 3]), _choose(12, 3) * _choose(12, 2) ** 3)
+        # Every ace, king and queen and one of the jacks.
+        self.assertEqual(enumerator.hand_count([high_card_points == 37]), 4)
+        # playing_points only has to be possible for a hand to be counted.
+        self.assertEqual(enumerator.hand_count([playing_points >= 20]), enumerator.hand_count([]))
+        self.assertEqual(enumerator.hand_count([playing_points <= 3]), enumerator.hand_count([high_card_points <= 3]))
+
+    def test_is_possible_matches_z3(self):
+        for constraints in _constraint_sets:
+            z3_solver = _z3_solver(constraints)
+            hand_set_solver = _hand_set_solver(constraints)
+            for expr in [spades >= 8, hearts == 0, high_card_points >= 20, playing_points >= 30, playing_points <= high_card_points + 2,
+                    ace_of_spades == 0, z3.And(king_of_spades == 1, spades == 1), model.third_round_stopper_spades]:
+                self.assertEqual(hand_set_solver.is_possible(expr), model.is_possible(z3_solver, expr), "%s with %s" % (expr, constraints))
+
+    def test_solve_for_bounds_matches_z3(self):
+        minimize = [(expr, floor) for expr, floor, _ in _bounds]
+        maximize = [(expr, ceiling) for expr, _, ceiling in _bounds]
+        for constraints in _constraint_sets:
+            expected = model.solve_for_bounds(_z3_solver(constraints), minimize, maximize)
+            self.assertEqual(_hand_set_solver(constraints).solve_for_bounds(minimize, maximize), expected, constraints)
+
+    def test_unsatisfiable(self):
+        hand_set_solver = _hand_set_solver([spades >= 7, hearts >= 7])
+        self.assertEqual(hand_set_solver.check(), z3.unsat)
+        self.assertEqual(hand_set_solver.solve_for_bounds([(spades, 0)], [(spades, 13)]), None)
+        self.assertEqual(enumerator.hand_count([ace_of_spades == 1, spades == 0]), 0)
+
+    def test_push_pop(self):
+        hand_set_solver = _hand_set_solver([spades >= 5])
+        hand_set_solver.push()
+        hand_set_solver.add(hearts >= 5, high_card_points >= 10)
+        self.assertFalse(hand_set_solver.is_possible(spades >= 9))
+        hand_set_solver.pop()
+        self.assertTrue(hand_set_solver.is_possible(spades >= 9))
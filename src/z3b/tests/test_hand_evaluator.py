@@ -0,0 +1,152 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import random
+import unittest2
+import z3
+from core.callhistory import CallHistory
+from core.card import Card
+from core.hand import Hand
+from core.suit import SUITS
+from z3b import bidder, hand_evaluator, model
+from z3b.model import spades, hearts, diamonds, clubs, high_card_points, points, playing_points, ace_of_spades, king_of_hearts, doubletons, voids
+
+
+def _random_hand(random_state):
+    cards_by_suit_index = ["" for suit in SUITS]
+    for card_identifier in random_state.sample(range(52), 13):
+        suit, card = Card.suit_and_value_from_identifier(card_identifier)
+        cards_by_suit_index[suit.index] += card
+    return Hand(cards_by_suit_index)
+
+
+# Random hands are rarely this short anywhere, and support points are all
+# about shortness.
+_shapely_hands = map(Hand.from_cdhs_string, [
+    'AKQJT98765432...',
+    '.AKQ5432.KQ32.A2',
+    '2.AKJ5432..KQ432',
+    'Q2.K2.AJ32.KJ432',
+])
+
+
+def _hands(count, seed):
+    random_state = random.Random(seed)
+    return _shapely_hands + [_random_hand(random_state) for _ in range(count)]
+
+
+def _solver_for_hand(hand):
+    solver = z3.Solver()
+    solver.add(model.axioms)
+    solver.add(model.expr_for_hand(hand))
+    return solver
+
+
+def _variables():
+    variables = [getattr(model, name) for name in ('high_card_points', 'points', 'voids', 'singletons', 'doubletons')]
+    for suit in SUITS:
+        suit_name = suit.name.lower()
+        variables.append(model.expr_for_suit(suit))
+        variables.append(z3.Int('points_supporting_' + suit_name))
+        variables.extend(z3.Int("%s_of_%s" % (honor_name, suit_name)) for honor_name in model._honor_names)
+        variables.extend(z3.Int("%s_in_%s" % (count_name, suit_name)) for count_name in ('void', 'singleton', 'doubleton'))
+    return variables
+
+
+# A few meanings of every call the bidder might make over these.
+_auctions = ["", "1C P", "1N P", "1S 2H", "1D X", "1H P 2H P"]
+
+
+def _rule_meanings():
+    interpreter = bidder.Interpreter()
+    meanings = []
+    for calls_string in _auctions:
+        history = interpreter.create_history(CallHistory.from_string(calls_string))
+        selector = bidder.RuleSelector(interpreter.system, history)
+        for call in sorted(selector._call_to_rule):
+            meanings.extend(meaning for _, meaning in selector._meaning_of(call))
+            meanings.append(selector.constraints_for_call(call))
+    return meanings
+
+
+class HandEvaluatorTest(unittest2.TestCase):
+    def _assert_agrees_with_z3(self, exprs, hands):
+        for hand in hands:
+            values = hand_evaluator.values_for_hand(hand)
+            solver = _solver_for_hand(hand)
+            for expr in exprs:
+                compiled = hand_evaluator.compile_expr(expr)
+                self.assertIsNotNone(compiled)
+                # Printing a meaning is slow, so only do it for failures.
+                if compiled.is_possible(values) != model.is_possible(solver, expr):
+                    self.fail("hand_evaluator disagrees with z3 about %s for %s" % (expr, hand.pretty_one_line()))
+
+    def test_values_match_z3(self):
+        for hand in _hands(20, 1):
+            values = hand_evaluator.values_for_hand(hand)
+            solver = _solver_for_hand(hand)
+            self.assertEqual(solver.check(), z3.sat)
+            z3_model = solver.model()
+            for variable in _variables():
+                self.assertEqual(values[str(variable)], z3_model.eval(variable).as_long(), "%s for %s" % (variable, hand.pretty_one_line()))
+            # Only playing_points is left open by the axioms.
+            self.assertTrue(model.is_possible(solver, playing_points == values['high_card_points']))
+            self.assertTrue(model.is_possible(solver, playing_points == 55))
+
+    def test_support_points(self):
+        self.assertEqual(hand_evaluator._support_points(2, 12, 1, 1, 1), 12)
+        self.assertEqual(hand_evaluator._support_points(3, 12, 1, 0, 0), 13)
+        self.assertEqual(hand_evaluator._support_points(3, 12, 1, 1, 1), 18)
+        self.assertEqual(hand_evaluator._support_points(4, 12, 1, 1, 0), 16)
+        self.assertEqual(hand_evaluator._support_points(5, 12, 2, 0, 1), 19)
+
+    def test_operators_match_z3(self):
+        exprs = [
+            z3.And(spades >= 4, hearts < 3),
+            z3.Or(spades == 0, clubs > 6, doubletons >= 2),
+            z3.Not(diamonds <= 2),
+            z3.Implies(ace_of_spades == 1, spades >= 3),
+            z3.If(spades > hearts, high_card_points >= 12, high_card_points <= 9),
+            z3.Distinct(spades, hearts, diamonds),
+            -spades + hearts >= 0,
+            spades + hearts - diamonds * 2 >= 3,
+            z3.Xor(spades >= 4, hearts >= 4),
+            (spades >= 4) == (king_of_hearts == 1),
+            z3.BoolVal(True),
+            z3.Not(z3.BoolVal(False)),
+            points + voids * 3 >= 14,
+            playing_points >= 22,
+            z3.And(playing_points <= 14, playing_points >= high_card_points + 2),
+            model.points_supporting_spades >= 16,
+            model.third_round_stopper_spades,
+        ]
+        self._assert_agrees_with_z3(exprs, _hands(10, 2))
+
+    def test_rule_meanings_match_z3(self):
+        self._assert_agrees_with_z3(_rule_meanings(), _hands(6, 3))
+
+    def test_unsupported_expressions(self):
+        for expr in [spades / 2 >= 2, spades % 2 == 0, z3.And(hearts >= 5, z3.ToReal(spades) / 2 >= 2)]:
+            self.assertRaises(hand_evaluator.UnsupportedExpression, hand_evaluator._compile_uncached, expr)
+            # The bidder asks a solver instead.
+            self.assertIsNone(hand_evaluator.compile_expr(expr))
+
+    def test_bidder_falls_back_to_solver(self):
+        interpreter = bidder.Interpreter()
+        hands = _hands(6, 4)
+        for calls_string in _auctions:
+            history = interpreter.create_history(CallHistory.from_string(calls_string))
+            compiled_selector = bidder.RuleSelector(interpreter.system, history)
+            solver_selector = bidder.RuleSelector(interpreter.system, history)
+            compile_expr = hand_evaluator.compile_expr
+            # As if no meaning could be compiled.
+            hand_evaluator.compile_expr = lambda expr: None
+            try:
+                self.assertTrue(all(compiled is None for _, _, _, compiled in solver_selector._calls_priorities_and_meanings))
+            finally:
+                hand_evaluator.compile_expr = compile_expr
+            for hand in hands:
+                self.assertEqual(solver_selector.possible_calls_for_hand(hand, None).maximal_calls_and_priorities(),
+                    compiled_selector.possible_calls_for_hand(hand, None).maximal_calls_and_priorities(),
+                    "%s over %s" % (hand.pretty_one_line(), calls_string))
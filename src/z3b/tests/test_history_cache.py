@@ -0,0 +1,119 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest2
+from core.callhistory import CallHistory
+from z3b import bidder
+from z3b.bidder import HistoryCache
+from z3b.model import positions
+
+
+# Stands in for a History: all HistoryCache needs is its calls, and to be able
+# to hand back its solver when evicted.
+class FakeHistory(object):
+    def __init__(self, calls_string):
+        self.call_history = CallHistory.from_string(calls_string)
+        self.released = False
+
+    def _release_solver(self):
+        self.released = True
+
+
+def _calls(calls_string):
+    return CallHistory.from_string(calls_string).calls
+
+
+class HistoryCacheTest(unittest2.TestCase):
+    def _lookup(self, cache, calls_string):
+        history, remaining_calls = cache.lookup(CallHistory.from_string(calls_string))
+        return history, map(str, remaining_calls)
+
+    def _stats(self, cache):
+        return cache.hits, cache.partial_hits, cache.misses, cache.evictions
+
+    def test_lookup_along_shared_prefix(self):
+        cache = HistoryCache()
+        one_club = FakeHistory("1C")
+        one_club_pass_one_heart = FakeHistory("1C P 1H")
+        cache.add(one_club)
+        cache.add(one_club_pass_one_heart)
+
+        self.assertIs(self._lookup(cache, "1C")[0], one_club)
+        self.assertEqual(self._lookup(cache, "1C P"), (one_club, ['P']))
+        self.assertEqual(self._lookup(cache, "1C P 1H"), (one_club_pass_one_heart, []))
+        # The longest cached prefix wins.
+        self.assertEqual(self._lookup(cache, "1C P 1H P 1S"), (one_club_pass_one_heart, ['P', '1S']))
+        self.assertEqual(self._lookup(cache, "1C P 1S"), (one_club, ['P', '1S']))
+
+        history, remaining_calls = self._lookup(cache, "1D P")
+        self.assertNotIn(history, (one_club, one_club_pass_one_heart))
+        self.assertEqual(remaining_calls, ['1D', 'P'])
+
+    def test_counters(self):
+        cache = HistoryCache()
+        cache.add(FakeHistory("1C P"))
+        self._lookup(cache, "1C P")
+        self._lookup(cache, "1C P 1H")
+        self._lookup(cache, "1C P 1H P")
+        self._lookup(cache, "1C")
+        self._lookup(cache, "1D")
+        self.assertEqual(self._stats(cache), (1, 2, 2, 0))
+
+        cache.reset_stats()
+        self.assertEqual(self._stats(cache), (0, 0, 0, 0))
+        self.assertEqual(len(cache), 1)
+
+    def test_eviction_is_least_recently_used(self):
+        cache = HistoryCache(size_limit=2)
+        one_club = FakeHistory("1C")
+        one_diamond = FakeHistory("1D")
+        one_heart = FakeHistory("1H")
+        cache.add(one_club)
+        cache.add(one_diamond)
+        # Looking 1C up makes 1D the least recently used.
+        self._lookup(cache, "1C P")
+        cache.add(one_heart)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(one_diamond.released)
+        self.assertFalse(one_club.released)
+        self.assertFalse(one_heart.released)
+        self.assertIs(self._lookup(cache, "1C")[0], one_club)
+        self.assertIs(self._lookup(cache, "1H")[0], one_heart)
+        self.assertEqual(self._lookup(cache, "1D")[1], ['1D'])
+
+        # Adding a History again counts as using it.
+        cache.add(one_heart)
+        cache.add(FakeHistory("1S"))
+        self.assertTrue(one_club.released)
+        self.assertFalse(one_heart.released)
+
+    def test_eviction_prunes_empty_nodes(self):
+        cache = HistoryCache(size_limit=2)
+        cache.add(FakeHistory("1C"))
+        cache.add(FakeHistory("1C P 1H P"))
+        cache.add(FakeHistory("1D"))
+
+        # 1C was evicted, but 1C P 1H P still needs its node.
+        self.assertEqual(sorted(map(str, cache._root.children)), ['1C', '1D'])
+        one_club = cache._root.children[_calls("1C")[0]]
+        self.assertIsNone(one_club.history)
+        self.assertEqual(map(str, one_club.children), ['P'])
+
+        # Evicting 1C P 1H P takes the whole branch with it.
+        cache.add(FakeHistory("1H"))
+        self.assertEqual(sorted(map(str, cache._root.children)), ['1D', '1H'])
+
+    def test_eviction_restores_solver(self):
+        solver_pool = bidder._current_solver_pool()
+        history = bidder.Interpreter().create_history(CallHistory.from_string("1N P"))
+        history.solve_all_bounds_for_position(positions.RHO)
+        outstanding = solver_pool.stats()['outstanding']
+        self.assertGreater(outstanding, 0)
+
+        cache = HistoryCache(size_limit=0)
+        cache.add(history)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(solver_pool.stats()['outstanding'], outstanding - 1)
@@ -0,0 +1,62 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest2
+from core.callhistory import CallHistory
+from z3b import bidder
+from z3b.interpretation_cache import InterpretationCache
+from z3b.model import positions
+
+
+def _lookup(path, calls_string):
+    cached = InterpretationCache(path).lookup(calls_string)
+    if not cached:
+        return None
+    return cached.rule_name, sorted(annotation.key for annotation in cached.annotations), cached.constraints.sexpr(), cached.bounds
+
+
+class InterpretationCacheTest(unittest2.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'interpretations.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        cache = InterpretationCache(self.path)
+        self.assertIsNone(cache.lookup("1N"))
+
+        history = bidder.Interpreter().create_history(CallHistory.from_string("1N"))
+        history.solve_all_bounds_for_position(positions.RHO)
+        cache.add("1N", history)
+
+        # A new process has to open its own connection.
+        pool = multiprocessing.Pool(1)
+        rule_name, annotation_keys, constraints, bounds = pool.apply(_lookup, (self.path, "1N"))
+        pool.terminate()
+        self.assertEquals(rule_name, history._rule_for_last_call.name)
+        self.assertEquals(annotation_keys, sorted(annotation.key for annotation in history._annotations_for_last_call))
+        self.assertEquals(constraints, history._constraints_for_last_call.sexpr())
+        self.assertEquals(bounds, history._bounds)
+        self.assertEquals(bounds[(None, False)], 15)
+
+    def test_other_version_misses(self):
+        history = bidder.Interpreter().create_history(CallHistory.from_string("1N"))
+        InterpretationCache(self.path, version="old").add("1N", history)
+        self.assertIsNone(InterpretationCache(self.path).lookup("1N"))
+
+    def test_threads_open_their_own_connections(self):
+        cache = InterpretationCache(self.path)
+        cache.lookup("1N")
+        results = []
+        thread = threading.Thread(target=lambda: results.append(cache.lookup("1N")))
+        thread.start()
+        thread.join()
+        self.assertEquals(results, [None])
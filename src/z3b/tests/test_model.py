@@ -0,0 +1,48 @@
+# Copyright (c) 2013 The SAYCBridge Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest2
+import z3
+from z3b import model
+from z3b.model import spades, hearts, clubs, high_card_points, playing_points, points_supporting_spades, ace_of_spades
+
+
+def _solver(configuration_name):
+    configuration = model.solver_configurations[configuration_name]
+    solver = configuration.solver()
+    translator = configuration.translator()
+    if translator:
+        solver = model.ContextSolver(translator, solver)
+    solver.add(model.axioms)
+    return solver
+
+
+_bit_vec_configurations = sorted(name for name, configuration in model.solver_configurations.items() if configuration.encoding == 'bitvec')
+
+
+class SolverConfigurationTest(unittest2.TestCase):
+    def test_bit_vectors_do_not_wrap(self):
+        for name in _bit_vec_configurations:
+            solver = _solver(name)
+            self.assertFalse(model.is_possible(solver, z3.And(spades >= 7, hearts >= 7)), name)
+            self.assertFalse(model.is_possible(solver, spades + hearts + clubs > 13), name)
+            self.assertFalse(model.is_possible(solver, playing_points > 55), name)
+
+    def test_bounds_match_int_encoding(self):
+        minimize = [(spades, 0), (high_card_points, 0), (points_supporting_spades, 0)]
+        maximize = [(spades, 13), (high_card_points, 37), (points_supporting_spades, 100)]
+        for constraints in [[], [hearts >= 5, ace_of_spades == 1], [spades >= 4, playing_points <= 12]]:
+            expected = None
+            for name in ['lia'] + _bit_vec_configurations:
+                solver = _solver(name)
+                solver.add(constraints)
+                bounds = model.solve_for_bounds(solver, minimize, maximize)
+                if expected is None:
+                    expected = bounds
+                self.assertEqual(bounds, expected, "%s with %s" % (name, constraints))
+
+    def test_unbounded_variable(self):
+        translator = model.BitVecTranslator(10)
+        with self.assertRaises(AssertionError):
+            translator.translate(z3.Int('unknown') >= 1)